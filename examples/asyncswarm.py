@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Example of several Crazyflies driven from one event loop using the asyncio
+front-end (cflib.crazyflie.asyncapi, needs trollius). Every Crazyflie is
+connected, a parameter is read and set and the roll and pitch are logged
+for a few seconds, all at the same time. Usage:
+
+    asyncswarm.py [seconds] [URI ...]
+
+Without URIs four simulated Crazyflies (debug driver) are used.
+"""
+
+import sys
+sys.path.append("../lib")
+
+import logging
+import time
+
+import trollius as asyncio
+from trollius import From
+
+import cflib.crtp
+from cflib.crazyflie.asyncapi import AsyncCrazyflie
+from cflib.crazyflie.log import LogConfig
+
+# Only output errors from the logging framework
+logging.basicConfig(level=logging.ERROR)
+
+
+@asyncio.coroutine
+def fly(loop, uri, duration):
+    """Connect to one Crazyflie, use its parameters and log it"""
+    cf = AsyncCrazyflie(loop=loop)
+    start = time.time()
+    yield From(cf.connect(uri))
+    print "%s: connected in %.2fs" % (uri, time.time() - start)
+
+    cid = yield From(cf.param.get("info.cid"))
+    prp = yield From(cf.param.set("rpid.prp", "5"))
+    print "%s: info.cid=%s rpid.prp=%s" % (uri, cid, prp)
+
+    config = LogConfig("Stabilizer", 10)
+    config.add_variable("stabilizer.roll", "float")
+    config.add_variable("stabilizer.pitch", "float")
+    stream = cf.log.stream(config)
+    samples = 0
+    end = loop.time() + duration
+    while loop.time() < end:
+        try:
+            sample = yield From(asyncio.wait_for(stream.get(),
+                                                 end - loop.time()))
+        except asyncio.TimeoutError:
+            break
+        if sample is None:
+            break
+        samples += 1
+    stream.close()
+    cf.close()
+    print "%s: %d samples in %.1fs, %d dropped" % (uri, samples, duration,
+                                                 stream.dropped)
+
+if __name__ == '__main__':
+    duration = 3.0
+    uris = ["debug://0/0"] * 4
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        uris = sys.argv[2:]
+
+    cflib.crtp.init_drivers(enable_debug_driver=True)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(asyncio.wait(
+        [fly(loop, uri, duration) for uri in uris], loop=loop))
+    loop.close()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Benchmark of reading and writing all the parameters of a Crazyflie with
+different numbers of requests in flight at the same time. By default the
+simulated Crazyflie of the debug driver that delays its answers randomly
+(0-250ms) is used. Usage:
+
+    parambenchmark.py [URI] [window ...]
+"""
+
+import sys
+sys.path.append("../lib")
+
+import logging
+import time
+import threading
+
+import cflib.crtp
+from cflib.crazyflie import Crazyflie
+
+# Only output errors from the logging framework
+logging.basicConfig(level=logging.ERROR)
+
+
+def run(uri, window):
+    """Connect and return the time it takes to read all the parameters and
+    to write all the writable ones (seconds)"""
+    cf = Crazyflie(param_window=window)
+    connected = threading.Event()
+    cf.connected.add_callback(lambda uri: connected.set())
+    cf.open_link(uri)
+    connected.wait(60)
+
+    done = threading.Event()
+    result = {}
+
+    def finished(values):
+        result.update(values)
+        done.set()
+
+    start = time.time()
+    cf.param.read_all(finished)
+    done.wait(60)
+    read_time = time.time() - start
+
+    writable = dict((name, value) for (name, value) in result.items()
+                    if cf.param.toc.get_element_by_complete_name(
+                        name).get_readable_access() == "RW")
+    done.clear()
+    start = time.time()
+    cf.param.write_many(writable, finished)
+    done.wait(60)
+    write_time = time.time() - start
+
+    cf.close_link()
+    return (len(result), read_time, len(writable), write_time)
+
+if __name__ == '__main__':
+    uri = "debug://0/3"
+    windows = [1, 5, 10]
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    if len(sys.argv) > 2:
+        windows = [int(w) for w in sys.argv[2:]]
+
+    cflib.crtp.init_drivers(enable_debug_driver=True)
+    for window in windows:
+        (read, read_time, written, write_time) = run(uri, window)
+        print ("window=%-3d read %d params in %.2fs, wrote %d params in "
+               "%.2fs" % (window, read, read_time, written, write_time))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Benchmark of the throughput of the Crazyradio link driver using a simulated
+dongle and Crazyflie (cflib.drivers.mockradio), so no hardware is needed.
+
+The uplink is saturated by sending commander packets as fast as possible
+and the simulated Crazyflie answers every packet with a full log data
+packet. The number of packets per second in both directions is reported
+for different batch sizes of the radio thread. Usage:
+
+    radiobenchmark.py [seconds] [usb latency in ms] [batch size ...]
+"""
+
+import sys
+sys.path.append("../lib")
+
+import logging
+import time
+import struct
+import threading
+
+from cflib.crtp.radiodriver import RadioDriver
+from cflib.crtp.crtpstack import CRTPPacket, CRTPPort
+from cflib.drivers import crazyradio
+from cflib.drivers.crazyradio import Crazyradio
+from cflib.drivers.mockradio import MockCrazyradioDevice, SimulatedCopter
+
+# Only output errors from the logging framework
+logging.basicConfig(level=logging.ERROR)
+
+
+def run(batch_size, duration, usb_latency):
+    """Run the link for duration seconds and return the number of packets
+    per second (uplink, downlink)"""
+    log_packet = [0x52] + [0] * 31
+    copter = SimulatedCopter(channel=80, datarate=Crazyradio.DR_2MPS,
+                             downlink=log_packet)
+    devid = crazyradio.add_simulated_device(
+        MockCrazyradioDevice([copter], usb_latency=usb_latency))
+
+    driver = RadioDriver(batch_size=batch_size)
+    driver.connect("radio://{}/80/2M".format(devid), None, None)
+
+    running = [True]
+    received = [0]
+
+    def receiver():
+        while running[0]:
+            if driver.receive_packet(0.1) is not None:
+                received[0] += 1
+
+    receive_thread = threading.Thread(target=receiver)
+    receive_thread.start()
+
+    pk = CRTPPacket()
+    pk.port = CRTPPort.COMMANDER
+    pk.data = struct.pack('<fffH', 0, 0, 0, 0)
+    start = time.time()
+    while time.time() - start < duration:
+        driver.send_packet(pk)
+    elapsed = time.time() - start
+    uplink = copter.packets_received
+    downlink = received[0]
+
+    running[0] = False
+    receive_thread.join()
+    driver.close()
+    crazyradio.remove_simulated_devices()
+    return (uplink / elapsed, downlink / elapsed)
+
+if __name__ == '__main__':
+    duration = 3.0
+    usb_latency = 0.0
+    batch_sizes = [1, 4, 16]
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        usb_latency = float(sys.argv[2]) / 1000.0
+    if len(sys.argv) > 3:
+        batch_sizes = [int(b) for b in sys.argv[3:]]
+
+    print "Radio link throughput, simulated USB latency %.2fms" % (
+        usb_latency * 1000)
+    for batch_size in batch_sizes:
+        (uplink, downlink) = run(batch_size, duration, usb_latency)
+        print "batch=%-3d uplink=%7.0f packets/s downlink=%7.0f packets/s" % (
+            batch_size, uplink, downlink)
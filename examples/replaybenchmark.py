@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Benchmark of the whole library pipeline (packet dispatching, TOC download
+and log data decoding) on a recorded session, so it's reproducible and no
+Crazyflie is needed.
+
+A session is first recorded with the debug driver: the connection setup and
+a few seconds of logging of three log blocks at 100 Hz. It's then played
+back with the replay driver at each of the given speeds (0 means as fast
+as possible), each time in a new process so the log blocks get the same
+ids as when recording. The number of packets per second processed and the
+number of log samples decoded are reported. Usage:
+
+    replaybenchmark.py [seconds] [speed ...]
+"""
+
+import sys
+sys.path.append("../lib")
+
+import os
+import logging
+import subprocess
+import tempfile
+import time
+import threading
+
+import cflib.crtp
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.log import LogConfig
+from cflib.crtp.replaydriver import SessionRecorder
+
+# Only output errors from the logging framework
+logging.basicConfig(level=logging.ERROR)
+
+BLOCKS = [("Stabilizer", ["stabilizer.roll", "stabilizer.pitch",
+                          "stabilizer.yaw"]),
+          ("Gyro", ["imu.gyro_x", "imu.gyro_y", "imu.gyro_z"]),
+          ("Accel", ["imu.acc_x", "imu.acc_y", "imu.acc_z"])]
+
+
+def start_logging(cf, samples):
+    """Start logging the blocks, counting the samples in samples[0]"""
+    def count(timestamp, data, logconf):
+        samples[0] += 1
+
+    for (name, variables) in BLOCKS:
+        config = LogConfig(name, 10)
+        for variable in variables:
+            config.add_variable(variable)
+        cf.log.add_config(config)
+        config.data_received_cb.add_callback(count)
+        config.start()
+
+
+def record(filename, seconds):
+    """Record a session of seconds seconds to filename, return the number
+    of samples and packets recorded"""
+    cf = Crazyflie()
+    recorder = SessionRecorder(cf, filename)
+    recorder.start()
+    connected = threading.Event()
+    cf.connected.add_callback(lambda uri: connected.set())
+    cf.open_link("debug://0/0")
+    connected.wait(60)
+    samples = [0]
+    start_logging(cf, samples)
+    time.sleep(seconds)
+    recorder.stop()
+    cf.close_link()
+    return (samples[0], recorder.packets)
+
+
+def replay(filename, speed):
+    """Replay the session in filename at speed, print the samples decoded,
+    the time it took to connect and the packets received and time it took
+    after that"""
+    cf = Crazyflie()
+    connected = threading.Event()
+    cf.connected.add_callback(lambda uri: connected.set())
+    # The incoming packet thread polls for a link every second, so let it
+    # see the link before starting the clock
+    cf.link = cflib.crtp.get_link_driver(
+        "replay://%s?speed=%s" % (filename, speed), None, None)
+    time.sleep(1.1)
+    start = time.time()
+    cf._start_connection_setup()
+    connected.wait(60)
+    connect_time = time.time() - start
+    connect_packets = cf.get_link_statistics()["packets_in"]
+    start = time.time()
+    samples = [0]
+    start_logging(cf, samples)
+    # Wait until all the packets are played back and received
+    while True:
+        stats = cf.get_link_statistics()
+        if cf.link.get_status() == "Finished" and not stats["in_queue"]:
+            break
+        time.sleep(0.001)
+    elapsed = time.time() - start
+    # Let the incoming thread handle the last packet
+    time.sleep(0.1)
+    print samples[0], connect_time, stats["packets_in"] - connect_packets, \
+        elapsed
+    cf.close_link()
+
+
+if __name__ == '__main__':
+    cflib.crtp.init_drivers(enable_debug_driver=True)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--replay":
+        replay(sys.argv[2], float(sys.argv[3]))
+        os._exit(0)
+
+    seconds = 5
+    speeds = [1, 10, 0]
+    if len(sys.argv) > 1:
+        seconds = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        speeds = [float(s) for s in sys.argv[2:]]
+
+    (fd, filename) = tempfile.mkstemp(suffix=".crtp")
+    os.close(fd)
+    try:
+        (samples, packets) = record(filename, seconds)
+        print "Recorded %d packets in %.1fs, %d log samples" % (
+            packets, seconds, samples)
+        for speed in speeds:
+            output = subprocess.check_output([sys.executable, __file__,
+                                              "--replay", filename,
+                                              str(speed)])
+            (decoded, connect_time, received, elapsed) = \
+                output.split()[-4:]
+            print ("speed=%-4g connected in %.3fs, logging %6.0f packets/s,"
+                   " %s samples decoded" % (speed, float(connect_time),
+                                            int(received) / float(elapsed),
+                                            decoded))
+    finally:
+        os.remove(filename)
+    os._exit(0)
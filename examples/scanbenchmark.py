@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Benchmark of the scan for Crazyflies of the radio driver using simulated
+dongles and Crazyflies (cflib.drivers.mockradio), so no hardware is needed.
+
+A full scan is timed with one and several dongles, with dongles scanning
+on the PC side and in firmware (opt-in, see crazyradio.USE_FW_SCAN),
+followed by an incremental scan that only looks for the Crazyflies found
+before. Usage:
+
+    scanbenchmark.py [usb latency in ms] [air time in ms] [dongles]
+"""
+
+import sys
+sys.path.append("../lib")
+
+import logging
+import time
+
+from cflib.crtp.radiodriver import RadioDriver
+from cflib.drivers import crazyradio
+from cflib.drivers.crazyradio import Crazyradio
+from cflib.drivers.mockradio import MockCrazyradioDevice, SimulatedCopter
+
+# Only output errors from the logging framework
+logging.basicConfig(level=logging.ERROR)
+
+COPTERS = [(10, Crazyradio.DR_250KPS), (80, Crazyradio.DR_2MPS),
+           (100, Crazyradio.DR_1MPS), (125, Crazyradio.DR_2MPS)]
+
+
+def run(dongles, fw_scan, usb_latency, air_time, incremental=False):
+    """Scan using simulated dongles and return (seconds, URIs found)"""
+    crazyradio.USE_FW_SCAN = fw_scan
+    copters = [SimulatedCopter(channel=c, datarate=r) for (c, r) in COPTERS]
+    for _ in range(dongles):
+        crazyradio.add_simulated_device(
+            MockCrazyradioDevice(copters, version=0x0053,
+                                 usb_latency=usb_latency, air_time=air_time))
+    driver = RadioDriver()
+    start = time.time()
+    found = driver.scan_interface(incremental)
+    elapsed = time.time() - start
+    crazyradio.remove_simulated_devices()
+    return (elapsed, [uri for (uri, _) in found])
+
+if __name__ == '__main__':
+    usb_latency = 0.001
+    air_time = 0.0005
+    dongles = 4
+    if len(sys.argv) > 1:
+        usb_latency = float(sys.argv[1]) / 1000.0
+    if len(sys.argv) > 2:
+        air_time = float(sys.argv[2]) / 1000.0
+    if len(sys.argv) > 3:
+        dongles = int(sys.argv[3])
+
+    print "Scan time, simulated USB latency %.2fms, air time %.2fms" % (
+        usb_latency * 1000, air_time * 1000)
+    for (name, n, fw_scan, incremental) in [
+            ("1 dongle, PC scan", 1, False, False),
+            ("%d dongles, PC scan" % dongles, dongles, False, False),
+            ("1 dongle, firmware scan", 1, True, False),
+            ("%d dongles, firmware scan" % dongles, dongles, True, False),
+            ("%d dongles, incremental" % dongles, dongles, False, True)]:
+        (elapsed, found) = run(n, fw_scan, usb_latency, air_time,
+                               incremental)
+        print "%-28s %7.3fs, found %d: %s" % (name, elapsed, len(found),
+                                              " ".join(found))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+"""
+Benchmark of the throughput of the serial peer link driver over a pseudo
+terminal, compared with the Crazyradio link driver using a simulated dongle
+(see radiobenchmark.py), so no hardware is needed. Needs pyserial and a
+POSIX system.
+
+A simulated Crazyflie on the other end of the pseudo terminal answers every
+packet with a full log data packet, optionally limited to the speed of a
+UART at a given baudrate. The uplink is saturated by sending commander
+packets as fast as possible. Usage:
+
+    serialbenchmark.py [seconds] [baudrate ...]
+
+A baudrate of 0 means no limit (the speed of the pseudo terminal).
+"""
+
+import sys
+sys.path.append("../lib")
+
+import os
+import logging
+import time
+import select
+import struct
+import threading
+
+from cflib.crtp.serialdriver import SerialPeerDriver, FrameDecoder, encode_frame
+from cflib.crtp.crtpstack import CRTPPacket, CRTPPort
+
+from radiobenchmark import run as run_radio
+
+# Only output errors from the logging framework
+logging.basicConfig(level=logging.ERROR)
+
+
+class SimulatedCopter(threading.Thread):
+    """Answers every frame read from fd with a log data packet"""
+
+    def __init__(self, fd, baudrate):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.fd = fd
+        self.baudrate = baudrate
+        self.packets_received = 0
+        self.errors = 0
+        self.running = True
+        self._answer = CRTPPacket(0x52, [0] * 31)
+
+    def run(self):
+        decoder = FrameDecoder()
+        while self.running:
+            (readable, _, _) = select.select([self.fd], [], [], 0.1)
+            if not readable:
+                continue
+            start = time.time()
+            data = os.read(self.fd, 4096)
+            packets = decoder.decode(data)
+            self.packets_received += len(packets)
+            answers = bytearray()
+            for _ in packets:
+                encode_frame(self._answer, answers)
+            if answers:
+                os.write(self.fd, answers)
+            if self.baudrate:
+                # 10 bits per byte on a UART, the two directions at the same
+                # time
+                wait = (max(len(data), len(answers)) * 10.0 / self.baudrate -
+                        (time.time() - start))
+                if wait > 0:
+                    time.sleep(wait)
+        self.errors = decoder.errors
+
+
+def run_serial(duration, baudrate):
+    """Run the link for duration seconds and return the number of packets
+    per second (uplink, downlink)"""
+    (master, slave) = os.openpty()
+    copter = SimulatedCopter(master, baudrate)
+    copter.start()
+
+    driver = SerialPeerDriver()
+    driver.connect("serialpeer://" + os.ttyname(slave), None, None)
+
+    running = [True]
+    received = [0]
+
+    def receiver():
+        while running[0]:
+            if driver.receive_packet(0.1) is not None:
+                received[0] += 1
+
+    receive_thread = threading.Thread(target=receiver)
+    receive_thread.start()
+
+    pk = CRTPPacket()
+    pk.port = CRTPPort.COMMANDER
+    pk.data = struct.pack('<fffH', 0, 0, 0, 0)
+    start = time.time()
+    while time.time() - start < duration:
+        # Don't let the queue grow without limit if the link can't keep up
+        if driver.out_queue.qsize() < 100:
+            driver.send_packet(pk)
+        else:
+            time.sleep(0.0001)
+    elapsed = time.time() - start
+    uplink = copter.packets_received
+    downlink = received[0]
+
+    running[0] = False
+    receive_thread.join()
+    copter.running = False
+    copter.join()
+    driver.close()
+    os.close(master)
+    os.close(slave)
+    if copter.errors:
+        print "%d corrupt frames!" % copter.errors
+    return (uplink / elapsed, downlink / elapsed)
+
+if __name__ == '__main__':
+    duration = 3.0
+    baudrates = [0, 2000000]
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        baudrates = [int(b) for b in sys.argv[2:]]
+
+    print "Link throughput (%.1fs per run)" % duration
+    for baudrate in baudrates:
+        (uplink, downlink) = run_serial(duration, baudrate)
+        name = "serial %s" % (baudrate or "pty")
+        print "%-18s uplink=%7.0f packets/s downlink=%7.0f packets/s" % (
+            name, uplink, downlink)
+    for batch_size in [1, 16]:
+        (uplink, downlink) = run_radio(batch_size, duration, 0.0)
+        name = "radio batch=%d" % batch_size
+        print "%-18s uplink=%7.0f packets/s downlink=%7.0f packets/s" % (
+            name, uplink, downlink)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Benchmark of several Crazyflies sharing one Crazyradio dongle, using a
+simulated dongle and Crazyflies (cflib.drivers.mockradio), so no hardware
+is needed.
+
+Every Crazyflie is on its own radio address and its uplink is saturated
+with commander packets, while it answers every packet with a full log
+data packet. The dongle is shared between the links in turns, the
+packets per second in both directions, the spread between the fastest and
+the slowest link and the time the links waited for their turn are
+reported for different swarm sizes. The first link gets the weight given
+on the command line, the others have weight 1. Usage:
+
+    swarmbenchmark.py [seconds] [usb latency in ms] [weight] [copters ...]
+"""
+
+import sys
+sys.path.append("../lib")
+
+import logging
+import time
+import struct
+import threading
+
+from cflib.crtp.radiodriver import RadioDriver
+from cflib.crtp.crtpstack import CRTPPacket, CRTPPort
+from cflib.drivers import crazyradio
+from cflib.drivers.crazyradio import Crazyradio
+from cflib.drivers.mockradio import MockCrazyradioDevice, SimulatedCopter
+
+# Only output errors from the logging framework
+logging.basicConfig(level=logging.ERROR)
+
+
+def run(copters, duration, usb_latency, weight):
+    """Run the links for duration seconds and return a list of tuples with
+    (uplink, downlink) packets per second and the cycle stats of each
+    link"""
+    log_packet = [0x52] + [0] * 31
+    device = MockCrazyradioDevice(usb_latency=usb_latency)
+    devid = crazyradio.add_simulated_device(device)
+
+    drivers = []
+    for i in range(copters):
+        address = (0xE7, 0xE7, 0xE7, 0xE7, i + 1)
+        copter = SimulatedCopter(channel=80, datarate=Crazyradio.DR_2MPS,
+                                 address=address, downlink=log_packet)
+        device.add_copter(copter)
+        driver = RadioDriver()
+        link_weight = weight if i == 0 else 1
+        driver.connect("radio://{}/80/2M/{}?weight={}".format(
+            devid, "".join("%02X" % a for a in address), link_weight),
+            None, None)
+        drivers.append((driver, copter))
+
+    running = [True]
+    received = [0] * copters
+
+    def receiver(i, driver):
+        while running[0]:
+            if driver.receive_packet(0.1) is not None:
+                received[i] += 1
+
+    def sender(driver):
+        pk = CRTPPacket()
+        pk.port = CRTPPort.COMMANDER
+        pk.data = struct.pack('<fffH', 0, 0, 0, 0)
+        while running[0]:
+            driver.send_packet(pk)
+
+    threads = []
+    for (i, (driver, copter)) in enumerate(drivers):
+        threads.append(threading.Thread(target=receiver, args=(i, driver)))
+        threads.append(threading.Thread(target=sender, args=(driver,)))
+    start = time.time()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    elapsed = time.time() - start
+    results = []
+    for (i, (driver, copter)) in enumerate(drivers):
+        results.append((copter.packets_received / elapsed,
+                        received[i] / elapsed, driver.get_cycle_stats()))
+
+    running[0] = False
+    for t in threads:
+        t.join()
+    for (driver, copter) in drivers:
+        driver.close()
+    crazyradio.remove_simulated_devices()
+    return results
+
+if __name__ == '__main__':
+    duration = 3.0
+    usb_latency = 0.0
+    weight = 1
+    swarm_sizes = [1, 2, 4, 8]
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        usb_latency = float(sys.argv[2]) / 1000.0
+    if len(sys.argv) > 3:
+        weight = int(sys.argv[3])
+    if len(sys.argv) > 4:
+        swarm_sizes = [int(c) for c in sys.argv[4:]]
+
+    print "Shared dongle throughput, simulated USB latency %.2fms" % (
+        usb_latency * 1000)
+    for copters in swarm_sizes:
+        results = run(copters, duration, usb_latency, weight)
+        uplinks = [r[0] for r in results]
+        print ("copters=%-2d uplink=%7.0f packets/s downlink=%7.0f "
+               "packets/s" % (copters, sum(uplinks),
+                              sum(r[1] for r in results)))
+        print ("    per link min=%6.0f max=%6.0f packets/s, first link "
+               "%6.0f packets/s" % (min(uplinks), max(uplinks), uplinks[0]))
+        print ("    turn latency avg=%.2fms max=%.2fms, radio switches=%d" %
+               (1000 * max(r[2]["turn_latency_avg"] for r in results),
+                1000 * max(r[2]["turn_latency_max"] for r in results),
+                results[0][2]["radio_switches"]))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Benchmark of the time it takes to connect to a Crazyflie, i.e to download
+the log and param TOCs, with different TOC fetch windows.
+
+By default the debug driver is used with random delays on the answers
+(debug://0/3), so no Crazyflie is needed. It answers one request at a time,
+like it always has, so the results can be compared with older ones. With
+debug://0/6 each answer gets its own random latency instead, so answers
+to requests sent close together can arrive out of order. Usage:
+
+    tocbenchmark.py [uri] [rounds] [window ...]
+"""
+
+import sys
+sys.path.append("../lib")
+
+import logging
+import time
+import threading
+
+import cflib.crtp
+from cflib.crazyflie import Crazyflie, RECEIVE_TIMEOUT
+from cflib.crazyflie.toccache import get_shared_cache
+
+# Only output errors from the logging framework
+logging.basicConfig(level=logging.ERROR)
+
+
+def time_to_connected(link_uri, window):
+    """Connect to link_uri and return the time in seconds it took until the
+    connection was set up, or None if it failed"""
+    # Drop the TOCs kept in memory by earlier rounds
+    get_shared_cache().clear()
+    cf = Crazyflie(toc_fetch_window=window)
+    done = threading.Event()
+    result = {}
+
+    def connected(uri):
+        result["time"] = time.time() - start
+        done.set()
+
+    def failed(uri, msg):
+        done.set()
+
+    cf.connected.add_callback(connected)
+    cf.connection_failed.add_callback(failed)
+
+    # The incoming packet thread checks for a link every RECEIVE_TIMEOUT
+    # seconds, so let it see the link before starting the clock
+    cf.link = cflib.crtp.get_link_driver(link_uri, None, None)
+    time.sleep(2 * RECEIVE_TIMEOUT)
+    start = time.time()
+    cf._start_connection_setup()
+    done.wait(60)
+    cf.close_link()
+    cf.connected.remove_callback(connected)
+    cf.connection_failed.remove_callback(failed)
+    return result.get("time")
+
+if __name__ == '__main__':
+    uri = "debug://0/3"
+    rounds = 5
+    windows = [1, 2, 5, 10]
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        windows = [int(w) for w in sys.argv[3:]]
+
+    cflib.crtp.init_drivers(enable_debug_driver=True)
+
+    print "Time to connected for %s (%d rounds)" % (uri, rounds)
+    baseline = None
+    for window in windows:
+        times = []
+        for i in range(rounds):
+            t = time_to_connected(uri, window)
+            if t is not None:
+                times.append(t)
+        if not times:
+            print "window=%-3d failed to connect" % window
+            continue
+        mean = sum(times) / len(times)
+        if baseline is None:
+            baseline = mean
+        print "window=%-3d mean=%.3fs min=%.3fs max=%.3fs speedup=%.1fx" % (
+            window, mean, min(times), max(times), baseline / mean)
@@ -132,11 +132,14 @@ class AboutDialog(QtGui.QWidget, about_widget_class):
         self._fw_modified = None
 
         helper.cf.param.add_update_callback(group="imu_sensors",
-                                            cb=self._imu_sensors_update)
+                                            cb=self._imu_sensors_update,
+                                            typed=True)
         helper.cf.param.add_update_callback(group="imu_tests",
-                                            cb=self._imu_sensor_tests_update)
+                                            cb=self._imu_sensor_tests_update,
+                                            typed=True)
         helper.cf.param.add_update_callback(group="firmware",
-                                            cb=self._firmware_update)
+                                            cb=self._firmware_update,
+                                            typed=True)
         helper.cf.connected.add_callback(self._connected)
 
         self._disconnected_signal.connect(self._disconnected)
@@ -174,25 +177,25 @@ class AboutDialog(QtGui.QWidget, about_widget_class):
     def _firmware_update(self, name, value):
         """Callback for firmware parameters"""
         if "revision0" in name:
-            self._fw_rev0 = eval(value)
+            self._fw_rev0 = value
         if "revision1" in name:
-            self._fw_rev1 = eval(value)
+            self._fw_rev1 = value
         if "modified" in name:
-            self._fw_modified = eval(value)
+            self._fw_modified = value
 
     def _imu_sensors_update(self, name, value):
         """Callback for sensor found paramters"""
         param = name[name.index('.') + 1:]
         if not param in self._imu_sensors_text:
             self._imu_sensors_text += IMU_SENSORS_FORMAT.format(param,
-                                                                eval(value))
+                                                                value)
 
     def _imu_sensor_tests_update(self, name, value):
         """Callback for sensor test parameters"""
         param = name[name.index('.') + 1:]
         if not param in self._imu_sensor_test_text:
             self._imu_sensor_test_text += SENSOR_TESTS_FORMAT.format(param,
-                                                                 eval(value))
+                                                                 value)
 
     def _disconnected(self, uri):
         """Callback for Crazyflie disconnected"""
@@ -317,13 +317,11 @@ class MainUI(QtGui.QMainWindow, main_window_class):
 
         GuiConfig().set("link_uri", linkURI)
 
-        lg = LogConfig("Battery", 1000)
-        lg.add_variable("pm.vbat", "float")
-        self.cf.log.add_config(lg)
-        if lg.valid:
-            lg.data_received_cb.add_callback(self.batteryUpdatedSignal.emit)
-            lg.error_cb.add_callback(self._log_error_signal.emit)
-            lg.start()
+        battery = self.cf.log.subscribe("Battery", ["pm.vbat"], 1000)
+        if battery.valid:
+            battery.data_received_cb.add_callback(
+                self.batteryUpdatedSignal.emit)
+            battery.error_cb.add_callback(self._log_error_signal.emit)
         else:
             logger.warning("Could not setup loggingblock!")
 
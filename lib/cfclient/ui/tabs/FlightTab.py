@@ -137,32 +137,35 @@ class FlightTab(Tab, flight_tab_class):
         self.crazyflieXModeCheckbox.clicked.connect(
                              lambda enabled:
                              self.helper.cf.param.set_value("flightmode.x",
-                                                            str(enabled)))
+                                                            enabled))
         self.helper.cf.param.add_update_callback(
                         group="flightmode", name="xmode",
                         cb=( lambda name, checked:
-                        self.crazyflieXModeCheckbox.setChecked(eval(checked))))
+                        self.crazyflieXModeCheckbox.setChecked(bool(checked))),
+                        typed=True)
         self.ratePidRadioButton.clicked.connect(
                     lambda enabled:
                     self.helper.cf.param.set_value("flightmode.ratepid",
-                                                   str(enabled)))
+                                                   enabled))
         self.angularPidRadioButton.clicked.connect(
                     lambda enabled:
                     self.helper.cf.param.set_value("flightmode.ratepid",
-                                                   str(not enabled)))
+                                                   not enabled))
         self.helper.cf.param.add_update_callback(
                     group="flightmode", name="ratepid",
                     cb=(lambda name, checked:
-                    self.ratePidRadioButton.setChecked(eval(checked))))
+                    self.ratePidRadioButton.setChecked(bool(checked))),
+                    typed=True)
         
         self.helper.cf.param.add_update_callback(
                     group="flightmode", name="althold",
                     cb=(lambda name, enabled:
-                    self.helper.inputDeviceReader.setAltHold(eval(enabled))))
+                    self.helper.inputDeviceReader.setAltHold(bool(enabled))),
+                    typed=True)
 
         self.helper.cf.param.add_update_callback(
                         group="imu_sensors",
-                        cb=self._set_available_sensors)
+                        cb=self._set_available_sensors, typed=True)
                 
         self.logBaro = None
         self.logAltHold = None
@@ -230,40 +233,33 @@ class FlightTab(Tab, flight_tab_class):
 
     def connected(self, linkURI):
         # IMU & THRUST
-        lg = LogConfig("Stabalizer", GuiConfig().get("ui_update_period"))
-        lg.add_variable("stabilizer.roll", "float")
-        lg.add_variable("stabilizer.pitch", "float")
-        lg.add_variable("stabilizer.yaw", "float")
-        lg.add_variable("stabilizer.thrust", "uint16_t")
-
-        self.helper.cf.log.add_config(lg)
-        if (lg.valid):
-            lg.data_received_cb.add_callback(self._imu_data_signal.emit)
-            lg.error_cb.add_callback(self._log_error_signal.emit)
-            lg.start()
+        period = GuiConfig().get("ui_update_period")
+        imu = self.helper.cf.log.subscribe("Stabalizer",
+                                           ["stabilizer.roll",
+                                            "stabilizer.pitch",
+                                            "stabilizer.yaw",
+                                            "stabilizer.thrust"], period)
+        if imu.valid:
+            imu.data_received_cb.add_callback(self._imu_data_signal.emit)
+            imu.error_cb.add_callback(self._log_error_signal.emit)
         else:
             logger.warning("Could not setup logconfiguration after "
                            "connection!")
 
         # MOTOR
-        lg = LogConfig("Motors", GuiConfig().get("ui_update_period"))
-        lg.add_variable("motor.m1")
-        lg.add_variable("motor.m2")
-        lg.add_variable("motor.m3")
-        lg.add_variable("motor.m4")
-
-        self.helper.cf.log.add_config(lg)
-        if lg.valid:
-            lg.data_received_cb.add_callback(self._motor_data_signal.emit)
-            lg.error_cb.add_callback(self._log_error_signal.emit)
-            lg.start()
+        motors = self.helper.cf.log.subscribe("Motors",
+                                              ["motor.m1", "motor.m2",
+                                               "motor.m3", "motor.m4"],
+                                              period)
+        if motors.valid:
+            motors.data_received_cb.add_callback(self._motor_data_signal.emit)
+            motors.error_cb.add_callback(self._log_error_signal.emit)
         else:
             logger.warning("Could not setup logconfiguration after "
                            "connection!")
             
     def _set_available_sensors(self, name, available):
         logger.info("[%s]: %s", name, available)
-        available = eval(available)
         if ("HMC5883L" in name):
             if (not available):
                 self.actualASL.setText("N/A")
@@ -273,29 +269,23 @@ class FlightTab(Tab, flight_tab_class):
                 self.helper.inputDeviceReader.setAltHoldAvailable(available)
                 if (not self.logBaro and not self.logAltHold):
                     # The sensor is available, set up the logging
-                    self.logBaro = LogConfig("Baro", 200)
-                    self.logBaro.add_variable("baro.aslLong", "float")
-
-                    self.helper.cf.log.add_config(self.logBaro)
+                    self.logBaro = self.helper.cf.log.subscribe(
+                        "Baro", ["baro.aslLong"], 200)
                     if self.logBaro.valid:
                         self.logBaro.data_received_cb.add_callback(
                             self._baro_data_signal.emit)
                         self.logBaro.error_cb.add_callback(
                             self._log_error_signal.emit)
-                        self.logBaro.start()
                     else:
                         logger.warning("Could not setup logconfiguration after "
                                        "connection!")            
-                    self.logAltHold = LogConfig("AltHold", 200)
-                    self.logAltHold.add_variable("altHold.target", "float")
-
-                    self.helper.cf.log.add_config(self.logAltHold)
+                    self.logAltHold = self.helper.cf.log.subscribe(
+                        "AltHold", ["altHold.target"], 200)
                     if self.logAltHold.valid:
                         self.logAltHold.data_received_cb.add_callback(
                             self._althold_data_signal.emit)
                         self.logAltHold.error_cb.add_callback(
                             self._log_error_signal.emit)
-                        self.logAltHold.start()
                     else:
                         logger.warning("Could not setup logconfiguration after "
                                        "connection!")                        
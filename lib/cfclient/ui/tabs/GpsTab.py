@@ -156,19 +156,12 @@ class GpsTab(Tab, gps_tab_class):
         }
 
     def _connected(self, link_uri):
-        lg = LogConfig("GPS", 100)
-        lg.add_variable("gps.lat")
-        lg.add_variable("gps.lon")
-        lg.add_variable("gps.hMSL")
-        lg.add_variable("gps.heading")
-        lg.add_variable("gps.gSpeed")
-        lg.add_variable("gps.hAcc")
-        lg.add_variable("gps.fixType")
-        self._cf.log.add_config(lg)
-        if lg.valid:
-            lg.data_received_cb.add_callback(self._log_data_signal.emit)
-            lg.error_cb.add_callback(self._log_error_signal.emit)
-            lg.start()
+        gps = self._cf.log.subscribe("GPS", ["gps.lat", "gps.lon", "gps.hMSL",
+                                             "gps.heading", "gps.gSpeed",
+                                             "gps.hAcc", "gps.fixType"], 100)
+        if gps.valid:
+            gps.data_received_cb.add_callback(self._log_data_signal.emit)
+            gps.error_cb.add_callback(self._log_error_signal.emit)
         else:
             logger.warning("Could not setup logging block for GPS!")
         self._max_speed = 0.0
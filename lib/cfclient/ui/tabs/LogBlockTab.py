@@ -28,7 +28,8 @@
 
 """
 This tab shows all log blocks that are registered and can be used to start the
-logging and also to write the logging data to file.
+logging and also to write the logging data to file. The blocks shared by the
+log subscriptions are listed too, but they can't be started or stopped here.
 """
 
 __author__ = 'Bitcraze AB'
@@ -53,7 +54,8 @@ from PyQt4 import QtCore, QtGui, uic
 from PyQt4.QtCore import pyqtSlot, pyqtSignal, QThread
 from PyQt4.QtCore import QAbstractItemModel, QModelIndex, QString, QVariant
 
-from cfclient.utils.logdatawriter import LogWriter
+from cfclient.utils.guiconfig import GuiConfig
+from cfclient.utils.logdatawriter import LogWriter, BinaryLogWriter
 
 
 class LogBlockChildItem(object):
@@ -82,8 +84,14 @@ class LogBlockItem(object):
         self.name = block.name
         self.id = block.id
         self.period = block.period_in_ms
+        # Blocks shared by the subscriptions are started and deleted by
+        # them, they can't be started or stopped from the tab
+        self.shared = block.shared
         self._model = model
-        self._log_file_writer = LogWriter(block, connected_ts)
+        if GuiConfig().get("log_file_format") == "binary":
+            self._log_file_writer = BinaryLogWriter(block, connected_ts)
+        else:
+            self._log_file_writer = LogWriter(block, connected_ts)
 
         self._block.started_cb.add_callback(self._set_started)
         self._block.added_cb.add_callback(self._set_added)
@@ -115,6 +123,19 @@ class LogBlockItem(object):
         self._doing_transaction = False
         self._model.refresh()
 
+    def is_item_of(self, block):
+        """Return True if this node represents the block"""
+        return self._block is block
+
+    def remove(self):
+        """Stop writing to file and stop following the block, called when
+        the block has been removed"""
+        if self.writing_to_file():
+            self.stop_writing_to_file()
+        self._block.started_cb.remove_callback(self._set_started)
+        self._block.added_cb.remove_callback(self._set_added)
+        self._block.error_cb.remove_callback(self._log_error)
+
     def logging_started(self):
         """Return True if the block has been started, otherwise False"""
         return self._block_started
@@ -182,7 +203,7 @@ class LogBlockModel(QAbstractItemModel):
     def clicked(self, index):
         """Callback when a cell has been clicked (mouse down/up on same cell)"""
         node = index.internalPointer()
-        if not node.parent and index.column() == 3:
+        if not node.parent and index.column() == 3 and not node.shared:
             if node.logging_started():
                 node.stop()
             else:
@@ -208,7 +229,12 @@ class LogBlockModel(QAbstractItemModel):
 
     def remove_block(self, block):
         """Remove a block from the view"""
-        raise NotImplementedError()
+        for node in self._nodes:
+            if node.is_item_of(block):
+                node.remove()
+                self._nodes.remove(node)
+                self.layoutChanged.emit()
+                return
 
     def columnCount(self, parent):
         """Re-implemented method to get the number of columns"""
@@ -289,7 +315,7 @@ class CheckboxDelegate(QStyledItemDelegate):
             s.rect.adjust(center_offset, 0, 0, 0)
 
             if col == 3:
-                if not item.doing_transaction():
+                if not item.doing_transaction() and not item.shared:
                     s.state = QStyle.State_Enabled
                 if item.logging_started():
                     s.state |= QStyle.State_On
@@ -313,6 +339,7 @@ class LogBlockTab(Tab, logblock_tab_class):
 
     _blocks_updated_signal = pyqtSignal(bool)
     _disconnected_signal = pyqtSignal(str)
+    _block_removed_signal = pyqtSignal(object)
 
     def __init__(self, tabWidget, helper, *args):
         """Initialize the tab"""
@@ -331,6 +358,9 @@ class LogBlockTab(Tab, logblock_tab_class):
             self._disconnected_signal.emit)
 
         self._model = LogBlockModel(self._block_tree)
+        self._block_removed_signal.connect(self._model.remove_block)
+        self._helper.cf.log.block_removed_cb.add_callback(
+            self._block_removed_signal.emit)
         self._block_tree.setModel(self._model)
         self._block_tree.clicked.connect(self._model.clicked)
         self._block_tree.setItemDelegate(CheckboxDelegate())
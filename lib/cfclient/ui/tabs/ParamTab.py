@@ -118,10 +118,7 @@ class ParamBlockModel(QAbstractItemModel):
             self._nodes.append(new_group)
 
         # Request updates for all of the parameters
-        for group in self._nodes:
-            for param in group.children:
-                complete_name = "%s.%s" % (group.name, param.name)
-                crazyflie.param.request_param_update(complete_name)
+        crazyflie.param.read_all()
 
         self.layoutChanged.emit()
 
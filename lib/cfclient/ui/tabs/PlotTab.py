@@ -122,10 +122,11 @@ class LogConfigModel(QAbstractItemModel):
 class PlotTab(Tab, plot_tab_class):
     """Tab for plotting logging data"""
 
-    _log_data_signal = pyqtSignal(int, object, object)
+    _log_data_signal = pyqtSignal(object)
     _log_error_signal = pyqtSignal(object, str)
     _disconnected_signal = pyqtSignal(str)
     _connected_signal = pyqtSignal(str)
+    _configs_updated_signal = pyqtSignal(object)
 
     colors = ['g', 'b', 'm', 'r', 'y', 'c']
 
@@ -160,12 +161,13 @@ class PlotTab(Tab, plot_tab_class):
             self.helper.cf.connected.add_callback(
                 self._connected_signal.emit)
 
-            self.helper.cf.log.block_added_cb.add_callback(self._config_added)
+            self._configs_updated_signal.connect(self._configs_updated)
+            self.helper.logConfigReader.configs_updated.add_callback(
+                self._configs_updated_signal.emit)
             self.dataSelector.currentIndexChanged.connect(
                 self._selection_changed)
 
-        self._previous_config = None
-        self._started_previous = False
+        self._subscription = None
 
     def _connected(self, link_uri):
         """Callback when the Crazyflie has been connected"""
@@ -176,16 +178,16 @@ class PlotTab(Tab, plot_tab_class):
         """Callback for when the Crazyflie has been disconnected"""
         self._model.reset()
         self.dataSelector.setCurrentIndex(-1)
-        self._previous_config = None
-        self._started_previous = False
+        # The subscriptions end when the logging is reset on reconnect
+        self._subscription = None
 
-    def _log_data_signal_wrapper(self, ts, data, logconf):
-        """Wrapper for signal"""
+    def _log_data_signal_wrapper(self, samples):
+        """Wrapper for signal, the samples are delivered in batches"""
 
         # For some reason the *.emit functions are not
         # the same over time (?!) so they cannot be registered and then
         # removed as callbacks.
-        self._log_data_signal.emit(ts, data, logconf)
+        self._log_data_signal.emit(samples)
 
     def _log_error_signal_wrapper(self, config, msg):
         """Wrapper for signal"""
@@ -201,55 +203,65 @@ class PlotTab(Tab, plot_tab_class):
         # Check if we have disconnected
         if i < 0:
             return
-        # First check if we need to stop the old block
-        if self._started_previous and self._previous_config:
-            logger.debug("Should stop config [%s], stopping!",
-                        self._previous_config.name)
-            self._previous_config.delete()
-
-        # Remove our callback for the previous config
-        if self._previous_config:
-            self._previous_config.data_received_cb.remove_callback(
+        # Stop the old subscription, the log blocks are deleted if no one
+        # else uses them
+        if self._subscription:
+            self._subscription.data_received_cb.remove_callback(
                 self._log_data_signal_wrapper)
-            self._previous_config.error_cb.remove_callback(
+            self._subscription.error_cb.remove_callback(
                 self._log_error_signal_wrapper)
+            self._subscription.unsubscribe()
+            self._subscription = None
 
         lg = self._model.get_config(i)
-        if not lg.started:
-            logger.debug("Config [%s] not started, starting!", lg.name)
-            self._started_previous = True
-            lg.start()
-        else:
-            self._started_previous = False
+        names = []
+        for d in lg.variables:
+            if d.is_toc_variable():
+                names.append(d.name)
+            else:
+                logger.warning("Memory variables can't be plotted, skipping"
+                               " [%s] in [%s]", d.name, lg.name)
         self._plot.removeAllDatasets()
         color_selector = 0
 
         self._plot.set_title(lg.name)
 
-        for d in lg.variables:
-            self._plot.add_curve(d.name,
+        for name in names:
+            self._plot.add_curve(name,
                                 self.colors[color_selector % len(self.colors)])
             color_selector += 1
-        lg.data_received_cb.add_callback(self._log_data_signal_wrapper)
-        lg.error_cb.add_callback(self._log_error_signal_wrapper)
+        subscription = self.helper.cf.log.subscribe(lg.name, names,
+                                                    lg.period_in_ms)
+        if not subscription.valid:
+            self._logging_error(subscription, "Could not log the variables")
+            return
+        subscription.data_received_cb.add_batched_callback(
+            self._log_data_signal_wrapper)
+        subscription.error_cb.add_callback(self._log_error_signal_wrapper)
 
-        self._previous_config = lg
+        self._subscription = subscription
 
-    def _config_added(self, logconfig):
-        """Callback from the log layer when a new config has been added"""
-        logger.debug("Callback for new config [%s]", logconfig.name)
-        self._model.add_block(logconfig)
+    def _configs_updated(self, configs):
+        """Callback from the log configuration reader when the
+        configurations have been read or saved"""
+        if not self.helper.cf.link:
+            return
+        logger.debug("Got %d log configurations", len(configs))
+        self._model.reset()
+        for config in configs:
+            self._model.add_block(config)
 
     def _logging_error(self, log_conf, msg):
         """Callback from the log layer when an error occurs"""
         QMessageBox.about(self, "Plot error", "Error when starting log config"
                 " [%s]: %s" % (log_conf.name, msg))
 
-    def _log_data_received(self, timestamp, data, logconf):
-        """Callback when the log layer receives new data"""
+    def _log_data_received(self, samples):
+        """Callback when the log layer receives new data, samples is a list
+        of (timestamp, data, logconf)"""
 
-        # Check so that the incoming data belongs to what we are currently
-        # logging
-        if self._previous_config:
-            if self._previous_config.name == logconf.name:
+        for (timestamp, data, logconf) in samples:
+            # Check so that the incoming data belongs to what we are
+            # currently logging
+            if logconf is self._subscription:
                 self._plot.add_data(data, timestamp)
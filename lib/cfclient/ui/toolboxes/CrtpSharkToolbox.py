@@ -61,28 +61,34 @@ class CrtpSharkToolbox(QtGui.QWidget, param_tab_class):
         self.clearButton.clicked.connect(self.clearLog)
         self.saveButton.clicked.connect(self._save_data)
 
-        self._incoming_packet_signal.connect(lambda p: self._packet("IN", p))
-        self._outgoing_packet_signal.connect(lambda p: self._packet("OUT", p))
+        # The packets are delivered in batches to keep the load down
+        self._incoming_packet_signal.connect(lambda c: self._packets("IN", c))
+        self._outgoing_packet_signal.connect(lambda c: self._packets("OUT", c))
         self._ms_offset = int(round(time() * 1000))
 
         self._data = []
 
-    def _packet(self, dir, pk):
+    def _packets(self, dir, calls):
+        """Show the packets received or sent since the last time, calls is
+        a list of the arguments of the packet callbacks"""
         if self.masterCheck.isChecked():
-            line = QtGui.QTreeWidgetItem()
-
+            lines = []
             ms_diff = int(round(time()*1000))-self._ms_offset
-            line.setData(0, Qt.DisplayRole, "%d" % ms_diff)
-            line.setData(1, Qt.DisplayRole, "%s" % dir)
-            line.setData(2, Qt.DisplayRole, "%d/%d" % (pk.port, pk.channel))
-            line.setData(3, Qt.DisplayRole, pk.datal.__str__())
+            for (pk,) in calls:
+                line = QtGui.QTreeWidgetItem()
+
+                line.setData(0, Qt.DisplayRole, "%d" % ms_diff)
+                line.setData(1, Qt.DisplayRole, "%s" % dir)
+                line.setData(2, Qt.DisplayRole, "%d/%d" % (pk.port, pk.channel))
+                line.setData(3, Qt.DisplayRole, pk.datal.__str__())
 
-            s = "%d, %s, %d/%d, %s" % (ms_diff, dir, pk.port, pk.channel,
-                                      pk.datal.__str__())
-            self._data.append(s)
+                s = "%d, %s, %d/%d, %s" % (ms_diff, dir, pk.port, pk.channel,
+                                          pk.datal.__str__())
+                self._data.append(s)
+                lines.append(line)
 
-            self.logTree.addTopLevelItem(line)
-            self.logTree.scrollToItem(line)
+            self.logTree.addTopLevelItems(lines)
+            self.logTree.scrollToItem(lines[-1])
     
     @pyqtSlot()
     def clearLog(self):
@@ -95,17 +101,23 @@ class CrtpSharkToolbox(QtGui.QWidget, param_tab_class):
     def getTabName(self):
         return 'Crtp sniffer'
     
+    def _incoming_packets(self, calls):
+        self._incoming_packet_signal.emit(calls)
+
+    def _outgoing_packets(self, calls):
+        self._outgoing_packet_signal.emit(calls)
+
     def enable(self):
-        self.helper.cf.packet_received.add_callback(
-            self._incoming_packet_signal.emit)
-        self.helper.cf.packet_sent.add_callback(
-            self._outgoing_packet_signal.emit)
+        self.helper.cf.packet_received.add_batched_callback(
+            self._incoming_packets)
+        self.helper.cf.packet_sent.add_batched_callback(
+            self._outgoing_packets)
 
     def disable(self):
         self.helper.cf.packet_received.remove_callback(
-            self._incoming_packet_signal.emit)
+            self._incoming_packets)
         self.helper.cf.packet_sent.remove_callback(
-            self._outgoing_packet_signal.emit)
+            self._outgoing_packets)
 
     def preferedDockArea(self):
         return Qt.RightDockWidgetArea
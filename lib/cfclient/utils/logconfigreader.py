@@ -51,13 +51,23 @@ from PyQt4 import QtCore, QtGui, uic
 from PyQt4.QtCore import pyqtSlot, pyqtSignal
 
 from cflib.crazyflie.log import LogVariable, LogConfig
+from cflib.utils.callbacks import Caller
 
 
 class LogConfigReader():
-    """Reads logging configurations from file"""
+    """Reads logging configurations from file.
+
+    The configurations are added to the Crazyflie when it's connected, so
+    they can be started and logged to file from the log blocks tab. Other
+    parts of the application (i.e the plotter) only use them as
+    descriptions of what to log, and log them with Log.subscribe so the
+    log blocks are shared with the rest of the application."""
 
     def __init__(self, crazyflie):
         self.dsList = []
+        # Called with the list of configurations when they have been read
+        # (on connect) or one of them has been saved
+        self.configs_updated = Caller()
         # Check if user config exists, otherwise copy files
         if (not os.path.exists(sys.path[1] + "/log")):
             logger.info("No user config found, copying dist files")
@@ -99,13 +109,12 @@ class LogConfigReader():
         """Callback that is called once Crazyflie is connected"""
 
         self._read_config_files()
-        # Just add all the configurations. Via callbacks other parts of the
-        # application will pick up these configurations and use them
         for d in self.dsList:
             self._cf.log.add_config(d)
             if not d.valid:
                 logger.warning("Could not add log configuration [%s]",
                                d.name)
+        self.configs_updated.call(self.dsList)
 
     def getLogConfigs(self):
         """Return the log configurations"""
@@ -136,3 +145,7 @@ class LogConfigReader():
         json_data = open(filename, 'w')
         json_data.write(json.dumps(saveConfig, indent=2))
         json_data.close()
+
+        self.dsList = [d for d in self.dsList
+                       if d.name != logconfig.name] + [logconfig]
+        self.configs_updated.call(self.dsList)
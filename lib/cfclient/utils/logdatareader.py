@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Used to read back log data files written by BinaryLogWriter.
+
+The file is memory mapped, so only the parts that are read are loaded, and a
+sparse index of the timestamps is built when it's opened. The timestamps
+are stored unwrapped (in ms, they keep increasing during the connection),
+the reader returns them as times in ms from the first timestamp in the
+file. The host time of the samples, in ms since the epoch, is read as the
+variable HostTime.
+
+If NumPy is installed the data is returned as one NumPy array per variable,
+otherwise as lists.
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['LogDataReader']
+
+import os
+import mmap
+import struct
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+from .logdatawriter import read_npy_header, record_struct, STRUCT_TYPES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of records between the entries of the timestamp index
+INDEX_STRIDE = 1024
+
+
+class LogDataReader(object):
+    """Reader for one log data file"""
+
+    def __init__(self, filename):
+        """Open and index the file"""
+        self.filename = filename
+        with open(filename, "rb") as f:
+            (self._fields, count, self._offset) = read_npy_header(f)
+            size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._record = record_struct(self._fields)
+        self._timestamp = struct.Struct("<" +
+                                        STRUCT_TYPES[self._fields[0][1]])
+        # Don't trust the header for records that were not written
+        self._count = max(0, min(count, (size - self._offset) /
+                                 self._record.size))
+        self.variables = [name for (name, npy_type) in self._fields[1:]]
+        # Timestamp of the first record, the times are counted from it
+        self._first = self._raw_timestamp(0) if self._count else 0
+        self._index = []
+        self._build_index()
+
+    def close(self):
+        """Close the file, arrays returned earlier are still valid"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __len__(self):
+        """Return the number of records in the file"""
+        return self._count
+
+    def _raw_timestamp(self, i):
+        """Return the logged timestamp of record i"""
+        return self._timestamp.unpack_from(
+            self._map, self._offset + i * self._record.size)[0]
+
+    def _build_index(self):
+        """Store the time of every INDEX_STRIDE record"""
+        for i in xrange(0, self._count, INDEX_STRIDE):
+            self._index.append(self._time(i))
+
+    def _time(self, i):
+        """Return the time of record i"""
+        return self._raw_timestamp(i) - self._first
+
+    def duration(self):
+        """Return the time in ms between the first and the last record"""
+        if self._count == 0:
+            return 0
+        return self._time(self._count - 1)
+
+    def find(self, time):
+        """Return the index of the first record at or after time (in ms from
+        the first record), or the number of records if there's none"""
+        # Find the last index entry before time...
+        low = 0
+        high = len(self._index)
+        while low < high:
+            middle = (low + high) / 2
+            if self._index[middle] < time:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return 0
+        # ...and search the records it covers
+        high = min(low * INDEX_STRIDE, self._count)
+        low = (low - 1) * INDEX_STRIDE
+        while low < high:
+            middle = (low + high) / 2
+            if self._time(middle) < time:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def read(self, start=None, end=None, variables=None):
+        """Read the records with times from start up to (not including) end,
+        in ms from the first record. Return a dictionary with the times of
+        the records as Timestamp and the values of each variable, or only
+        of the variables listed."""
+        first = self.find(start) if start is not None else 0
+        last = self.find(end) if end is not None else self._count
+        return self.read_records(first, last, variables)
+
+    def read_records(self, first, last, variables=None):
+        """Read the records with index first up to (not including) last,
+        like read"""
+        first = max(0, first)
+        last = max(first, min(last, self._count))
+        if variables is None:
+            variables = self.variables
+        offset = self._offset + first * self._record.size
+        count = last - first
+
+        if numpy is not None:
+            records = numpy.frombuffer(self._map, numpy.dtype(self._fields),
+                                       count, offset)
+            times = records["Timestamp"].astype(numpy.int64) - self._first
+            data = {"Timestamp": times}
+            for name in variables:
+                # Copy, so the arrays are still valid when the file is closed
+                data[name] = records[name].copy()
+            return data
+
+        columns = [self.variables.index(name) + 1 for name in variables]
+        data = {"Timestamp": []}
+        for name in variables:
+            data[name] = []
+        for i in xrange(count):
+            values = self._record.unpack_from(self._map,
+                                              offset + i * self._record.size)
+            data["Timestamp"].append(values[0] - self._first)
+            for (name, column) in zip(variables, columns):
+                data[name].append(values[column])
+        return data
+
+    def chunks(self, start=None, end=None, variables=None, size=65536):
+        """Like read, but yield the data in chunks of (at most) size
+        records, for ranges too big to read at once"""
+        first = self.find(start) if start is not None else 0
+        last = self.find(end) if end is not None else self._count
+        for i in xrange(first, last, size):
+            yield self.read_records(i, min(i + size, last), variables)
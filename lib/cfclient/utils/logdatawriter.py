@@ -28,23 +28,128 @@
 
 """
 Used to write log data to files.
+
+Every sample is written with the Crazyflie time (Timestamp, in ms) and the
+estimated host time (HostTime, ms since the epoch), which samples from
+several blocks or Crazyflies can be merged on. The Crazyflie time is the
+unwrapped timestamp delivered by the log configuration, so it keeps
+increasing during the connection and is stored as it is (64 bits in the
+binary files).
+
+LogWriter writes the samples of a log block as text to a CSV file, straight
+from the callback. BinaryLogWriter instead queues the raw values and
+appends them as fixed width records, from a thread of its own, to a file in
+the NumPy .npy format (a structured array with one field per variable,
+loadable with numpy.load). Convert such a file to CSV with:
+
+    python -m cfclient.utils.logdatawriter <file.npy> [file.csv]
 """
 
 __author__ = 'Bitcraze AB'
-__all__ = ['LogWriter']
+__all__ = ['LogWriter', 'BinaryLogWriter', 'export_csv']
 
 import os
 import sys
+import ast
+import struct
+import time
 import datetime
+import threading
+import collections
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-from cflib.crazyflie.log import LogConfig
+from cflib.crazyflie.log import LogConfig, LogTocElement
 
 import traceback
 
+NPY_MAGIC = "\x93NUMPY\x01\x00"
+# The header is padded to a multiple of this (as recent NumPy does)
+NPY_ALIGNMENT = 64
+
+# The .npy types of the timestamps and of the struct format of each log type
+TIMESTAMP_TYPE = "<u8"
+HOST_TIME_TYPE = "<i8"
+NPY_TYPES = {"B": "|u1", "H": "<u2", "L": "<u4", "I": "<u4", "b": "|i1",
+             "h": "<i2", "i": "<i4", "f": "<f4", "q": "<i8", "Q": "<u8"}
+STRUCT_TYPES = dict((v, k) for (k, v) in NPY_TYPES.items() if k != "I")
+
+# Samples queued by the callback before new ones are dropped
+QUEUE_SIZE = 100000
+# Time in seconds between the checks for queued samples
+POLL_INTERVAL = 0.1
+# Size in bytes of the buffered records that triggers a write
+FLUSH_SIZE = 64 * 1024
+# Max time in seconds before buffered records are written to the file
+FLUSH_INTERVAL = 1.0
+
+
+def _npy_header(fields, count, size=0):
+    """Return the .npy header for count records of the fields, a list of
+    (name, type) tuples, padded to at least size bytes"""
+    descr = "[%s]" % ", ".join("(%r, %r)" % (str(name), str(npy_type))
+                               for (name, npy_type) in fields)
+    header = "{'descr': %s, 'fortran_order': False, 'shape': (%d,), }" % (
+        descr, count)
+    # Leave room for a count of up to 10 digits, so the header can be
+    # updated in place as records are added
+    length = len(NPY_MAGIC) + 2 + len(header) + 10 + 1
+    length = max(size, length + -length % NPY_ALIGNMENT)
+    header += " " * (length - len(NPY_MAGIC) - 2 - len(header) - 1) + "\n"
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header
+
+
+def read_npy_header(f):
+    """Read the .npy header of the file f. Return a tuple with the fields,
+    a list of (name, type) tuples, the number of records and the offset
+    of the first record."""
+    magic = f.read(len(NPY_MAGIC))
+    if magic != NPY_MAGIC:
+        raise IOError("Not a version 1.0 .npy file")
+    (length,) = struct.unpack("<H", f.read(2))
+    header = ast.literal_eval(f.read(length))
+    if header["fortran_order"] or len(header["shape"]) != 1:
+        raise IOError("Not a log data file")
+    fields = [(str(name), str(npy_type))
+              for (name, npy_type) in header["descr"]]
+    return (fields, header["shape"][0], len(NPY_MAGIC) + 2 + length)
+
+
+def record_struct(fields):
+    """Return the struct used to pack and unpack the records of fields"""
+    return struct.Struct("<" + "".join(STRUCT_TYPES[npy_type]
+                                       for (name, npy_type) in fields))
+
+
+def export_csv(filename, csv_filename):
+    """Convert a log data file written by BinaryLogWriter to the CSV format
+    written by LogWriter"""
+    with open(filename, "rb") as f:
+        (fields, count, offset) = read_npy_header(f)
+        record = record_struct(fields)
+        f.seek(offset)
+        with open(csv_filename, "w") as out:
+            out.write(",".join(["Timestamp"] +
+                               [name for (name, npy_type) in fields[1:]]))
+            out.write("\n")
+            chunk = max(1, FLUSH_SIZE / record.size)
+            while count > 0:
+                n = min(count, chunk)
+                data = f.read(n * record.size)
+                n = len(data) / record.size
+                if n == 0:
+                    break
+                lines = []
+                for i in range(n):
+                    values = record.unpack_from(data, i * record.size)
+                    lines.append("%d," % values[0] +
+                                 ",".join(map(str, values[1:])))
+                lines.append("")
+                out.write("\n".join(lines))
+                count -= n
+
 
 class LogWriter():
     """Create a writer for a specific log block"""
@@ -65,7 +170,7 @@ class LogWriter():
     def _write_header(self):
         """Write the header to the file"""
         if not self._header_written:
-            s = "Timestamp"
+            s = "Timestamp,HostTime"
             for v in self._block.variables:
                 s += "," + v.name
                 self._header_values.append(v.name)
@@ -76,7 +181,8 @@ class LogWriter():
     def _new_data(self, timestamp, data, logconf):
         """Callback when new data arrives from the Crazyflie"""
         if self._file:
-            s = "%d" % timestamp
+            s = "%d,%d" % (timestamp,
+                           int(round(logconf.host_time * 1000)))
             for col in self._header_values:
                 s += "," + str(data[col])
             s += '\n'
@@ -116,4 +222,158 @@ class LogWriter():
             self._write_header()
             self._block.data_received_cb.add_callback(self._new_data)
             logger.info("Started logging of block [%s] to file [%s]",
-                        self._block.name, self._filename)
\ No newline at end of file
+                        self._block.name, self._filename)
+
+class BinaryLogWriter(object):
+    """Create a writer for a specific log block that writes the samples to
+    a binary .npy file from a thread of its own. It's used the same way as
+    LogWriter."""
+
+    def __init__(self, logblock, connected_ts=None, directory=None):
+        """Initialize the writer"""
+        self._block = logblock
+        self._dir = os.path.join(sys.path[1], "logdata",
+                                 connected_ts.strftime("%Y%m%dT%H-%M-%S"))
+        self._filename = None
+        self._samples = collections.deque()
+        self._thread = None
+        # Number of samples dropped since the writer could not keep up
+        self.dropped = 0
+
+    def _new_values(self, timestamp, values, logconf, host_time):
+        """Callback when new data arrives from the Crazyflie, the values are
+        only queued here (appending to a deque needs no lock)"""
+        if len(self._samples) < QUEUE_SIZE:
+            self._samples.append((timestamp, int(round(host_time * 1000)),
+                                  values))
+        else:
+            self.dropped += 1
+
+    def writing(self):
+        """Return True if the file is open and we are using it,
+        otherwise false"""
+        return self._thread is not None
+
+    def stop(self):
+        """Stop the logging to file, after writing all the queued samples"""
+        if self._thread:
+            self._block.values_received_cb.remove_callback(self._new_values)
+            self._thread.stop()
+            self._thread = None
+            logger.info("Stopped logging of block [%s] to file [%s]",
+                        self._block.name, self._filename)
+            if self.dropped:
+                logger.warning("Dropped %d samples of block [%s], the disk "
+                               "could not keep up", self.dropped,
+                               self._block.name)
+
+    def start(self):
+        """Start the logging to file"""
+
+        # Due to concurrency let's not check first, just create
+        try:
+            os.makedirs(self._dir)
+        except OSError:
+            logger.debug("logdata directory already exists")
+
+        if not self._thread:
+            time_now = datetime.datetime.now()
+            name = "{0}-{1}.npy".format(self._block.name,
+                                        time_now.strftime(
+                                            "%Y%m%dT%H-%M-%S"))
+            self._filename = os.path.join(self._dir, name)
+            fields = [("Timestamp", TIMESTAMP_TYPE),
+                      ("HostTime", HOST_TIME_TYPE)]
+            for v in self._block.variables:
+                unpack_string = LogTocElement.get_unpack_string_from_id(
+                    v.fetch_as)
+                fields.append((v.name, NPY_TYPES[unpack_string[1:]]))
+            self.dropped = 0
+            self._samples.clear()
+            self._thread = _WriterThread(open(self._filename, "wb"), fields,
+                                         self._samples)
+            self._thread.start()
+            self._block.values_received_cb.add_callback(self._new_values)
+            logger.info("Started logging of block [%s] to file [%s]",
+                        self._block.name, self._filename)
+
+
+class _WriterThread(threading.Thread):
+    """Thread that packs the queued samples into records and writes them in
+    batches, updating the number of records in the header after each
+    write"""
+
+    def __init__(self, f, fields, samples):
+        threading.Thread.__init__(self, name="LogWriter")
+        self.daemon = True
+        self._file = f
+        self._fields = fields
+        self._samples = samples
+        self._stop = threading.Event()
+        self._record = record_struct(fields)
+        self._count = 0
+        self._header_size = len(_npy_header(fields, 0))
+
+    def stop(self):
+        """Write the queued samples, close the file and wait until done"""
+        self._stop.set()
+        self.join()
+
+    def _write(self, data):
+        """Append the records in data and update the header"""
+        self._file.write(data)
+        self._count += len(data) / self._record.size
+        self._file.seek(0)
+        self._file.write(_npy_header(self._fields, self._count,
+                                     self._header_size))
+        self._file.seek(0, os.SEEK_END)
+        self._file.flush()
+
+    def run(self):
+        pack = self._record.pack
+        popleft = self._samples.popleft
+        self._file.write(_npy_header(self._fields, 0))
+        records = []
+        last_flush = time.time()
+        try:
+            while True:
+                stopping = self._stop.wait(POLL_INTERVAL)
+                while self._samples:
+                    (timestamp, host_time, values) = popleft()
+                    records.append(pack(timestamp, host_time, *values))
+                now = time.time()
+                if records and (stopping or
+                                len(records) * self._record.size >=
+                                FLUSH_SIZE or
+                                now - last_flush >= FLUSH_INTERVAL):
+                    self._write("".join(records))
+                    records = []
+                    last_flush = now
+                if stopping:
+                    break
+        except Exception:
+            logger.error("Could not write log data: %s",
+                         traceback.format_exc())
+        finally:
+            self._file.close()
+
+
+def main():
+    """Convert a log data file to CSV"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="logdatawriter")
+    parser.add_argument("filename", help="Log data file (.npy) to convert")
+    parser.add_argument("csv_filename", nargs="?",
+                        help="CSV file to write, defaults to the name of the"
+                             " log data file with the extension .csv")
+    args = parser.parse_args()
+
+    csv_filename = args.csv_filename
+    if not csv_filename:
+        csv_filename = os.path.splitext(args.filename)[0] + ".csv"
+    export_csv(args.filename, csv_filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -39,6 +39,7 @@ from cflib.crazyflie import Crazyflie
 import cfclient.utils
 from cfclient.utils.input import JoystickReader
 from cfclient.utils.config import Config
+from cfclient.utils.periodictimer import PeriodicTimer
 
 if os.name == 'posix':
     print 'Disabling standard output for libraries!'
@@ -91,13 +92,25 @@ class HeadlessClient():
         self._cf.connection_failed.add_callback(self._connection_failed)
         self._cf.param.add_update_callback(group="imu_sensors", name="HMC5883L",
                 cb=(lambda name, found:
-                    self._jr.setAltHoldAvailable(eval(found))))
+                    self._jr.setAltHoldAvailable(found)), typed=True)
         self._jr.althold_updated.add_callback(
                 lambda enabled: self._cf.param.set_value("flightmode.althold", enabled))
 
         self._cf.open_link(link_uri)
         self._jr.input_updated.add_callback(self._cf.commander.send_setpoint)
 
+    def print_link_statistics(self):
+        """Print a summary of the link statistics"""
+        stats = self._cf.get_link_statistics()
+        if not stats:
+            return
+        latency = stats["latency_p50"]
+        print ("Link: in={packets_in} out={packets_out} "
+               "empty_acks={empty_ack_ratio:.0%} lost={lost} "
+               "drops={drops} queues={in_queue}/{out_queue} "
+               "retries={retries}".format(**stats) +
+               (" rtt_p50={:.2f}ms".format(latency * 1000) if latency else ""))
+
     def _connection_failed(self, link, message):
         """Callback for a failed Crazyflie connection"""
         print "Connection failed on {}: {}".format(link, message)
@@ -134,6 +147,9 @@ def main():
     parser.add_argument("-x", "--x-mode", action="store_true", 
                         dest="xmode", 
                         help="Enable client-side X-mode") 
+    parser.add_argument("-s", "--stats", action="store", type=float,
+                        dest="stats", default=0,
+                        help="Print link statistics every STATS seconds")
     (args, unused) = parser.parse_known_args()
 
     if args.debug:
@@ -151,6 +167,10 @@ def main():
                                       input_device=args.controller,
                                       xmode=args.xmode)
             headless.connect_crazyflie(link_uri=args.uri)
+            if args.stats > 0:
+                stats_timer = PeriodicTimer(args.stats,
+                                            headless.print_link_statistics)
+                stats_timer.start()
         else:
             print "No input-device connected, exiting!"
 
@@ -42,20 +42,27 @@ import logging
 logger = logging.getLogger(__name__)
 import time
 import datetime
+from collections import deque
 from threading import Thread
 
-from threading import Timer, Lock
+from threading import Lock
 
 from .commander import Commander
 from .console import Console
-from .param import Param
+from .param import Param, PARAM_WINDOW
 from .log import Log
-from .toccache import TocCache
+from .toccache import get_shared_cache
+from .retry import PendingRequests
+from .toc import TOC_FETCH_WINDOW
 
 import cflib.crtp
 
 from cflib.utils.callbacks import Caller
 
+# Timeout in seconds when waiting for incoming packets, calls queued with
+# queue_call are done at the latest after this
+RECEIVE_TIMEOUT = 0.1
+
 
 class State:
     """Stat of the connection procedure"""
@@ -68,38 +75,56 @@ class State:
 class Crazyflie():
     """The Crazyflie class"""
 
-    # Called on disconnect, no matter the reason
-    disconnected = Caller()
-    # Called on unintentional disconnect only
-    connection_lost = Caller()
-    # Called when the first packet in a new link is received
-    link_established = Caller()
-    # Called when the user requests a connection
-    connection_requested = Caller()
-    # Called when the link is established and the TOCs (that are not cached)
-    # have been downloaded
-    connected = Caller()
-    # Called if establishing of the link fails (i.e times out)
-    connection_failed = Caller()
-    # Called for every packet received
-    packet_received = Caller()
-    # Called for every packet sent
-    packet_sent = Caller()
-    # Called when the link driver updates the link quality measurement
-    link_quality_updated = Caller()
-
     state = State.DISCONNECTED
 
-    def __init__(self, link=None, ro_cache=None, rw_cache=None):
+    def __init__(self, link=None, ro_cache=None, rw_cache=None,
+                 toc_fetch_window=TOC_FETCH_WINDOW,
+                 param_window=PARAM_WINDOW):
         """
         Create the objects from this module and register callbacks.
 
         ro_cache -- Path to read-only cache (string)
         rw_cache -- Path to read-write cache (string)
+        toc_fetch_window -- Number of TOC elements requested at the same
+                            time when downloading the TOCs (int)
+        param_window -- Number of parameter reads and writes waiting for
+                        an answer at the same time (int)
         """
+        # The callbacks are created for every instance, so that several
+        # Crazyflies can be used at the same time
+        # Called on disconnect, no matter the reason
+        self.disconnected = Caller()
+        # Called on unintentional disconnect only
+        self.connection_lost = Caller()
+        # Called when the first packet in a new link is received
+        self.link_established = Caller()
+        # Called when the user requests a connection
+        self.connection_requested = Caller()
+        # Called when the link is established and the TOCs (that are not
+        # cached) have been downloaded
+        self.connected = Caller()
+        # Called if establishing of the link fails (i.e times out)
+        self.connection_failed = Caller()
+        # Called for every packet received
+        self.packet_received = Caller()
+        # Called for every packet sent
+        self.packet_sent = Caller()
+        # Called before packet_sent for packets that are resent since they
+        # were not answered in time
+        self.packet_resent = Caller()
+        # Called when the link driver updates the link quality measurement
+        self.link_quality_updated = Caller()
+
         self.link = link
-        self._toc_cache = TocCache(ro_cache=ro_cache,
-                                   rw_cache=rw_cache)
+        self.toc_fetch_window = toc_fetch_window
+        self.param_window = param_window
+        self._log_toc_ready = False
+        self._param_toc_ready = False
+        # The TOCs are shared with the other Crazyflies using the same
+        # cache directories
+        self._toc_cache = get_shared_cache(ro_cache=ro_cache,
+                                           rw_cache=rw_cache)
+        self._toc_lock = Lock()
 
         self.incoming = _IncomingPacketHandler(self)
         self.incoming.setDaemon(True)
@@ -116,7 +141,8 @@ class Crazyflie():
         self.packet_received.add_callback(self._check_for_initial_packet_cb)
         self.packet_received.add_callback(self._check_for_answers)
 
-        self._answer_patterns = {}
+        self._pending_requests = PendingRequests(self._no_answer_do_retry,
+                                                 self._no_answer_timeout)
 
         self._send_lock = Lock()
 
@@ -144,23 +170,46 @@ class Crazyflie():
     def _disconnected(self, link_uri):
         """ Callback when disconnected."""
         self.connected_ts = None
+        # Stop waiting for TOCs downloaded by other Crazyflies and let them
+        # take over the TOCs we were downloading
+        self._toc_cache.release(self)
 
     def _start_connection_setup(self):
-        """Start the connection setup by refreshing the TOCs"""
+        """Start the connection setup by refreshing the TOCs. The log and
+        param TOCs are downloaded at the same time."""
         logger.info("We are connected[%s], request connection setup",
                     self.link_uri)
+        self._log_toc_ready = False
+        self._param_toc_ready = False
         self.log.refresh_toc(self._log_toc_updated_cb, self._toc_cache)
+        self.param.refresh_toc(self._param_toc_updated_cb, self._toc_cache)
+
+    def _toc_updated(self):
+        """Called when one of the TOCs has been fully updated, the
+        connection is set up when both are done. The TOC callbacks are
+        called from the thread handling incoming packets, also when another
+        Crazyflie downloaded the TOC (see queue_call)."""
+        with self._toc_lock:
+            done = self._log_toc_ready and self._param_toc_ready
+            if done:
+                # Only signal the connection once
+                self._log_toc_ready = False
+                self._param_toc_ready = False
+        if done:
+            self.connected_ts = datetime.datetime.now()
+            self.connected.call(self.link_uri)
 
     def _param_toc_updated_cb(self):
         """Called when the param TOC has been fully updated"""
         logger.info("Param TOC finished updating")
-        self.connected_ts = datetime.datetime.now()
-        self.connected.call(self.link_uri)
+        self._param_toc_ready = True
+        self._toc_updated()
 
     def _log_toc_updated_cb(self):
         """Called when the log TOC has been fully updated"""
         logger.info("Log TOC finished updating")
-        self.param.refresh_toc(self._param_toc_updated_cb, self._toc_cache)
+        self._log_toc_ready = True
+        self._toc_updated()
 
     def _link_error_cb(self, errmsg):
         """Called from the link driver when there's an error"""
@@ -237,7 +286,7 @@ class Crazyflie():
         if (self.link is not None):
             self.link.close()
             self.link = None
-        self._answer_patterns = {}
+        self._pending_requests.stop()
         self.disconnected.call(self.link_uri)
 
     def add_port_callback(self, port, cb):
@@ -248,76 +297,129 @@ class Crazyflie():
         """Remove the callback cb on port"""
         self.incoming.remove_port_callback(port, cb)
 
+    def queue_call(self, func, *args):
+        """Call func with args from the thread handling incoming packets,
+        i.e for handing over results computed by another thread"""
+        self.incoming.queue_call(func, *args)
+
+    def get_link_statistics(self):
+        """
+        Return a snapshot of the statistics of the current link as a
+        dictionary (packets and bytes per port, ack retries, empty acks,
+        queue depths, round-trip latency percentiles and drops), see
+        cflib.crtp.linkstats. An empty dictionary is returned if there's no
+        link.
+        """
+        link = self.link
+        if link is None:
+            return {}
+        return link.get_statistics()
+
+    def get_request_stats(self):
+        """
+        Return a dictionary with statistics about the requests sent to the
+        Crazyflie that expects an answer (number of pending, answered,
+        retried and timed out requests and the answer latency).
+        """
+        return self._pending_requests.get_stats()
+
     def _no_answer_do_retry(self, pk, pattern):
         """Resend packets that we have not gotten answers to"""
         logger.debug("Resending for pattern %s", pattern)
-        # Set the timer to None before trying to send again
         self.send_packet(pk, expected_reply=pattern, resend=True)
 
+    def _no_answer_timeout(self, pk, pattern):
+        """Called when a request is given up. If the connection is not set
+        up yet (i.e the TOCs are being downloaded), the setup fails."""
+        link = self.link
+        if link is None or self.connected_ts is not None:
+            return
+        message = "No answer from the Crazyflie to the request %s" % (
+            pattern,)
+        logger.warning(message)
+        self.link = None
+        link.close()
+        self._pending_requests.stop()
+        self.state = State.DISCONNECTED
+        self._toc_cache.release(self)
+        self.connection_failed.call(self.link_uri, message)
+
     def _check_for_answers(self, pk):
         """
         Callback called for every packet received to check if we are
-        waiting for an answer on this port. If so, then cancel the retry
-        timer.
+        waiting for an answer on this port. If so, then remove the request
+        so it's not resent anymore.
         """
-        longest_match = ()
-        if len(self._answer_patterns) > 0:
-            data = (pk.header,) + pk.datat
-            for p in self._answer_patterns.keys():
-                logger.debug("Looking for pattern match on %s vs %s", p, data)
-                if len(p) <= len(data):
-                    if p == data[0:len(p)]:
-                        match = data[0:len(p)]
-                        if len(match) >= len(longest_match):
-                            logger.debug("Found new longest match %s", match)
-                            longest_match = match
-        if len(longest_match) > 0:
-            del self._answer_patterns[longest_match]
-
-    def send_packet(self, pk, expected_reply=(), resend=False):
+        self._pending_requests.match(pk)
+
+    def send_packet(self, pk, expected_reply=(), resend=False,
+                    retry_policy=None, timeout_callback=None):
         """
         Send a packet through the link interface.
 
         pk -- Packet to send
-        expect_answer -- True if a packet from the Crazyflie is expected to
-                         be sent back, otherwise false
+        expected_reply -- The first bytes of the answer that is expected to
+                          be sent back from the Crazyflie. The packet is
+                          resent until an answer is received.
+        resend -- True if this is a resend of a packet that is already
+                  waiting for an answer
+        retry_policy -- RetryPolicy used if no answer is received, None
+                        means the default policy
+        timeout_callback -- Called with (pk, pattern) if no answer is
+                            received before the retries of retry_policy
+                            have run out. If the connection is being set
+                            up, it also fails (connection_failed is called).
 
         """
         self._send_lock.acquire()
         if (self.link is not None):
-            self.link.send_packet(pk)
-            self.packet_sent.call(pk)
             if len(expected_reply) > 0 and not resend:
-                pattern = (pk.header,) + expected_reply
+                pattern = (pk.header,) + tuple(expected_reply)
                 logger.debug("Sending packet and expecting the %s pattern back",
                              pattern)
-                new_timer = Timer(0.2,
-                                  lambda: self._no_answer_do_retry(pk, pattern))
-                self._answer_patterns[pattern] = new_timer
-                new_timer.start()
-            elif resend:
-                # Check if we have gotten an answer, if not try again
-                pattern = expected_reply
-                if pattern in self._answer_patterns:
-                    logger.debug("We want to resend and the pattern is there")
-                    if self._answer_patterns[pattern]:
-                        new_timer = Timer(0.2,
-                                          lambda:
-                                          self._no_answer_do_retry(
-                                              pk, pattern))
-                        self._answer_patterns[pattern] = new_timer
-                        new_timer.start()
-                else:
-                    logger.debug("Resend requested, but no pattern found: %s",
-                                 self._answer_patterns)
+                self._pending_requests.add(pk, pattern, retry_policy,
+                                           timeout_callback)
+            if resend:
+                self.packet_resent.call(pk)
+            self.link.send_packet(pk)
+            self.packet_sent.call(pk)
         self._send_lock.release()
 
+
 class _IncomingPacketHandler(Thread):
     """Handles incoming packets and sends the data to the correct receivers"""
     def __init__(self, cf):
         Thread.__init__(self)
         self.cf = cf
         self.cb = []
+        # The dispatch table has one entry for every possible header byte,
+        # each entry is a tuple with the callbacks matching the header and
+        # a flag telling if the packet is considered handled by them. The
+        # list of callbacks and the table are never modified in place,
+        # instead new ones are built and swapped in under the lock. This way
+        # the receiving thread can use them without locking.
+        self._cb_lock = Lock()
+        self._dispatch_table = self._build_dispatch_table(self.cb)
+        # Calls queued by other threads, done between the packets
+        self._calls = deque()
+
+    @staticmethod
+    def _build_dispatch_table(callbacks):
+        """Build the header-byte to callbacks lookup table"""
+        table = []
+        for header in range(256):
+            port = (header & 0xF0) >> 4
+            channel = header & 0x03
+            matching = []
+            found = False
+            for cb in callbacks:
+                if (cb[0] == port & cb[1] and
+                        cb[2] == channel & cb[3]):
+                    matching.append(cb[4])
+                    if (cb[0] != 0xFF):
+                        found = True
+            table.append((tuple(matching), found))
+        return table
 
     def add_port_callback(self, port, cb):
         """Add a callback for data that comes on a specific port"""
@@ -327,9 +429,11 @@ class _IncomingPacketHandler(Thread):
     def remove_port_callback(self, port, cb):
         """Remove a callback for data that comes on a specific port"""
         logger.debug("Removing callback on port [%d] to [%s]", port, cb)
-        for port_callback in self.cb:
-            if (port_callback[0] == port and port_callback[4] == cb):
-                self.cb.remove(port_callback)
+        with self._cb_lock:
+            self.cb = [port_callback for port_callback in self.cb
+                       if not (port_callback[0] == port and
+                               port_callback[4] == cb)]
+            self._dispatch_table = self._build_dispatch_table(self.cb)
 
     def add_header_callback(self, cb, port, channel, port_mask=0xFF,
                             channel_mask=0xFF):
@@ -338,14 +442,32 @@ class _IncomingPacketHandler(Thread):
         possibility to add a mask for channel and port for multiple
         hits for same callback.
         """
-        self.cb.append([port, port_mask, channel, channel_mask, cb])
+        with self._cb_lock:
+            self.cb = self.cb + [[port, port_mask, channel, channel_mask, cb]]
+            self._dispatch_table = self._build_dispatch_table(self.cb)
+
+    def queue_call(self, func, *args):
+        """Call func with args from this thread"""
+        self._calls.append((func, args))
+
+    def _do_calls(self):
+        """Do the queued calls"""
+        while self._calls:
+            (func, args) = self._calls.popleft()
+            try:
+                func(*args)
+            except Exception:  # pylint: disable=W0703
+                import traceback
+                logger.warning("Exception while doing queued call [%s]\n\n%s",
+                               func, traceback.format_exc())
 
     def run(self):
         while(True):
+            self._do_calls()
             if self.cf.link is None:
-                time.sleep(1)
+                time.sleep(RECEIVE_TIMEOUT)
                 continue
-            pk = self.cf.link.receive_packet(1)
+            pk = self.cf.link.receive_packet(RECEIVE_TIMEOUT)
 
             if pk is None:
                 continue
@@ -353,22 +475,18 @@ class _IncomingPacketHandler(Thread):
             #All-packet callbacks
             self.cf.packet_received.call(pk)
 
-            found = False
-            for cb in self.cb:
-                if (cb[0] == pk.port & cb[1] and
-                        cb[2] == pk.channel & cb[3]):
-                    try:
-                        cb[4](pk)
-                    except Exception:  # pylint: disable=W0703
-                        # Disregard pylint warning since we want to catch all
-                        # exceptions and we can't know what will happen in
-                        # the callbacks.
-                        import traceback
-                        logger.warning("Exception while doing callback on port"
-                                       " [%d]\n\n%s", pk.port,
-                                       traceback.format_exc())
-                    if (cb[0] != 0xFF):
-                        found = True
+            (callbacks, found) = self._dispatch_table[pk.header & 0xFF]
+            for cb in callbacks:
+                try:
+                    cb(pk)
+                except Exception:  # pylint: disable=W0703
+                    # Disregard pylint warning since we want to catch all
+                    # exceptions and we can't know what will happen in
+                    # the callbacks.
+                    import traceback
+                    logger.warning("Exception while doing callback on port"
+                                   " [%d]\n\n%s", pk.port,
+                                   traceback.format_exc())
 
             if not found:
                 logger.warning("Got packet on header (%d,%d) but no callback "
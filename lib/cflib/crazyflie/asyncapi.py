@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+asyncio front-end for the Crazyflie API.
+
+The Crazyflie API calls its callbacks from the threads of the link
+drivers. AsyncCrazyflie wraps a Crazyflie so that it can be used from
+coroutines running in an event loop. All the callbacks of all the
+Crazyflies used with the same loop are handed over to it through one
+queue, and the loop is woken up once per batch of calls instead of once
+per call, so many Crazyflies can be driven from one loop.
+
+Since the library runs on Python 2 this module uses trollius, the Python
+2 port of asyncio (pip install trollius). The module can be imported
+without it, but AsyncCrazyflie can then not be used. Coroutines are
+written using yield From() instead of await:
+
+    @asyncio.coroutine
+    def run(loop):
+        cf = AsyncCrazyflie(loop=loop)
+        yield From(cf.connect("radio://0/80/2M"))
+        value = yield From(cf.param.get("pid_rate.roll_kp"))
+        yield From(cf.param.set("pid_rate.roll_kp", 70))
+        stream = cf.log.stream(log_config)
+        while True:
+            sample = yield From(stream.get())
+            if sample is None:
+                break
+            (timestamp, data) = sample
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['AsyncCrazyflie', 'AsyncParam', 'AsyncLog', 'LogStream']
+
+import collections
+import weakref
+from threading import Lock
+
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+except ImportError:
+    asyncio = None
+
+from cflib.crazyflie import Crazyflie
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _coroutine(func):
+    """Make func a coroutine, it's left as it is if trollius is missing"""
+    if asyncio is None:
+        return func
+    return asyncio.coroutine(func)
+
+
+class _LoopHandoff(object):
+    """
+    Hands calls over from any thread to an event loop. The calls are
+    queued and run in order by the loop, which is only woken up when the
+    queue was empty.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._calls = collections.deque()
+        self._scheduled = False
+        self._lock = Lock()
+
+    def call(self, function, *args):
+        """Run function(*args) in the loop"""
+        self._calls.append((function, args))
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._loop.call_soon_threadsafe(self._run)
+
+    def _run(self):
+        # Reset before running the calls, so calls queued from now on
+        # schedule a new run
+        with self._lock:
+            self._scheduled = False
+        calls = self._calls
+        while calls:
+            (function, args) = calls.popleft()
+            try:
+                function(*args)
+            except Exception:
+                logger.exception("Error in call handed over to the loop")
+
+# One handoff per event loop
+_handoffs = weakref.WeakKeyDictionary()
+_handoffs_lock = Lock()
+
+
+def _get_handoff(loop):
+    with _handoffs_lock:
+        handoff = _handoffs.get(loop)
+        if handoff is None:
+            handoff = _LoopHandoff(loop)
+            _handoffs[loop] = handoff
+        return handoff
+
+
+class AsyncCrazyflie(object):
+    """A Crazyflie used from coroutines running in an event loop"""
+
+    def __init__(self, cf=None, loop=None, **kwargs):
+        """
+        cf -- The Crazyflie to use, a new one is created (using kwargs as
+              arguments) if not supplied
+        loop -- The event loop, the default one is used if not supplied
+        """
+        if asyncio is None:
+            raise Exception("The asyncio front-end needs trollius")
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        if cf is None:
+            cf = Crazyflie(**kwargs)
+        self.cf = cf
+        self.loop = loop
+        self.commander = cf.commander
+        self._handoff = _get_handoff(loop)
+        self._connecting = None
+
+        self.param = AsyncParam(self)
+        self.log = AsyncLog(self)
+
+        handoff = self._handoff
+        cf.connected.add_callback(
+            lambda uri: handoff.call(self._connected, uri))
+        cf.connection_failed.add_callback(
+            lambda uri, msg: handoff.call(self._failed, uri, msg))
+        cf.disconnected.add_callback(
+            lambda uri: handoff.call(self._disconnected, uri))
+
+    def call_in_loop(self, function, *args):
+        """Run function(*args) in the event loop, can be called from any
+        thread"""
+        self._handoff.call(function, *args)
+
+    @_coroutine
+    def connect(self, uri):
+        """Open the link to uri and return when the Crazyflie is connected
+        and its TOCs are downloaded. Raises an exception if the connection
+        fails."""
+        self._connecting = asyncio.Future(loop=self.loop)
+        self.cf.open_link(uri)
+        yield From(self._connecting)
+
+    def close(self):
+        """Close the link"""
+        self.cf.close_link()
+
+    def _connected(self, uri):
+        if self._connecting is not None and not self._connecting.done():
+            self._connecting.set_result(uri)
+
+    def _failed(self, uri, msg):
+        if self._connecting is not None and not self._connecting.done():
+            self._connecting.set_exception(
+                Exception("Connection to {} failed: {}".format(uri, msg)))
+
+    def _disconnected(self, uri):
+        self._failed(uri, "Disconnected")
+        self.log.close_streams()
+
+
+class AsyncParam(object):
+    """Reads and writes parameters of an AsyncCrazyflie"""
+
+    def __init__(self, acf):
+        self.acf = acf
+        self.param = acf.cf.param
+
+    def _check(self, complete_name, write=False):
+        element = self.param.toc.get_element_by_complete_name(complete_name)
+        if element is None:
+            raise Exception("[{}] is not in the TOC".format(complete_name))
+        if write and element.get_readable_access() == "RO":
+            raise Exception("[{}] is read only".format(complete_name))
+
+    @_coroutine
+    def _request(self, complete_name, send, *args):
+        """Call send(*args) and return the next value of the parameter.
+        Raises an exception if the Crazyflie doesn't answer."""
+        future = asyncio.Future(loop=self.acf.loop)
+        (group, name) = complete_name.split(".", 1)
+
+        def resolve(value):
+            if not future.done():
+                future.set_result(value)
+
+        def reject(message):
+            if not future.done():
+                future.set_exception(Exception("Could not read or write [{}]:"
+                                               " {}".format(complete_name,
+                                                            message)))
+
+        def updated(updated_name, value):
+            self.acf.call_in_loop(resolve, value)
+
+        def failed(failed_name, message):
+            if failed_name == complete_name:
+                self.acf.call_in_loop(reject, message)
+
+        self.param.add_update_callback(group, name, updated, typed=True)
+        self.param.param_failed_cb.add_callback(failed)
+        try:
+            send(*args)
+            value = yield From(future)
+        finally:
+            self.param.remove_update_callback(group, name, updated,
+                                              typed=True)
+            self.param.param_failed_cb.remove_callback(failed)
+        raise Return(value)
+
+    @_coroutine
+    def get(self, complete_name):
+        """Read the value (int or float) of a parameter from the
+        Crazyflie"""
+        self._check(complete_name)
+        value = yield From(self._request(complete_name,
+                                         self.param.request_param_update,
+                                         complete_name))
+        raise Return(value)
+
+    @_coroutine
+    def set(self, complete_name, value):
+        """Set the value of a parameter and return the value the Crazyflie
+        answered with. Raises a ValueError if the value is not valid for
+        the type of the parameter."""
+        self._check(complete_name, write=True)
+        value = yield From(self._request(complete_name, self.param.set_value,
+                                         complete_name, value))
+        raise Return(value)
+
+
+class AsyncLog(object):
+    """Streams log data from an AsyncCrazyflie"""
+
+    def __init__(self, acf):
+        self.acf = acf
+        self._streams = []
+
+    def stream(self, config, maxsize=100):
+        """
+        Add and start the log configuration (if not done already) and return
+        a LogStream with its samples. When maxsize samples are waiting to be
+        read the oldest ones are dropped, the logging isn't stopped since
+        the configuration could be used by others too.
+        """
+        if config.cf is None:
+            self.acf.cf.log.add_config(config)
+        if not config.valid:
+            raise Exception("Log configuration [{}] is not valid".format(
+                config.name))
+        stream = LogStream(self.acf, config, maxsize)
+        self._streams.append(stream)
+        config.start()
+        return stream
+
+    def close_streams(self):
+        """Close all the streams"""
+        for stream in self._streams:
+            stream.close()
+        self._streams = []
+
+
+class LogStream(object):
+    """
+    The samples of a log configuration, as (timestamp, {name: value}),
+    read with the coroutine get().
+    """
+
+    def __init__(self, acf, config, maxsize):
+        self.acf = acf
+        self.config = config
+        self.maxsize = maxsize
+        # Number of samples dropped because maxsize samples were waiting
+        self.dropped = 0
+        self.closed = False
+        self._samples = collections.deque()
+        self._waiter = None
+        config.data_received_cb.add_callback(self._data_received)
+
+    def _data_received(self, timestamp, data, config):
+        self.acf.call_in_loop(self._put, (timestamp, data))
+
+    def _put(self, sample):
+        if self.closed:
+            return
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(sample)
+            return
+        samples = self._samples
+        if len(samples) >= self.maxsize:
+            samples.popleft()
+            self.dropped += 1
+        samples.append(sample)
+
+    @_coroutine
+    def get(self):
+        """Return the next sample, or None when the stream is closed"""
+        samples = self._samples
+        if samples:
+            raise Return(samples.popleft())
+        if self.closed:
+            raise Return(None)
+        self._waiter = asyncio.Future(loop=self.acf.loop)
+        sample = yield From(self._waiter)
+        self._waiter = None
+        raise Return(sample)
+
+    def close(self):
+        """End the stream, the logging is stopped if nothing else uses the
+        configuration"""
+        if self.closed:
+            return
+        self.closed = True
+        config = self.config
+        config.data_received_cb.remove_callback(self._data_received)
+        if (self.acf.cf.link is not None and
+                not config.data_received_cb.callbacks and
+                not config.values_received_cb.callbacks):
+            config.stop()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
@@ -64,13 +64,16 @@ States of a configuration:
 """
 
 __author__ = 'Bitcraze AB'
-__all__ = ['Log', 'LogTocElement']
+__all__ = ['Log', 'LogTocElement', 'LogPlan', 'LogSubscription']
 
 import struct
 import errno
+import threading
 from cflib.crtp.crtpstack import CRTPPacket, CRTPPort
 from cflib.utils.callbacks import Caller
 from .toc import Toc, TocFetcher
+from .timebase import Timebase
+from .retry import SETUP_RETRY_POLICY
 
 # Channels used for the logging port
 CHAN_TOC = 0
@@ -142,11 +145,29 @@ class LogConfig(object):
 
     def __init__(self, name, period_in_ms):
         """Initialize the entry"""
+        # Called with (timestamp, {name: value}, config) for every sample.
+        # The timestamp is the Crazyflie time in ms, unwrapped so it keeps
+        # increasing during the connection (it used to be the raw 24 bit
+        # timestamp of the packet, that wraps around after about 4.6
+        # hours). The host time of the sample is in host_time during the
+        # call.
         self.data_received_cb = Caller()
+        # Called with (timestamp, (value, ...), config, host_time) for every
+        # sample, the values are in the same order as the names in
+        # variable_names
+        self.values_received_cb = Caller()
+        # Host time (in seconds, like time.time()) of the sample being
+        # delivered, estimated from the clock of the Crazyflie when the
+        # packet is received (see Timebase)
+        self.host_time = None
         self.error_cb = Caller()
         self.started_cb = Caller()
         self.added_cb = Caller()
         self.err_no = 0
+        # True for the configurations shared by the subscriptions (see
+        # Log.subscribe), they are started and deleted by the subscriptions
+        # and should not be stopped or deleted by anyone else
+        self.shared = False
 
         self.id = LogConfig._config_id_counter
         LogConfig._config_id_counter = (LogConfig._config_id_counter + 1) % 255
@@ -159,6 +180,8 @@ class LogConfig(object):
         self.variables = []
         self.default_fetch_as = []
         self.name = name
+        self.variable_names = ()
+        self._decoder = None
 
     def add_variable(self, name, fetch_as=None):
         """Add a new variable to the configuration.
@@ -265,21 +288,403 @@ class LogConfig(object):
                 pk.data = (CMD_DELETE_BLOCK, self.id)
                 self.cf.send_packet(pk, expected_reply=(CMD_DELETE_BLOCK, self.id))
 
-    def unpack_log_data(self, log_data, timestamp):
+    def build_decoder(self):
+        """Compile the layout of the variables into one struct that is used
+        to unpack all the values of a log data packet in one call. This is
+        done when the configuration is added, but has to be redone if
+        variables are added after that."""
+        unpack_string = "<"
+        for var in self.variables:
+            unpack_string += LogTocElement.get_unpack_string_from_id(
+                var.fetch_as)[1:]
+        self._decoder = struct.Struct(unpack_string)
+        self.variable_names = tuple(var.name for var in self.variables)
+
+    def get_data_size(self):
+        """Return the size in bytes of the data in a log data packet"""
+        if self._decoder is None:
+            self.build_decoder()
+        return self._decoder.size
+
+    def unpack_log_data(self, log_data, timestamp, host_time=None):
         """Unpack received logging data so it represent real values according
         to the configuration in the entry"""
-        ret_data = {}
-        data_index = 0
-        for var in self.variables:
-            size = LogTocElement.get_size_from_id(var.fetch_as)
-            name = var.name
-            unpackstring = LogTocElement.get_unpack_string_from_id(
-                var.fetch_as)
-            value = struct.unpack(unpackstring,
-                                  log_data[data_index:data_index + size])[0]
-            data_index += size
-            ret_data[name] = value
-        self.data_received_cb.call(timestamp, ret_data, self)
+        if self._decoder is None:
+            self.build_decoder()
+        values = self._decoder.unpack_from(log_data, 0)
+        self.host_time = host_time
+        if self.values_received_cb.callbacks:
+            self.values_received_cb.call(timestamp, values, self, host_time)
+        if self.data_received_cb.callbacks:
+            self.data_received_cb.call(timestamp,
+                                       dict(zip(self.variable_names, values)),
+                                       self)
+
+
+class LogPlan(object):
+    """A set of variables to log, each at its own period, that are packed
+    automatically into as few log configurations as possible.
+
+    The variables are added with the period they are needed at and the
+    plan is added to the Log with add_plan. The variables are then grouped
+    by period, and packed into log configurations that fit in one log data
+    packet (first fit, biggest variables first). A variable that doesn't
+    fit in a configuration with its own period is put in one with a
+    shorter period if there's room for it, instead of creating a new
+    configuration. The samples of all the configurations are merged into
+    one stream per requested period: data_received_cb of the plan is called
+    once per period with the latest values of all the variables requested
+    at that period, whatever configurations they are logged in."""
+
+    def __init__(self, name):
+        """Initialize the plan"""
+        # Called with (timestamp, {name: value}, plan) once per requested
+        # period, with all the variables requested at that period
+        self.data_received_cb = Caller()
+        # Called with (plan, message) if a configuration could not be added
+        # or started
+        self.error_cb = Caller()
+        self.name = name
+        self.valid = False
+        # The log configurations created when the plan was added
+        self.configs = []
+        # Requested variables by name, as (period in ms, fetch as)
+        self._requests = {}
+        self._order = []
+        # (index, name) of the values in the samples of each configuration,
+        # by configuration id
+        self._deliveries = {}
+        # Names of the variables requested at each period
+        self._groups = {}
+        # The periods delivered when a sample of a configuration arrives,
+        # by configuration id. A period is delivered with the samples of
+        # the slowest configuration holding its variables, when that
+        # sample arrives the values from the other ones are up to date.
+        self._clocks = {}
+        # Latest value of every variable
+        self._values = {}
+        # Timestamp of the last delivery of each period
+        self._last_delivery = {}
+
+    @staticmethod
+    def _quantize_period(period_in_ms):
+        """Return the period in ms as a period supported by the Crazyflie"""
+        return min(max(10, int(period_in_ms) // 10 * 10), 2540)
+
+    def add_variable(self, name, period_in_ms, fetch_as=None):
+        """Add a variable to the plan.
+
+        name - Complete name of the variable in the form group.name
+        period_in_ms - Period the variable is needed at
+        fetch_as - String representation of the type the variable should
+                   be fetched as (i.e FP16 to fetch a float in 2 bytes).
+                   The type it's stored as is used by default.
+
+        If a variable is added several times, the shortest period and the
+        last fetch_as type are used."""
+        period_in_ms = self._quantize_period(period_in_ms)
+        if name in self._requests:
+            period_in_ms = min(period_in_ms, self._requests[name][0])
+            fetch_as = fetch_as or self._requests[name][1]
+        else:
+            self._order.append(name)
+        self._requests[name] = (period_in_ms, fetch_as)
+
+    def create_configs(self, toc):
+        """Pack the variables into log configurations using the types in
+        the TOC toc and return the configurations. None is returned if a
+        variable is missing in the TOC."""
+        variables = []
+        for name in self._order:
+            (period, fetch_as) = self._requests[name]
+            element = toc.get_element_by_complete_name(name)
+            if element is None:
+                logger.warning("%s not in TOC, the plan cannot be used!",
+                               name)
+                return None
+            fetch_as = fetch_as or element.ctype
+            size = LogTocElement.get_size_from_id(
+                LogTocElement.get_id_from_cstring(fetch_as))
+            variables.append((period, -size, name, fetch_as))
+
+        # Fastest and biggest first, so the configurations for the shortest
+        # periods exist when the slower variables are placed
+        blocks = []
+        for (period, size, name, fetch_as) in sorted(variables):
+            size = -size
+            fitting = [b for b in blocks
+                       if b["size"] + size <= MAX_LOG_DATA_PACKET_SIZE and
+                       b["period"] <= period]
+            if fitting:
+                # Prefer the same period, then the closest one, and the
+                # configuration with the least room left
+                block = max(fitting, key=lambda b: (b["period"], b["size"]))
+            else:
+                block = {"period": period, "size": 0, "variables": []}
+                blocks.append(block)
+            block["size"] += size
+            block["variables"].append((name, fetch_as, period))
+
+        self.configs = []
+        self._deliveries = {}
+        self._groups = {}
+        self._clocks = {}
+        self._values = {}
+        self._last_delivery = {}
+        clocks = {}
+        for block in blocks:
+            config = LogConfig("%s-%d" % (self.name, len(self.configs) + 1),
+                               block["period"])
+            deliveries = []
+            for (name, fetch_as, period) in block["variables"]:
+                config.add_variable(name, fetch_as)
+                deliveries.append((len(deliveries), name))
+                self._groups.setdefault(period, []).append(name)
+                clock = clocks.get(period)
+                if clock is None or clock.period_in_ms < config.period_in_ms:
+                    clocks[period] = config
+            self._deliveries[config.id] = deliveries
+            self.configs.append(config)
+        for (period, config) in clocks.items():
+            self._clocks.setdefault(config.id, []).append(period)
+        return self.configs
+
+    def start(self):
+        """Start the logging of all the configurations"""
+        for config in self.configs:
+            config.start()
+
+    def stop(self):
+        """Stop the logging of all the configurations"""
+        for config in self.configs:
+            config.stop()
+
+    def delete(self):
+        """Delete all the configurations in the Crazyflie"""
+        for config in self.configs:
+            config.delete()
+
+    def _config_error(self, config, msg):
+        self.error_cb.call(self, "%s: %s" % (config.name, msg))
+
+    def _values_received(self, timestamp, values, config, host_time):
+        """Store the values of a sample of one of the configurations and
+        deliver the periods it's the clock of that are due"""
+        latest = self._values
+        for (index, name) in self._deliveries[config.id]:
+            latest[name] = values[index]
+        for period in self._clocks.get(config.id, ()):
+            last = self._last_delivery.get(period)
+            # Samples within half a period of the configuration are
+            # delivered, otherwise the period is always rounded up to the
+            # next sample.
+            if (last is not None and
+                    timestamp - last < period - config.period_in_ms / 2):
+                continue
+            names = self._groups[period]
+            # Wait until all the configurations have sent a sample
+            if not all(name in latest for name in names):
+                continue
+            self._last_delivery[period] = timestamp
+            self.data_received_cb.call(
+                timestamp, dict((name, latest[name]) for name in names),
+                self)
+
+
+class LogSubscription(object):
+    """A subscription to variables at a period, created by Log.subscribe.
+
+    The variables are logged in log configurations shared with the other
+    subscriptions. Every time a new sample of the subscribed variables is
+    available data_received_cb is called with the latest values of all the
+    variables."""
+
+    def __init__(self, broker, name, variables, period_in_ms):
+        # Called with (timestamp, {name: value}, subscription), the
+        # timestamp is unwrapped like for LogConfig
+        self.data_received_cb = Caller()
+        # Called with (subscription, message) if a log configuration used
+        # by the subscription could not be added or started
+        self.error_cb = Caller()
+        self.name = name
+        self.variables = tuple(variables)
+        self.period_in_ms = period_in_ms
+        self.valid = False
+        self._broker = broker
+        self._values = {}
+        # Timestamp of the last sample used by configuration id
+        self._last_sample = {}
+
+    def unsubscribe(self):
+        """Stop the subscription, the log configurations that are not used
+        anymore are deleted"""
+        self._broker.unsubscribe(self)
+
+    def _update(self, timestamp, values, indexes, config):
+        """Update the values from a sample of a configuration, indexes is a
+        list of (index in the sample, variable name)"""
+        last = self._last_sample.get(config.id)
+        if (last is not None and timestamp - last <
+                self.period_in_ms - config.period_in_ms / 2):
+            return
+        self._last_sample[config.id] = timestamp
+        for (index, name) in indexes:
+            self._values[name] = values[index]
+        # Only deliver complete samples
+        if len(self._values) == len(self.variables):
+            self.data_received_cb.call(timestamp, dict(self._values), self)
+
+
+class _LogBroker(object):
+    """Shares log configurations between subscriptions.
+
+    When a subscription needs variables that are not logged, or not as
+    fast as it needs them, new log configurations are packed for them (see
+    LogPlan). A subscription takes the values of every variable from the
+    slowest configuration that logs it fast enough. A configuration is
+    deleted when no subscription takes any values from it."""
+
+    def __init__(self, log):
+        self._log = log
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        # Log configurations created by the broker
+        self._configs = []
+        # (subscription, [(index, name)]) of the values to deliver from the
+        # samples of the configurations, by configuration id. Replaced (not
+        # modified) when subscriptions change.
+        self._routes = {}
+        self._counter = 0
+
+    def subscribe(self, name, variables, period_in_ms):
+        period_in_ms = LogPlan._quantize_period(period_in_ms)
+        subscription = LogSubscription(self, name, variables, period_in_ms)
+        # The configurations are added without holding the lock, since that
+        # calls the block_added_cb callbacks that could subscribe too. The
+        # sources are then checked again with the lock held, since another
+        # subscription could have been removed in the meantime and the
+        # configurations it used deleted. If two subscriptions add
+        # configurations for the same variables at the same time the one
+        # that isn't used is deleted by _update_routes.
+        new_configs = []
+        while True:
+            with self._lock:
+                sources = self._sources(new_configs)
+                missing = [v for v in subscription.variables
+                           if self._pick_source(sources.get(v, []),
+                                                period_in_ms) is None]
+                if not missing:
+                    self._configs += new_configs
+                    self._subscriptions.append(subscription)
+                    subscription.valid = True
+                    self._update_routes()
+                    count = len(self._configs)
+                    break
+                self._counter += 1
+                plan_name = "Shared%d" % self._counter
+            plan = LogPlan(plan_name)
+            for variable in missing:
+                plan.add_variable(variable, period_in_ms)
+            configs = plan.create_configs(self._log._toc)
+            if configs is None:
+                self._delete_configs(new_configs)
+                return subscription
+            for config in configs:
+                config.shared = True
+                self._log.add_config(config)
+                if not config.valid:
+                    logger.warning("Could not add configuration [%s] for"
+                                   " the subscription [%s]", config.name,
+                                   name)
+                    self._delete_configs(new_configs)
+                    return subscription
+                config.values_received_cb.add_callback(
+                    self._values_received)
+                config.error_cb.add_callback(self._config_error)
+                new_configs.append(config)
+        logger.info("Subscription [%s] added %d log configurations, %d in"
+                    " use", name, len(new_configs), count)
+        for config in new_configs:
+            config.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+                subscription.valid = False
+                self._update_routes()
+
+    def reset(self):
+        """Forget all the subscriptions and configurations, used when the
+        logging in the Crazyflie is reset"""
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription.valid = False
+            self._subscriptions = []
+            self._configs = []
+            self._routes = {}
+
+    def _sources(self, new_configs=()):
+        """Return the configurations logging each variable, by variable
+        name, new_configs are added but not registered yet"""
+        sources = {}
+        for config in self._configs + list(new_configs):
+            for name in config.variable_names:
+                sources.setdefault(name, []).append(config)
+        return sources
+
+    @staticmethod
+    def _pick_source(configs, period_in_ms):
+        """Return the slowest of the configurations that is fast enough for
+        period_in_ms, so faster configurations can be deleted when they are
+        not needed anymore. None is returned if none of them is."""
+        fast_enough = [c for c in configs if c.period_in_ms <= period_in_ms]
+        if not fast_enough:
+            return None
+        return max(fast_enough, key=lambda c: c.period_in_ms)
+
+    def _update_routes(self):
+        """Update the routes from the configurations to the subscriptions
+        and delete the configurations that are not used"""
+        sources = self._sources()
+        routes = {}
+        for subscription in self._subscriptions:
+            indexes = {}
+            for name in subscription.variables:
+                config = self._pick_source(sources.get(name, []),
+                                           subscription.period_in_ms)
+                if config is None:
+                    logger.warning("No configuration logs [%s] for the"
+                                   " subscription [%s]", name,
+                                   subscription.name)
+                    continue
+                indexes.setdefault(config, []).append(
+                    (config.variable_names.index(name), name))
+            for (config, config_indexes) in indexes.items():
+                routes.setdefault(config.id, []).append((subscription,
+                                                         config_indexes))
+        self._routes = routes
+        self._delete_configs([c for c in self._configs
+                              if c.id not in routes])
+
+    def _delete_configs(self, configs):
+        for config in configs:
+            config.values_received_cb.remove_callback(self._values_received)
+            config.error_cb.remove_callback(self._config_error)
+            self._log._remove_when_deleted(config)
+            config.delete()
+            if config in self._configs:
+                self._configs.remove(config)
+
+    def _values_received(self, timestamp, values, config, host_time):
+        for (subscription, indexes) in self._routes.get(config.id, ()):
+            subscription._update(timestamp, values, indexes, config)
+
+    def _config_error(self, config, msg):
+        for (subscription, _) in self._routes.get(config.id, ()):
+            subscription.error_cb.call(subscription,
+                                       "%s: %s" % (config.name, msg))
 
 
 class LogTocElement:
@@ -361,8 +766,16 @@ class Log():
 
     def __init__(self, crazyflie=None):
         self.log_blocks = []
+        # Added blocks by block id, used to dispatch log data
+        self._blocks_by_id = {}
         # Called with newly created blocks
         self.block_added_cb = Caller()
+        # Called with the blocks removed from log_blocks when they have
+        # been deleted (see _remove_when_deleted)
+        self.block_removed_cb = Caller()
+        # Ids of the blocks that are removed from log_blocks when their
+        # deletion is acknowledged
+        self._removed_on_delete = set()
 
         self.cf = crazyflie
         self._toc = None
@@ -374,6 +787,9 @@ class Log():
 
         self._refresh_callback = None
         self._toc_cache = None
+        self._broker = _LogBroker(self)
+        # Unwraps the log data timestamps and maps them to host time
+        self.timebase = Timebase()
 
     def add_config(self, logconf):
         """Add a log configuration to the logging framework.
@@ -424,14 +840,63 @@ class Log():
                 (logconf.period > 0 and logconf.period < 0xFF)):
             logconf.valid = True
             logconf.cf = self.cf
+            logconf.build_decoder()
             self.log_blocks.append(logconf)
+            self._blocks_by_id[logconf.id] = logconf
             self.block_added_cb.call(logconf)
         else:
             logconf.valid = False
 
+    def add_plan(self, plan):
+        """Add a LogPlan to the logging framework.
+
+        The variables of the plan are packed into log configurations that
+        are added like with add_config. The plan is valid if all of them
+        could be added. A Crazyflie has to be connected."""
+        plan.valid = False
+        if not self.cf.link:
+            logger.error("Cannot add plans without being connected to a "
+                         "Crazyflie!")
+            return
+
+        configs = plan.create_configs(self._toc)
+        if configs is None:
+            return
+        for config in configs:
+            self.add_config(config)
+            if not config.valid:
+                logger.warning("Could not add configuration [%s] of the plan"
+                               " [%s]", config.name, plan.name)
+                return
+            config.values_received_cb.add_callback(plan._values_received)
+            config.error_cb.add_callback(plan._config_error)
+        logger.info("Plan [%s] uses %d log configurations", plan.name,
+                    len(configs))
+        plan.valid = True
+
+    def subscribe(self, name, variables, period_in_ms):
+        """Subscribe to the variables (a list of complete names) at the
+        period period_in_ms and return a LogSubscription.
+
+        The variables are logged in log configurations shared by all the
+        subscriptions, so subscribing to variables that are already logged
+        at the same or a shorter period doesn't add any traffic. The
+        configurations are created, started and deleted as needed. The
+        subscription is not valid if the variables could not be logged. A
+        Crazyflie has to be connected, the subscriptions end when the
+        logging is reset (i.e on reconnect)."""
+        if not self.cf.link:
+            logger.error("Cannot subscribe without being connected to a "
+                         "Crazyflie!")
+            return LogSubscription(self._broker, name, variables,
+                                   period_in_ms)
+        return self._broker.subscribe(name, variables, period_in_ms)
+
     def refresh_toc(self, refresh_done_callback, toc_cache):
         """Start refreshing the table of loggale variables"""
 
+        self._broker.reset()
+        self.timebase.reset()
         self._toc_cache = toc_cache
         self._refresh_callback = refresh_done_callback
         self._toc = None
@@ -439,23 +904,42 @@ class Log():
         pk = CRTPPacket()
         pk.set_header(CRTPPort.LOGGING, CHAN_SETTINGS)
         pk.data = (CMD_RESET_LOGGING, )
-        self.cf.send_packet(pk, expected_reply=(CMD_RESET_LOGGING,))
+        self.cf.send_packet(pk, expected_reply=(CMD_RESET_LOGGING,),
+                            retry_policy=SETUP_RETRY_POLICY)
+
+    def _remove_when_deleted(self, logconf):
+        """Remove the configuration from log_blocks once the Crazyflie has
+        acknowledged that it's deleted, used for configurations that are
+        never started again"""
+        self._removed_on_delete.add(logconf.id)
 
     def _find_block(self, id):
-        for block in self.log_blocks:
-            if block.id == id:
-                return block
-        return None
+        return self._blocks_by_id.get(id)
 
     def _new_packet_cb(self, packet):
         """Callback for newly arrived packets with TOC information"""
         chan = packet.channel
-        cmd = packet.datal[0]
-        payload = struct.pack("B" * (len(packet.datal) - 1), *packet.datal[1:])
+
+        # Log data is by far the most common packet, so handle it first and
+        # without copying the payload
+        if (chan == CHAN_LOGDATA):
+            payload = packet.payload
+            block = self._blocks_by_id.get(payload[0])
+            if (block is not None):
+                timebase = self.timebase
+                timestamp = timebase.add_timestamp(
+                    payload[1] | payload[2] << 8 | payload[3] << 16)
+                block.unpack_log_data(memoryview(payload)[4:], timestamp,
+                                      timebase.host_time(timestamp))
+            else:
+                logger.warning("Error no LogEntry to handle id=%d", payload[0])
+            return
+
+        cmd = packet[0]
 
         if (chan == CHAN_SETTINGS):
-            id = ord(payload[0])
-            error_status = ord(payload[1])
+            id = packet[1]
+            error_status = packet[2]
             block = self._find_block(id)
             if (cmd == CMD_CREATE_BLOCK):
                 if (block is not None):
@@ -516,28 +1000,25 @@ class Log():
                     if block:
                         block.started = False
                         block.added = False
+                        if id in self._removed_on_delete:
+                            self._removed_on_delete.discard(id)
+                            self._blocks_by_id.pop(id, None)
+                            if block in self.log_blocks:
+                                self.log_blocks.remove(block)
+                                self.block_removed_cb.call(block)
 
             if (cmd == CMD_RESET_LOGGING):
                 # Guard against multiple responses due to re-sending
                 if not self._toc:
                     logger.debug("Logging reset, continue with TOC download")
                     self.log_blocks = []
+                    self._blocks_by_id = {}
+                    self._removed_on_delete = set()
 
                     self._toc = Toc()
                     toc_fetcher = TocFetcher(self.cf, LogTocElement,
                                              CRTPPort.LOGGING,
                                              self._toc, self._refresh_callback,
-                                             self._toc_cache)
+                                             self._toc_cache,
+                                             self.cf.toc_fetch_window)
                     toc_fetcher.start()
-
-        if (chan == CHAN_LOGDATA):
-            chan = packet.channel
-            id = packet.datal[0]
-            block = self._find_block(id)
-            timestamps = struct.unpack("<BBB", packet.data[1:4])
-            timestamp = (timestamps[0] | timestamps[1] << 8 | timestamps[2] << 16)
-            logdata = packet.data[4:]
-            if (block is not None):
-                block.unpack_log_data(logdata, timestamp)
-            else:
-                logger.warning("Error no LogEntry to handle id=%d", id)
@@ -41,9 +41,8 @@ from cflib.utils.callbacks import Caller
 import struct
 from cflib.crtp.crtpstack import CRTPPacket, CRTPPort
 from .toc import Toc, TocFetcher
-from threading import Thread, Lock
-
-from Queue import Queue
+from .retry import SETUP_RETRY_POLICY
+from threading import Lock
 
 import logging
 logger = logging.getLogger(__name__)
@@ -63,6 +62,9 @@ TOC_RESET = 0
 TOC_GETNEXT = 1
 TOC_GETCRC32 = 2
 
+# Number of parameter requests waiting for an answer at the same time
+PARAM_WINDOW = 5
+
 
 # One element entry in the TOC
 class ParamTocElement:
@@ -83,6 +85,20 @@ class ParamTocElement:
              0x06: ("float",    '<f'),
              0x07: ("double",   '<d')}
 
+    # Precompiled structs for packing and unpacking the values
+    structs = dict((pytype, struct.Struct(pytype))
+                   for (ctype, pytype) in types.values() if pytype)
+
+    # Range of the values of the integer types
+    int_ranges = {"uint8_t": (0, 0xFF),
+                  "uint16_t": (0, 0xFFFF),
+                  "uint32_t": (0, 0xFFFFFFFF),
+                  "uint64_t": (0, 0xFFFFFFFFFFFFFFFF),
+                  "int8_t": (-0x80, 0x7F),
+                  "int16_t": (-0x8000, 0x7FFF),
+                  "int32_t": (-0x80000000, 0x7FFFFFFF),
+                  "int64_t": (-0x8000000000000000, 0x7FFFFFFFFFFFFFFF)}
+
     def __init__(self, data=None):
         """TocElement creator. Data is the binary payload of the element."""
         if (data):
@@ -106,10 +122,61 @@ class ParamTocElement:
             return "RO"
         return "RW"
 
+    def unpack_value(self, data, offset=0):
+        """Return the value (int or float) packed in data at offset"""
+        return self.structs[self.pytype].unpack_from(data, offset)[0]
+
+    def parse_value(self, string):
+        """Convert a string to a value of the type of the parameter, without
+        checking the range. Integers can be written in any base using a
+        prefix (i.e 0x10) and True/False are accepted as 1/0."""
+        string = string.strip()
+        if string in ("True", "False"):
+            return int(string == "True")
+        if self.ctype in self.int_ranges:
+            try:
+                return int(string, 0)
+            except ValueError:
+                # 5.0 is accepted for an integer, but not 5.5
+                return float(string)
+        return float(string)
+
+    def pack_value(self, value):
+        """Return value packed for the type of the parameter. The value can
+        be a number or a string (see parse_value). Raises a ValueError if
+        the value is not valid for the type."""
+        if isinstance(value, basestring):
+            value = self.parse_value(value)
+        if not self.pytype:
+            raise ValueError("Setting %s parameters is not supported" %
+                             self.ctype)
+        if self.ctype in self.int_ranges:
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            if not isinstance(value, (int, long)):
+                raise ValueError("%r is not a valid %s value" %
+                                 (value, self.ctype))
+            (low, high) = self.int_ranges[self.ctype]
+            if not low <= value <= high:
+                raise ValueError("%d is out of range for %s" %
+                                 (value, self.ctype))
+        elif not isinstance(value, (int, long, float)):
+            raise ValueError("%r is not a valid %s value" %
+                             (value, self.ctype))
+        try:
+            return self.structs[self.pytype].pack(value)
+        except (struct.error, OverflowError) as e:
+            raise ValueError("%r is not a valid %s value (%s)" %
+                             (value, self.ctype, e))
+
 
 class Param():
     """
     Used to read and write parameter values in the Crazyflie.
+
+    The values are ints or floats depending on the type of the parameter.
+    For compatibility the update callbacks get the values as strings,
+    unless they are added with typed=True.
     """
 
     toc = Toc()
@@ -118,56 +185,177 @@ class Param():
         self.cf = crazyflie
         self.param_update_callbacks = {}
         self.group_update_callbacks = {}
+        # Callbacks that get the values as ints or floats
+        self.typed_param_update_callbacks = {}
+        self.typed_group_update_callbacks = {}
         self.param_updater = None
+        # Called with (complete_name, message) when reading or writing a
+        # parameter got no answer from the Crazyflie
+        self.param_failed_cb = Caller()
+        # Bulk reads and writes waiting for answers
+        self._bulk_requests = []
+        self._bulk_lock = Lock()
 
-        self.param_updater = _ParamUpdater(self.cf, self._param_updated)
-        self.param_updater.start()
+        self.param_updater = _ParamUpdater(self.cf, self._param_updated,
+                                           self.cf.param_window,
+                                           self._param_failed)
 
         self.cf.disconnected.add_callback(self.param_updater.close)
+        self.cf.disconnected.add_callback(self._drop_bulk_requests)
 
     def _param_updated(self, pk):
         """Callback with data for an updated parameter"""
-        var_id = pk.datal[0]
+        var_id = pk[0]
         element = self.toc.get_element_by_id(var_id)
         if element:
-            s = struct.unpack(element.pytype, pk.data[1:])[0]
-            s = s.__str__()
+            value = element.unpack_value(pk.payload, 1)
             complete_name = "%s.%s" % (element.group, element.name)
             logger.debug("Updated parameter [%s]" % complete_name)
-            if complete_name in self.param_update_callbacks:
-                self.param_update_callbacks[complete_name].call(complete_name, s)
-            if element.group in self.group_update_callbacks:
-                self.group_update_callbacks[element.group].call(complete_name, s)
+            if complete_name in self.typed_param_update_callbacks:
+                self.typed_param_update_callbacks[complete_name].call(
+                    complete_name, value)
+            if element.group in self.typed_group_update_callbacks:
+                self.typed_group_update_callbacks[element.group].call(
+                    complete_name, value)
+            if (complete_name in self.param_update_callbacks or
+                    element.group in self.group_update_callbacks):
+                s = str(value)
+                if complete_name in self.param_update_callbacks:
+                    self.param_update_callbacks[complete_name].call(
+                        complete_name, s)
+                if element.group in self.group_update_callbacks:
+                    self.group_update_callbacks[element.group].call(
+                        complete_name, s)
+            if self._bulk_requests:
+                self._bulk_updated(complete_name, value)
         else:
             logger.debug("Variable id [%d] not found in TOC", var_id)
 
-    def remove_update_callback(self, group, name=None, cb=None):
+    def _param_failed(self, var_id):
+        """Callback when reading or writing a parameter got no answer"""
+        element = self.toc.get_element_by_id(var_id)
+        if element:
+            complete_name = "%s.%s" % (element.group, element.name)
+            self.param_failed_cb.call(complete_name,
+                                      "No answer from the Crazyflie")
+            if self._bulk_requests:
+                self._bulk_updated(complete_name, None)
+
+    def _bulk_updated(self, complete_name, value):
+        """Record the value for the bulk requests waiting for it and call
+        the completion callbacks of the finished ones, value is None if the
+        parameter got no answer"""
+        finished = []
+        with self._bulk_lock:
+            for bulk in self._bulk_requests:
+                if complete_name in bulk.remaining:
+                    bulk.remaining.discard(complete_name)
+                    bulk.values[complete_name] = value
+                    if not bulk.remaining:
+                        finished.append(bulk)
+            if finished:
+                self._bulk_requests = [b for b in self._bulk_requests
+                                       if b.remaining]
+        for bulk in finished:
+            if bulk.callback:
+                values = bulk.values
+                if not bulk.typed:
+                    values = dict((name, None if value is None
+                                   else str(value))
+                                  for (name, value) in values.items())
+                bulk.callback(values)
+
+    def _drop_bulk_requests(self, uri):
+        """The bulk requests will never finish after a disconnect"""
+        with self._bulk_lock:
+            self._bulk_requests = []
+
+    def _add_bulk_request(self, names, callback, typed):
+        bulk = _BulkRequest(names, callback, typed)
+        if not bulk.remaining:
+            if callback:
+                callback({})
+            return
+        with self._bulk_lock:
+            self._bulk_requests.append(bulk)
+
+    def read_all(self, callback=None, group=None, typed=False):
+        """
+        Request an update of the values of all the parameters in the TOC
+        (or only the ones in group). The update callbacks are called for
+        every value and callback is called with a dictionary of
+        {complete_name: value} when all of them have been received (with
+        the values as strings unless typed is True). Parameters that got no
+        answer have the value None.
+        """
+        names = []
+        for element in self.toc:
+            if group is None or element.group == group:
+                names.append("%s.%s" % (element.group, element.name))
+        self._add_bulk_request(names, callback, typed)
+        for name in names:
+            self.request_param_update(name)
+
+    def write_many(self, values, callback=None, typed=False):
+        """
+        Set the values of several parameters, values is a dictionary (or a
+        list of tuples) of complete_name and value. When all of them have
+        been written callback is called with a dictionary of
+        {complete_name: value} with the values the Crazyflie answered with
+        (as strings unless typed is True), or None for the ones that got
+        no answer. Parameters that are not in the TOC or that are read only
+        are not written and left out of the answer. Raises a ValueError
+        before anything is written if one of the values is not valid.
+        """
+        if isinstance(values, dict):
+            values = values.items()
+        writable = []
+        for (complete_name, value) in values:
+            element = self.toc.get_element_by_complete_name(complete_name)
+            if element and element.access == ParamTocElement.RW_ACCESS:
+                element.pack_value(value)
+                writable.append((complete_name, value))
+            else:
+                logger.warning("Cannot set value for [%s], it's not in the"
+                               " TOC or read only!", complete_name)
+        self._add_bulk_request([name for (name, _) in writable], callback,
+                               typed)
+        for (complete_name, value) in writable:
+            self.set_value(complete_name, value)
+
+    def _get_callbacks(self, group, name, typed):
+        """Return the dictionary and key of the callbacks for a group or a
+        group.name"""
+        if not name:
+            if typed:
+                return (self.typed_group_update_callbacks, group)
+            return (self.group_update_callbacks, group)
+        paramname = "{}.{}".format(group, name)
+        if typed:
+            return (self.typed_param_update_callbacks, paramname)
+        return (self.param_update_callbacks, paramname)
+
+    def remove_update_callback(self, group, name=None, cb=None, typed=False):
         """Remove the supplied callback for a group or a group.name"""
         if not cb:
             return
 
-        if not name:
-            if group in self.group_update_callbacks:
-                self.group_update_callbacks[group].remove_callback(cb)
-        else:
-            paramname = "{}.{}".format(group, name)
-            if paramname in self.param_update_callbacks:
-                self.param_update_callbacks[paramname].remove_callback(cb)
+        (callbacks, key) = self._get_callbacks(group, name, typed)
+        if key in callbacks:
+            callbacks[key].remove_callback(cb)
 
-    def add_update_callback(self, group, name=None, cb=None):
+    def add_update_callback(self, group, name=None, cb=None, typed=False):
         """
         Add a callback for a specific parameter name. This callback will be
-        executed when a new value is read from the Crazyflie.
+        executed when a new value is read from the Crazyflie, with the
+        complete name and the value. The value is a string unless typed is
+        True, then it's an int or a float depending on the type of the
+        parameter.
         """
-        if not name:
-            if not group in self.group_update_callbacks:
-                self.group_update_callbacks[group] = Caller()
-            self.group_update_callbacks[group].add_callback(cb)
-        else:
-            paramname = "{}.{}".format(group, name)
-            if not paramname in self.param_update_callbacks:
-                self.param_update_callbacks[paramname] = Caller()
-            self.param_update_callbacks[paramname].add_callback(cb)
+        (callbacks, key) = self._get_callbacks(group, name, typed)
+        if not key in callbacks:
+            callbacks[key] = Caller()
+        callbacks[key].add_callback(cb)
 
     def refresh_toc(self, refresh_done_callback, toc_cache):
         """
@@ -176,7 +364,8 @@ class Param():
         self.toc = Toc()
         toc_fetcher = TocFetcher(self.cf, ParamTocElement,
                                 CRTPPort.PARAM, self.toc,
-                                refresh_done_callback, toc_cache)
+                                refresh_done_callback, toc_cache,
+                                self.cf.toc_fetch_window)
         toc_fetcher.start()
 
     def disconnected(self, uri):
@@ -192,7 +381,10 @@ class Param():
 
     def set_value(self, complete_name, value):
         """
-        Set the value for the supplied parameter.
+        Set the value for the supplied parameter. The value can be an int,
+        a float or a string with a number (i.e "5", "0x10", "1.5" or
+        "True"). Raises a ValueError if the value is not valid for the type
+        of the parameter.
         """
         element = self.toc.get_element_by_complete_name(complete_name)
 
@@ -205,69 +397,138 @@ class Param():
             varid = element.ident
             pk = CRTPPacket()
             pk.set_header(CRTPPort.PARAM, WRITE_CHANNEL)
-            pk.data = struct.pack('<B', varid)
-            pk.data += struct.pack(element.pytype, eval(value))
+            pk.data = struct.pack('<B', varid) + element.pack_value(value)
             self.param_updater.request_param_setvalue(pk)
 
 
-class _ParamUpdater(Thread):
-    """This thread will update params through a queue to make sure that we
-    get back values"""
-    def __init__(self, cf, updated_callback):
-        """Initialize the thread"""
-        Thread.__init__(self)
-        self.setDaemon(True)
-        self.wait_lock = Lock()
+class _BulkRequest(object):
+    """Parameters of a read_all or write_many waiting for answers"""
+
+    def __init__(self, names, callback, typed):
+        self.remaining = set(names)
+        self.values = {}
+        self.callback = callback
+        self.typed = typed
+
+
+class _ParamRequest(object):
+    """A parameter read or write waiting to be sent"""
+
+    __slots__ = ('var_id', 'pk')
+
+    def __init__(self, var_id, pk):
+        self.var_id = var_id
+        self.pk = pk
+
+
+class _ParamUpdater(object):
+    """
+    Sends parameter read and write requests to the Crazyflie, keeping up to
+    window requests waiting for an answer at the same time. Answers are
+    matched to the requests using the variable id, so there is never more
+    than one request for the same variable in flight. A read of a variable
+    that is already waiting to be read is not queued again and a write of
+    a variable that is waiting to be written replaces the value to write.
+    """
+
+    def __init__(self, cf, updated_callback, window=PARAM_WINDOW,
+                 failed_callback=None):
+        """Initialize the updater, failed_callback is called with the
+        variable id of the requests that got no answer"""
         self.cf = cf
         self.updated_callback = updated_callback
-        self.request_queue = Queue()
+        self.failed_callback = failed_callback
+        self.window = max(1, window)
+        self._lock = Lock()
+        # Requests waiting to be sent, in order
+        self._queue = []
+        # Requests sent and waiting for an answer, by variable id
+        self._in_flight = {}
         self.cf.add_port_callback(CRTPPort.PARAM, self._new_packet_cb)
-        self._should_close = False
-        self._req_param = -1
 
     def close(self, uri):
-        # First empty the queue from all packets
-        while not self.request_queue.empty():
-            self.request_queue.get()
-        # Then force an unlock of the mutex if we are waiting for a packet
-        # we didn't get back due to a disconnect for example.
-        try:
-            self.wait_lock.release()
-        except:
-            pass
+        """Drop all the requests, for example after a disconnect"""
+        with self._lock:
+            self._queue = []
+            self._in_flight = {}
+
+    def _find_queued(self, var_id, channel):
+        for request in self._queue:
+            if request.var_id == var_id and request.pk.channel == channel:
+                return request
+        return None
 
     def request_param_setvalue(self, pk):
         """Place a param set value request on the queue. When this is sent to
         the Crazyflie it will answer with the update param value. """
-        self.request_queue.put(pk)
+        var_id = pk[0]
+        with self._lock:
+            request = self._find_queued(var_id, WRITE_CHANNEL)
+            if request is not None:
+                request.pk = pk
+            else:
+                self._queue.append(_ParamRequest(var_id, pk))
+        self._send_requests()
+
+    def request_param_update(self, var_id):
+        """Place a param update request on the queue"""
+        with self._lock:
+            if self._find_queued(var_id, READ_CHANNEL) is not None:
+                return
+            in_flight = self._in_flight.get(var_id)
+            if in_flight is not None and in_flight.pk.channel == READ_CHANNEL:
+                return
+            pk = CRTPPacket()
+            pk.set_header(CRTPPort.PARAM, READ_CHANNEL)
+            pk.data = struct.pack('<B', var_id)
+            logger.debug("Requesting request to update param [%d]", var_id)
+            self._queue.append(_ParamRequest(var_id, pk))
+        self._send_requests()
+
+    def _send_requests(self):
+        """Send queued requests until the window is full"""
+        to_send = []
+        with self._lock:
+            if self.cf.link is None:
+                self._queue = []
+                return
+            i = 0
+            while (i < len(self._queue) and
+                    len(self._in_flight) < self.window):
+                request = self._queue[i]
+                if request.var_id in self._in_flight:
+                    i += 1
+                    continue
+                del self._queue[i]
+                self._in_flight[request.var_id] = request
+                to_send.append(request.pk)
+        for pk in to_send:
+            self.cf.send_packet(pk, expected_reply=(tuple(pk[0:2])),
+                                retry_policy=SETUP_RETRY_POLICY,
+                                timeout_callback=self._request_timeout)
+
+    def _request_timeout(self, pk, pattern):
+        """Callback when a request got no answer, it's dropped so the
+        requests after it can be sent"""
+        logger.warning("No answer when reading or writing param [%d]", pk[0])
+        failed = False
+        with self._lock:
+            request = self._in_flight.get(pk[0])
+            if request is not None and request.pk is pk:
+                del self._in_flight[pk[0]]
+                failed = True
+        if failed and self.failed_callback:
+            self.failed_callback(pk[0])
+        self._send_requests()
 
     def _new_packet_cb(self, pk):
         """Callback for newly arrived packets"""
         if pk.channel == READ_CHANNEL or pk.channel == WRITE_CHANNEL:
-            var_id = pk.datal[0]
-            if (pk.channel != TOC_CHANNEL and self._req_param == var_id
-                and pk is not None):
-                self.updated_callback(pk)
-                self._req_param = -1
-                try:
-                    self.wait_lock.release()
-                except:
-                    pass
-
-    def request_param_update(self, var_id):
-        """Place a param update request on the queue"""
-        pk = CRTPPacket()
-        pk.set_header(CRTPPort.PARAM, READ_CHANNEL)
-        pk.data = struct.pack('<B', var_id)
-        logger.debug("Requesting request to update param [%d]", var_id)
-        self.request_queue.put(pk)
-
-    def run(self):
-        while not self._should_close:
-            pk = self.request_queue.get()  # Wait for request update
-            self.wait_lock.acquire()
-            if self.cf.link:
-                self._req_param = pk.datal[0]
-                self.cf.send_packet(pk, expected_reply=(pk.datat[0:2]))
-            else:
-                self.wait_lock.release()
+            var_id = pk[0]
+            with self._lock:
+                request = self._in_flight.get(var_id)
+                if request is None:
+                    return
+                del self._in_flight[var_id]
+            self.updated_callback(pk)
+            self._send_requests()
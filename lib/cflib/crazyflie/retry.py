@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Keeps track of packets sent to the Crazyflie that expects an answer and
+resends them until the answer arrives.
+
+A request is identified by a pattern, which is the header of the packet
+followed by the first bytes of the expected answer. The pending requests
+are stored in a dictionary keyed by the pattern, so finding the request
+that an incoming packet answers only costs one lookup per distinct pattern
+length (the longest pattern wins). All the retries are handled by one
+timer thread instead of one thread per request. The thread is started
+with the first request and runs until stop() is called.
+
+The time to wait for an answer adapts to the link like the retransmission
+timeout of TCP: it's never shorter than the interval of the policy, but
+grows with the measured round-trip time of the answered requests (only the
+ones that were not resent count). When requests have to be resent the
+timeout is doubled for the following requests, until one of them is
+answered without being resent. This way a Crazyflie or link that answers
+slowly (i.e with a long queue of requests) isn't flooded with resends.
+
+A request that is still not answered when the retries of its policy have
+run out is dropped and reported to its timeout callback and to the timeout
+callback of the table.
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['RetryPolicy', 'PendingRequests', 'DEFAULT_RETRY_POLICY',
+           'SETUP_RETRY_POLICY']
+
+import time
+import heapq
+from threading import Thread, Lock, Condition, current_thread
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy(object):
+    """Policy for resending a request when no answer is received"""
+
+    def __init__(self, interval=0.2, max_retries=None, backoff=1.0,
+                 max_interval=None):
+        """
+        interval -- Time in seconds to wait for an answer before resending
+        max_retries -- Number of times to resend the request before giving
+                       up, None means that it's resent until answered
+        backoff -- The interval is multiplied by this after every resend,
+                   so a Crazyflie (or link) that is slow to answer isn't
+                   flooded with resends
+        max_interval -- Max interval in seconds when backing off, None
+                        means no limit
+        """
+        self.interval = interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_interval = max_interval
+
+    def get_interval(self, retries, timeout=0.0):
+        """Return the time to wait for an answer after retries resends,
+        timeout is the retransmission timeout estimated for the link"""
+        base = max(self.interval, timeout)
+        interval = base * self.backoff ** retries
+        if self.max_interval is not None:
+            interval = min(interval, max(self.max_interval, base))
+        return interval
+
+# Gains of the smoothed round-trip time and of its mean deviation (as in
+# TCP, RFC 6298)
+SRTT_GAIN = 0.125
+RTTVAR_GAIN = 0.25
+# Max retransmission timeout in seconds when backing off
+MAX_TIMEOUT = 3.0
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+# Policy for the requests done when setting up a connection (TOC download
+# and reading the parameters), the connection fails after about 15 s
+# without an answer. Many of these requests are in flight at the same time,
+# backing off keeps the resends from piling up when the answers are slow.
+SETUP_RETRY_POLICY = RetryPolicy(interval=0.2, max_retries=7, backoff=2.0,
+                                 max_interval=1.0)
+
+
+class _PendingRequest(object):
+    """A request waiting for an answer"""
+
+    __slots__ = ('pk', 'pattern', 'policy', 'timeout_callback', 'retries',
+                 'sent_ts')
+
+    def __init__(self, pk, pattern, policy, timeout_callback):
+        self.pk = pk
+        self.pattern = pattern
+        self.policy = policy
+        self.timeout_callback = timeout_callback
+        self.retries = 0
+        self.sent_ts = time.time()
+
+
+class PendingRequests(object):
+    """Table of the requests waiting for an answer from the Crazyflie"""
+
+    def __init__(self, resend_callback, timeout_callback=None):
+        """
+        resend_callback -- Called as resend_callback(pk, pattern) from the
+                           timer thread when a request should be resent
+        timeout_callback -- Called as timeout_callback(pk, pattern) from
+                            the timer thread when a request is given up
+        """
+        self._resend_callback = resend_callback
+        self._timeout_callback = timeout_callback
+        self._lock = Lock()
+        self._wakeup = Condition(self._lock)
+        self._requests = {}
+        # Number of pending patterns for each length, the lengths are also
+        # kept sorted (longest first) to find the longest match
+        self._length_count = {}
+        self._lengths = ()
+        # Heap with (deadline, sequence number, request)
+        self._timers = []
+        self._sequence = 0
+
+        self._requested = 0
+        self._answered = 0
+        self._retries = 0
+        self._timeouts = 0
+        self._max_pending = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        # Smoothed round-trip time and its mean deviation, None until a
+        # request has been answered
+        self._srtt = None
+        self._rttvar = 0.0
+        # Backed off timeout, used until a request sent after _backoff_ts
+        # is answered without being resent
+        self._backoff_timeout = 0.0
+        self._backoff_ts = 0.0
+
+        self._thread = None
+
+    def add(self, pk, pattern, policy=None, timeout_callback=None):
+        """Add a request for the packet pk that is answered by a packet
+        starting with pattern. If it's not answered before the retries of
+        policy have run out, timeout_callback(pk, pattern) is called."""
+        if policy is None:
+            policy = DEFAULT_RETRY_POLICY
+        request = _PendingRequest(pk, pattern, policy, timeout_callback)
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run,
+                                      name="PendingRequests")
+                self._thread.setDaemon(True)
+                self._thread.start()
+            if pattern in self._requests:
+                # The old request is replaced and its timer will be ignored
+                self._remove(pattern)
+            self._requests[pattern] = request
+            length = len(pattern)
+            if length in self._length_count:
+                self._length_count[length] += 1
+            else:
+                self._length_count[length] = 1
+                self._lengths = tuple(sorted(self._length_count,
+                                             reverse=True))
+            self._requested += 1
+            self._max_pending = max(self._max_pending, len(self._requests))
+            self._schedule(request)
+
+    def match(self, pk):
+        """Remove and return the request answered by the packet pk, or None
+        if the packet does not answer any pending request"""
+        if not self._requests:
+            return None
+        header = pk.header
+        payload = pk.payload
+        with self._lock:
+            for length in self._lengths:
+                if length - 1 > len(payload):
+                    continue
+                pattern = (header,) + tuple(payload[0:length - 1])
+                request = self._requests.get(pattern)
+                if request is not None:
+                    self._remove(pattern)
+                    latency = time.time() - request.sent_ts
+                    self._answered += 1
+                    self._latency_sum += latency
+                    self._latency_max = max(self._latency_max, latency)
+                    # The answer of a resent request could be to any of
+                    # the copies, so it doesn't tell the round-trip time
+                    if request.retries == 0:
+                        self._update_rtt(latency)
+                        if request.sent_ts >= self._backoff_ts:
+                            self._backoff_timeout = 0.0
+                    return request
+        return None
+
+    def clear(self):
+        """Drop all the pending requests"""
+        with self._lock:
+            self._requests = {}
+            self._length_count = {}
+            self._lengths = ()
+            self._timers = []
+
+    def stop(self):
+        """Drop all the pending requests and stop the timer thread, it's
+        started again by the next request"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._wakeup.notify()
+        self.clear()
+        with self._lock:
+            self._srtt = None
+            self._rttvar = 0.0
+            self._backoff_timeout = 0.0
+        if thread is not None and thread is not current_thread():
+            thread.join()
+
+    def get_stats(self):
+        """Return a dictionary with the statistics of the requests"""
+        with self._lock:
+            answered = self._answered
+            return {"pending": len(self._requests),
+                    "max_pending": self._max_pending,
+                    "requested": self._requested,
+                    "answered": answered,
+                    "retries": self._retries,
+                    "timeouts": self._timeouts,
+                    "latency_avg": (self._latency_sum / answered
+                                    if answered else 0.0),
+                    "latency_max": self._latency_max}
+
+    def _remove(self, pattern):
+        """Remove a pattern from the table, the lock must be held"""
+        del self._requests[pattern]
+        length = len(pattern)
+        self._length_count[length] -= 1
+        if self._length_count[length] == 0:
+            del self._length_count[length]
+            self._lengths = tuple(sorted(self._length_count, reverse=True))
+
+    def _update_rtt(self, rtt):
+        """Add a measured round-trip time, the lock must be held"""
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar += RTTVAR_GAIN * (abs(self._srtt - rtt) -
+                                           self._rttvar)
+            self._srtt += SRTT_GAIN * (rtt - self._srtt)
+
+    def _timeout(self):
+        """Return the retransmission timeout, the lock must be held"""
+        timeout = self._backoff_timeout
+        if self._srtt is not None:
+            timeout = max(timeout, self._srtt + 4 * self._rttvar)
+        return timeout
+
+    def _schedule(self, request):
+        """Arm the retry timer for a request, the lock must be held"""
+        self._sequence += 1
+        deadline = time.time() + request.policy.get_interval(
+            request.retries, self._timeout())
+        heapq.heappush(self._timers, (deadline, self._sequence, request))
+        if self._timers[0][2] is request:
+            self._wakeup.notify()
+
+    def _run(self):
+        """Timer thread resending the requests that have not been answered"""
+        thread = current_thread()
+        while True:
+            resend = []
+            timed_out = []
+            with self._lock:
+                now = time.time()
+                # A new thread is started if this one is stopped and
+                # requests are added again, so check that this is it
+                while (self._thread is thread and
+                        (not self._timers or self._timers[0][0] > now)):
+                    if self._timers:
+                        self._wakeup.wait(self._timers[0][0] - now)
+                    else:
+                        self._wakeup.wait()
+                    now = time.time()
+                if self._thread is not thread:
+                    return
+                while self._timers and self._timers[0][0] <= now:
+                    request = heapq.heappop(self._timers)[2]
+                    if self._requests.get(request.pattern) is not request:
+                        # Answered or replaced since the timer was armed
+                        continue
+                    max_retries = request.policy.max_retries
+                    if (max_retries is not None and
+                            request.retries >= max_retries):
+                        logger.warning("No answer for pattern %s after %d "
+                                       "retries, giving up",
+                                       request.pattern, request.retries)
+                        self._remove(request.pattern)
+                        self._timeouts += 1
+                        timed_out.append(request)
+                        continue
+                    if not resend:
+                        # Back off once for all the requests timing out
+                        # together
+                        self._backoff_timeout = min(
+                            2 * max(self._timeout(), request.policy.interval),
+                            MAX_TIMEOUT)
+                        self._backoff_ts = now
+                    request.retries += 1
+                    self._retries += 1
+                    self._schedule(request)
+                    resend.append(request)
+            for request in resend:
+                logger.debug("Resending for pattern %s", request.pattern)
+                self._resend_callback(request.pk, request.pattern)
+            for request in timed_out:
+                if request.timeout_callback is not None:
+                    request.timeout_callback(request.pk, request.pattern)
+                if self._timeout_callback is not None:
+                    self._timeout_callback(request.pk, request.pattern)
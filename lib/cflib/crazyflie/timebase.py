@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Keeps track of the clock of a connected Crazyflie.
+
+The log data timestamps are 24 bit milliseconds since the Crazyflie was
+started, so they wrap around after about 4.6 hours. The timebase unwraps
+them into a time that keeps increasing for the whole connection, and
+estimates how the Crazyflie clock relates to the host clock (offset and
+drift) with an exponentially weighted linear regression of the time
+packets are received against their timestamps. The host time of a sample
+is what samples from several log blocks or several Crazyflies are merged
+on.
+
+Only the packet with the least latency of every 100 ms is used for the
+regression, so the host times are about the time the samples were taken
+plus the lowest latency of the link, and don't jitter with the latency like
+the receive times do.
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['Timebase']
+
+import time
+from threading import Lock
+
+TIMESTAMP_BITS = 24
+TIMESTAMP_MASK = (1 << TIMESTAMP_BITS) - 1
+# Timestamps older than the last one by up to this are from packets
+# received out of order, not from a wraparound
+MAX_REORDER = 1 << (TIMESTAMP_BITS - 1)
+
+# The packet received with the least latency in every BUCKET_MS of
+# Crazyflie time is used as a sample for the regression
+BUCKET_MS = 100
+# Weight of a new sample in the regression, about the inverse of the
+# number of samples it's averaged over (here about 50 s)
+WEIGHT = 0.002
+# The drift is not estimated until the regression has got this many samples
+MIN_SAMPLES = 20
+# Estimated drifts outside of this (in parts per million) are not trusted
+MAX_DRIFT_PPM = 1000
+
+
+class Timebase(object):
+    """Unwraps the timestamps of one connection and maps them to host
+    time"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything about the clock, i.e when reconnecting"""
+        with self._lock:
+            self._last_raw = None
+            self._last = 0
+            self._bucket = None
+            self._samples = 0
+            self._mean_x = 0.0
+            self._mean_y = 0.0
+            self._var_x = 0.0
+            self._cov = 0.0
+            # (mean timestamp in ms, mean host time in s, s per ms) used to
+            # map timestamps to host time, swapped as one tuple so it can be
+            # read without the lock
+            self._model = None
+
+    def add_timestamp(self, raw, host_time=None):
+        """Add the 24 bit timestamp raw of a packet received at host_time (in
+        seconds, like time.time(), now if None). Return the timestamp
+        unwrapped (in ms)."""
+        if host_time is None:
+            host_time = time.time()
+        with self._lock:
+            if self._last_raw is None:
+                self._last_raw = raw
+                self._last = raw
+                self._bucket = (raw // BUCKET_MS, raw, host_time)
+                self._model = (raw, host_time, 0.001)
+            delta = ((raw - self._last_raw + MAX_REORDER) & TIMESTAMP_MASK) \
+                - MAX_REORDER
+            timestamp = self._last + delta
+            if delta > 0:
+                self._last_raw = raw
+                self._last = timestamp
+
+            # Keep the packet with the least latency of every bucket
+            (bucket, x, y) = self._bucket
+            if timestamp // BUCKET_MS > bucket:
+                self._add_sample(x, y)
+                self._bucket = (timestamp // BUCKET_MS, timestamp, host_time)
+            elif host_time - timestamp * 0.001 < y - x * 0.001:
+                self._bucket = (bucket, timestamp, host_time)
+            return timestamp
+
+    def _add_sample(self, x, y):
+        """Add host time y at timestamp x to the regression"""
+        self._samples += 1
+        weight = max(WEIGHT, 1.0 / self._samples)
+        # Exponentially weighted means and (co)variance, updated in a way
+        # that is numerically stable for large timestamps
+        dx = x - self._mean_x
+        dy = y - self._mean_y
+        self._mean_x += weight * dx
+        self._mean_y += weight * dy
+        self._var_x = (1 - weight) * (self._var_x + weight * dx * dx)
+        self._cov = (1 - weight) * (self._cov + weight * dx * dy)
+
+        slope = 0.001
+        if self._samples >= MIN_SAMPLES and self._var_x > 0:
+            if (abs(self._cov / self._var_x * 1000 - 1) * 1e6 <=
+                    MAX_DRIFT_PPM):
+                slope = self._cov / self._var_x
+        self._model = (self._mean_x, self._mean_y, slope)
+
+    def host_time(self, timestamp):
+        """Return the host time (in seconds, like time.time()) of the
+        unwrapped timestamp, or None if no packet has been received"""
+        model = self._model
+        if model is None:
+            return None
+        (mean_x, mean_y, slope) = model
+        return mean_y + (timestamp - mean_x) * slope
+
+    def get_drift(self):
+        """Return the estimated drift of the Crazyflie clock compared to the
+        host clock in parts per million"""
+        model = self._model
+        if model is None:
+            return 0.0
+        return (1 / (model[2] * 1000) - 1) * 1e6
+
+    def get_offset(self):
+        """Return the host time (in seconds) when the Crazyflie clock was 0,
+        or None if no packet has been received"""
+        return self.host_time(0)
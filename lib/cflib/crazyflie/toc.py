@@ -35,6 +35,7 @@ __author__ = 'Bitcraze AB'
 __all__ = ['TocElement', 'Toc', 'TocFetcher']
 
 from cflib.crtp.crtpstack import CRTPPacket
+from .retry import SETUP_RETRY_POLICY
 import struct
 
 import logging
@@ -50,6 +51,11 @@ CMD_TOC_INFO = 1
 IDLE = "IDLE"
 GET_TOC_INFO = "GET_TOC_INFO"
 GET_TOC_ELEMENT = "GET_TOC_ELEMENT"
+# Waiting for another Crazyflie to download the same TOC
+WAIT_FOR_SHARED = "WAIT_FOR_SHARED"
+
+# Default number of TOC elements that are requested at the same time
+TOC_FETCH_WINDOW = 2
 
 
 class TocElement:
@@ -65,38 +71,115 @@ class TocElement:
     access = RO_ACCESS
 
 
-class Toc:
-    """Container for TocElements."""
+class Toc(object):
+    """Container for TocElements.
+
+    The elements are stored by group and name in the toc dictionary. To
+    make lookups fast the container also keeps an index from ident to
+    element and one from complete name (group.name) to element. These are
+    updated by add_element, clear and when assigning a new dictionary to
+    toc, so the toc dictionary should not be modified directly.
+
+    A Toc can be frozen, after that it can't be modified and it's safe to
+    share it between several Crazyflies. Other Toc objects can adopt the
+    elements of a frozen Toc, which shares the dictionaries and indexes
+    instead of building new ones. They are copied if the adopting Toc is
+    modified later on."""
 
     def __init__(self):
-        self.toc = {}
+        self._toc = {}
+        self._elements_by_id = []
+        self._elements_by_name = {}
+        self._frozen = False
+        self._shared = False
+
+    def _get_toc(self):
+        """Get the elements as a dictionary of groups with elements"""
+        return self._toc
+
+    def _set_toc(self, toc):
+        """Replace all the elements with the ones in the dictionary toc,
+        organised as {group: {name: element}}"""
+        self.clear()
+        for group in toc.values():
+            for element in group.values():
+                self.add_element(element)
+
+    toc = property(_get_toc, _set_toc)
 
     def clear(self):
         """Clear the TOC"""
-        self.toc = {}
+        self._check_not_frozen()
+        self._toc = {}
+        self._elements_by_id = []
+        self._elements_by_name = {}
+        self._shared = False
+
+    def freeze(self):
+        """Make the TOC read-only and return it"""
+        self._frozen = True
+        return self
+
+    def is_frozen(self):
+        """Return True if the TOC is read-only"""
+        return self._frozen
+
+    def adopt(self, snapshot):
+        """Replace all the elements with the ones in the frozen Toc
+        snapshot, sharing its dictionaries and indexes"""
+        self._check_not_frozen()
+        if not snapshot.is_frozen():
+            raise ValueError("Only frozen TOCs can be adopted")
+        self._toc = snapshot._toc
+        self._elements_by_id = snapshot._elements_by_id
+        self._elements_by_name = snapshot._elements_by_name
+        self._shared = True
+
+    def _check_not_frozen(self):
+        if self._frozen:
+            raise TypeError("The TOC is frozen and can't be modified")
+
+    def _unshare(self):
+        """Make private copies of the shared dictionaries and indexes"""
+        self._toc = dict((group, dict(elements))
+                         for (group, elements) in self._toc.items())
+        self._elements_by_id = list(self._elements_by_id)
+        self._elements_by_name = dict(self._elements_by_name)
+        self._shared = False
 
     def add_element(self, element):
         """Add a new TocElement to the TOC container."""
+        self._check_not_frozen()
+        if self._shared:
+            self._unshare()
         try:
-            self.toc[element.group][element.name] = element
+            self._toc[element.group][element.name] = element
         except KeyError:
-            self.toc[element.group] = {}
-            self.toc[element.group][element.name] = element
+            self._toc[element.group] = {}
+            self._toc[element.group][element.name] = element
+
+        if element.ident >= len(self._elements_by_id):
+            self._elements_by_id.extend(
+                [None] * (element.ident + 1 - len(self._elements_by_id)))
+        self._elements_by_id[element.ident] = element
+        self._elements_by_name["%s.%s" % (element.group,
+                                          element.name)] = element
+
+    def __iter__(self):
+        """Iterate over the elements in ident order"""
+        for element in self._elements_by_id:
+            if element is not None:
+                yield element
 
     def get_element_by_complete_name(self, complete_name):
         """Get a TocElement element identified by complete name from the
         container."""
-        try:
-            return self.get_element_by_id(self.get_element_id(complete_name))
-        except ValueError:
-            # Item not found
-            return None
+        return self._elements_by_name.get(complete_name)
 
     def get_element_id(self, complete_name):
         """Get the TocElement element id-number of the element with the
         supplied name."""
-        [group, name] = complete_name.split(".")
-        element = self._get_element(group, name)
+        element = self._elements_by_name.get(complete_name)
         if element:
             return element.ident
         else:
@@ -107,24 +190,37 @@ class Toc:
         """Get a TocElement element identified by name and group from the
         container."""
         try:
-            return self.toc[group][name]
+            return self._toc[group][name]
         except KeyError:
             return None
 
     def get_element_by_id(self, ident):
         """Get a TocElement element identified by index number from the
         container."""
-        for group in self.toc.keys():
-            for name in self.toc[group].keys():
-                if self.toc[group][name].ident == ident:
-                    return self.toc[group][name]
+        if 0 <= ident < len(self._elements_by_id):
+            return self._elements_by_id[ident]
         return None
 
 
 class TocFetcher:
-    """Fetches TOC entries from the Crazyflie"""
+    """Fetches TOC entries from the Crazyflie
+
+    Up to window TOC elements are requested at the same time. Answers that
+    arrive out of order are kept until all the elements before them have
+    been received, so elements are always added to the TOC in index order.
+    Requests that are not answered are resent (and thereby gaps in the
+    received indexes filled) by the pending request handling in the
+    Crazyflie class.
+
+    The number of elements requested at the same time starts at one and
+    grows by one for every new element received, up to window. It's halved
+    when an element is received twice, since that means a request was
+    resent because the answers were slower than expected (i.e the
+    Crazyflie answers the requests one at a time and a long queue of them
+    builds up), so requesting more at the same time would only make it
+    worse."""
     def __init__(self, crazyflie, element_class, port, toc_holder,
-                 finished_callback, toc_cache):
+                 finished_callback, toc_cache, window=TOC_FETCH_WINDOW):
         self.cf = crazyflie
         self.port = port
         self._crc = 0
@@ -135,6 +231,13 @@ class TocFetcher:
         self._toc_cache = toc_cache
         self.finished_callback = finished_callback
         self.element_class = element_class
+        self.window = max(1, window)
+        # Number of elements currently requested at the same time
+        self._window = 1
+        # Index of the next element to add to the TOC
+        self._next_index = 0
+        # Elements received ahead of _next_index, by index
+        self._received = {}
 
     def start(self):
         """Initiate fetching of the TOC."""
@@ -147,12 +250,14 @@ class TocFetcher:
         pk = CRTPPacket()
         pk.set_header(self.port, TOC_CHANNEL)
         pk.data = (CMD_TOC_INFO, )
-        self.cf.send_packet(pk, expected_reply=(CMD_TOC_INFO,))
+        self.cf.send_packet(pk, expected_reply=(CMD_TOC_INFO,),
+                            retry_policy=SETUP_RETRY_POLICY)
 
     def _toc_fetch_finished(self):
         """Callback for when the TOC fetching is finished"""
         self.cf.remove_port_callback(self.port, self._new_packet_cb)
         logger.debug("[%d]: Done!", self.port)
+        self.state = IDLE
         self.finished_callback()
 
     def _new_packet_cb(self, packet):
@@ -160,44 +265,84 @@ class TocFetcher:
         chan = packet.channel
         if (chan != 0):
             return
-        payload = struct.pack("B" * (len(packet.datal) - 1), *packet.datal[1:])
+        payload = bytes(packet[1:])
 
-        if (self.state == GET_TOC_INFO):
+        if (self.state == GET_TOC_INFO and packet[0] == CMD_TOC_INFO):
             [self.nbr_of_items, self._crc] = struct.unpack("<BI", payload[:5])
             logger.debug("[%d]: Got TOC CRC, %d items and crc=0x%08X",
                          self.port, self.nbr_of_items, self._crc)
 
-            cache_data = self._toc_cache.fetch(self._crc)
-            if (cache_data):
-                self.toc.toc = cache_data
-                logger.info("TOC for port [%s] found in cache" % self.port)
-                self._toc_fetch_finished()
-            else:
-                self.state = GET_TOC_ELEMENT
-                self.requested_index = 0
-                self._request_toc_element(self.requested_index)
-
-        elif (self.state == GET_TOC_ELEMENT):
-            # Always add new element, but only request new if it's not the
-            # last one.
-            if self.requested_index != ord(payload[0]):
+            # If another Crazyflie is downloading the same TOC the answer
+            # comes when it's done
+            self.state = WAIT_FOR_SHARED
+            self._toc_cache.fetch(self._crc, self._queue_cache_answer,
+                                  self.cf)
+
+        elif (self.state == GET_TOC_ELEMENT and
+                packet[0] == CMD_TOC_ELEMENT):
+            index = packet[1]
+            # Drop answers to requests we have not sent and duplicates (i.e
+            # answers to resent requests), which means that the answers are
+            # too slow for the current window
+            if index > self.requested_index:
+                return
+            if index < self._next_index or index in self._received:
+                self._window = max(1, self._window // 2)
                 return
-            self.toc.add_element(self.element_class(payload))
-            logger.debug("Added element [%s]",
-                         self.element_class(payload).ident)
-            if (self.requested_index < (self.nbr_of_items - 1)):
-                logger.debug("[%d]: More variables, requesting index %d",
-                             self.port, self.requested_index + 1)
-                self.requested_index = self.requested_index + 1
-                self._request_toc_element(self.requested_index)
+            self._window = min(self._window + 1, self.window)
+            self._received[index] = self.element_class(payload)
+            logger.debug("Received element [%d]", index)
+            while self._next_index in self._received:
+                self.toc.add_element(self._received.pop(self._next_index))
+                self._next_index += 1
+
+            if (self._next_index < self.nbr_of_items):
+                self._request_window()
             else:  # No more variables in TOC
-                self._toc_cache.insert(self._crc, self.toc.toc)
+                self.toc.adopt(self._toc_cache.insert(self._crc,
+                                                      self.toc.toc))
                 self._toc_fetch_finished()
 
+    def _queue_cache_answer(self, snapshot):
+        """Called by the TOC cache, possibly from the thread of another
+        Crazyflie, the answer is handled in the thread of our Crazyflie"""
+        self.cf.queue_call(self._cache_answer, snapshot)
+
+    def _cache_answer(self, snapshot):
+        """Called by the TOC cache with the TOC (a frozen Toc) for the CRC,
+        or None if it should be downloaded"""
+        if self.state != WAIT_FOR_SHARED:
+            return
+        if snapshot is not None:
+            self.toc.adopt(snapshot)
+            logger.info("TOC for port [%s] found in cache" % self.port)
+            self._toc_fetch_finished()
+        elif self.nbr_of_items == 0:
+            self.toc.adopt(self._toc_cache.insert(self._crc, self.toc.toc))
+            self._toc_fetch_finished()
+        else:
+            self.state = GET_TOC_ELEMENT
+            self._next_index = 0
+            self._received = {}
+            self._window = 1
+            self.requested_index = -1
+            self._request_window()
+
+    def _request_window(self):
+        """Request elements until there's _window elements outstanding"""
+        last_index = min(self._next_index + self._window,
+                         self.nbr_of_items) - 1
+        while self.requested_index < last_index:
+            self.requested_index += 1
+            logger.debug("[%d]: More variables, requesting index %d",
+                         self.port, self.requested_index)
+            self._request_toc_element(self.requested_index)
+
     def _request_toc_element(self, index):
         """Request information about a specific item in the TOC"""
         logger.debug("Requesting index %d on port %d", index, self.port)
         pk = CRTPPacket()
         pk.set_header(self.port, TOC_CHANNEL)
         pk.data = (CMD_TOC_ELEMENT, index)
-        self.cf.send_packet(pk, expected_reply=(CMD_TOC_ELEMENT, index))
+        self.cf.send_packet(pk, expected_reply=(CMD_TOC_ELEMENT, index),
+                            retry_policy=SETUP_RETRY_POLICY)
@@ -29,21 +29,234 @@
 """
 Access the TOC cache for reading/writing. It supports both user
 cache and dist cache.
+
+The TOCs are stored in one binary file per cache directory (CACHE_FILE).
+The file starts with an index of the CRCs of the TOCs it contains, so it
+can be memory-mapped and a TOC decoded in one pass without reading the
+rest of the file. The file is always replaced atomically when a TOC is
+added. TOCs in the old JSON format (one CRC.json file per TOC) are
+migrated to the binary file of the user cache when the cache is opened,
+or read as they are if there is no user cache.
 """
 
 __author__ = 'Bitcraze AB'
-__all__ = ['TocCache']
+__all__ = ['TocCache', 'SharedTocCache', 'get_shared_cache']
 
 import os
+import re
 import json
+import mmap
+import struct
+import tempfile
 from glob import glob
+from collections import OrderedDict
+from threading import Lock
 
 import logging
 logger = logging.getLogger(__name__)
 
-from .log import LogTocElement  # pylint: disable=W0611
-from .param import ParamTocElement  # pylint: disable=W0611
- 
+from .log import LogTocElement
+from .param import ParamTocElement
+from .toc import Toc
+
+# Name of the binary cache file in the cache directories
+CACHE_FILE = "toccache.bin"
+
+_MAGIC = "CFTC"
+_VERSION = 1
+# Magic, version and number of TOCs
+_HEADER = struct.Struct("<4sBI")
+# CRC, offset and length of a TOC in the file
+_INDEX_ENTRY = struct.Struct("<III")
+# Element class id and number of elements of a TOC
+_TOC_HEADER = struct.Struct("<BH")
+# Ident, type id, access and length of the group and name of an element,
+# followed by the group and name
+_ELEMENT = struct.Struct("<HBBBB")
+
+# Number of TOCs kept in memory by the shared caches
+SHARED_CACHE_SIZE = 32
+
+# The classes of the elements that can be stored, the position in the
+# list is used as id in the file
+_ELEMENT_CLASSES = [LogTocElement, ParamTocElement]
+
+
+def _type_id(element_class, ctype):
+    """Return the id of the type of an element in the types of its class"""
+    for (type_id, info) in element_class.types.items():
+        if info[0] == ctype:
+            return type_id
+    raise KeyError("Type [%s] not found in %s.types!" %
+                   (ctype, element_class.__name__))
+
+
+def encode_toc(toc):
+    """Encode a TOC dictionary ({group: {name: element}}) to a string"""
+    elements = [element for group in toc.values()
+                for element in group.values()]
+    class_id = 0
+    if elements:
+        class_id = _ELEMENT_CLASSES.index(elements[0].__class__)
+    data = [_TOC_HEADER.pack(class_id, len(elements))]
+    element_class = _ELEMENT_CLASSES[class_id]
+    for element in sorted(elements, key=lambda e: e.ident):
+        data.append(_ELEMENT.pack(element.ident,
+                                  _type_id(element_class, element.ctype),
+                                  element.access, len(element.group),
+                                  len(element.name)))
+        data.append(element.group)
+        data.append(element.name)
+    return "".join(data)
+
+
+def decode_toc(data, offset=0):
+    """Decode a TOC encoded by encode_toc from data (a string, buffer or
+    mmap) starting at offset and return it as a dictionary
+    {group: {name: element}}"""
+    (class_id, count) = _TOC_HEADER.unpack_from(data, offset)
+    offset += _TOC_HEADER.size
+    element_class = _ELEMENT_CLASSES[class_id]
+    types = element_class.types
+    toc = {}
+    for _ in xrange(count):
+        (ident, type_id, access, group_length,
+         name_length) = _ELEMENT.unpack_from(data, offset)
+        offset += _ELEMENT.size
+        element = element_class()
+        element.ident = ident
+        element.ctype = types[type_id][0]
+        element.pytype = types[type_id][1]
+        element.access = access
+        element.group = data[offset:offset + group_length]
+        offset += group_length
+        element.name = data[offset:offset + name_length]
+        offset += name_length
+        try:
+            toc[element.group][element.name] = element
+        except KeyError:
+            toc[element.group] = {element.name: element}
+    return toc
+
+
+class _CacheFile(object):
+    """A memory-mapped binary cache file and its index"""
+
+    def __init__(self, path):
+        self.path = path
+        # Position and length of the TOCs in the file, by CRC
+        self.index = {}
+        self._map = None
+        self._load()
+
+    def _load(self):
+        self.close()
+        self.index = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as cache:
+                if os.fstat(cache.fileno()).st_size == 0:
+                    return
+                self._map = mmap.mmap(cache.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            (magic, version, count) = _HEADER.unpack_from(self._map, 0)
+            if magic != _MAGIC or version != _VERSION:
+                raise Exception("not a version %d cache file" % _VERSION)
+            offset = _HEADER.size
+            for _ in xrange(count):
+                (crc, position, length) = _INDEX_ENTRY.unpack_from(self._map,
+                                                                   offset)
+                self.index[crc] = (position, length)
+                offset += _INDEX_ENTRY.size
+        except Exception as exp:
+            logger.warning("Error while reading cache file [%s]: %s",
+                           self.path, str(exp))
+            self.close()
+            self.index = {}
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def get(self, crc):
+        """Return the TOC dictionary for crc"""
+        (position, length) = self.index[crc]
+        return decode_toc(self._map, position)
+
+    def get_encoded(self, crc):
+        (position, length) = self.index[crc]
+        return self._map[position:position + length]
+
+    def write(self, tocs):
+        """Replace the file with one containing the encoded TOCs in the
+        dictionary tocs {crc: data}, plus the ones already in the file"""
+        for crc in self.index:
+            if crc not in tocs:
+                tocs[crc] = self.get_encoded(crc)
+        crcs = sorted(tocs.keys())
+        position = _HEADER.size + _INDEX_ENTRY.size * len(crcs)
+        data = [_HEADER.pack(_MAGIC, _VERSION, len(crcs))]
+        for crc in crcs:
+            data.append(_INDEX_ENTRY.pack(crc, position, len(tocs[crc])))
+            position += len(tocs[crc])
+        data += [tocs[crc] for crc in crcs]
+
+        # Write to a new file that replaces the old one, so the file is
+        # never seen half written
+        directory = os.path.dirname(self.path) or "."
+        (fd, tmp_path) = tempfile.mkstemp(prefix=".toccache",
+                                          dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as cache:
+                cache.write("".join(data))
+                cache.flush()
+                os.fsync(cache.fileno())
+            self.close()
+            if os.name == "nt" and os.path.exists(self.path):
+                # Renaming over an existing file is not possible on Windows
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            self._load()
+
+
+def _read_json(filename):
+    """Read a TOC from a cache file in the JSON format"""
+    with open(filename) as cache:
+        return json.load(cache, object_hook=_json_decoder)
+
+
+def _json_decoder(obj):
+    """ Decode a toc element leaf-node """
+    if '__class__' in obj:
+        classes = dict((c.__name__, c) for c in _ELEMENT_CLASSES)
+        elem = classes[obj['__class__']]()
+        elem.ident = obj['ident']
+        elem.group = str(obj['group'])
+        elem.name = str(obj['name'])
+        elem.ctype = str(obj['ctype'])
+        elem.pytype = str(obj['pytype'])
+        elem.access = obj['access']
+        return elem
+    return obj
+
+
+def _find_json_files(directory):
+    """Return the JSON cache files in directory as a dictionary
+    {crc: filename}"""
+    files = {}
+    for filename in glob(os.path.join(directory, "*.json")):
+        match = re.match("^([0-9A-Fa-f]{8})\\.json$",
+                         os.path.basename(filename))
+        if match:
+            files[int(match.group(1), 16)] = filename
+    return files
 
 
 class TocCache():
@@ -52,75 +265,201 @@ class TocCache():
     don't supply any directories.
     """
     def __init__(self, ro_cache=None, rw_cache=None):
-        self._cache_files = []
+        self._rw_file = None
+        # The cache file (or JSON file name) of every TOC by CRC, the user
+        # cache takes precedence over the dist cache
+        self._index = {}
+        json_files = {}
+
         if (ro_cache):
-            self._cache_files += glob(ro_cache + "/*.json")
+            ro_file = _CacheFile(os.path.join(ro_cache, CACHE_FILE))
+            json_files.update(_find_json_files(ro_cache))
+            for crc in ro_file.index:
+                self._index[crc] = ro_file
         if (rw_cache):
-            self._cache_files += glob(rw_cache + "/*.json")
             if not os.path.exists(rw_cache):
                 os.makedirs(rw_cache)
+            self._rw_file = _CacheFile(os.path.join(rw_cache, CACHE_FILE))
+            json_files.update(_find_json_files(rw_cache))
+            for crc in self._rw_file.index:
+                self._index[crc] = self._rw_file
 
-        self._rw_cache = rw_cache
+        self._migrate(json_files)
 
-    def fetch(self, crc):
-        """ Try to get a hit in the cache, return None otherwise """
-        cache_data = None
-        pattern = "%08X.json" % crc
-        hit = None
-
-        for name in self._cache_files:
-            if (name.endswith(pattern)):
-                hit = name
-
-        if (hit):
+    def _migrate(self, json_files):
+        """Add the TOCs only found in JSON files to the user cache, or to
+        the index as JSON files if there's no user cache"""
+        migrated = {}
+        for (crc, filename) in json_files.items():
+            if crc in self._index:
+                continue
+            if self._rw_file is None:
+                self._index[crc] = filename
+                continue
             try:
-                cache = open(hit)
-                cache_data = json.load(cache,
-                                       object_hook=self._decoder)
-                cache.close()
+                migrated[crc] = encode_toc(_read_json(filename))
             except Exception as exp:
                 logger.warning("Error while parsing cache file [%s]:%s",
-                               hit, str(exp))
+                               filename, str(exp))
+        if migrated:
+            try:
+                self._rw_file.write(migrated)
+                logger.info("Migrated %d JSON TOCs to [%s]", len(migrated),
+                            self._rw_file.path)
+            except Exception as exp:
+                logger.warning("Could not migrate the JSON TOCs to [%s]: %s",
+                               self._rw_file.path, str(exp))
+            for crc in self._rw_file.index:
+                self._index[crc] = self._rw_file
 
-        return cache_data
+    def fetch(self, crc):
+        """ Try to get a hit in the cache, return None otherwise """
+        hit = self._index.get(crc)
+        if hit is None:
+            return None
+        try:
+            if isinstance(hit, _CacheFile):
+                return hit.get(crc)
+            return _read_json(hit)
+        except Exception as exp:
+            logger.warning("Error while reading TOC %08X from cache: %s",
+                           crc, str(exp))
+        return None
 
     def insert(self, crc, toc):
         """ Save a new cache to file """
-        if self._rw_cache:
+        if self._rw_file:
             try:
-                filename = "%s/%08X.json" % (self._rw_cache, crc)
-                cache = open(filename, 'w')
-                cache.write(json.dumps(toc, indent=2,
-                            default=self._encoder))
-                cache.close()
-                logger.info("Saved cache to [%s]", filename)
-                self._cache_files += [filename]
+                self._rw_file.write({crc: encode_toc(toc)})
+                for crc in self._rw_file.index:
+                    self._index[crc] = self._rw_file
+                logger.info("Saved cache to [%s]", self._rw_file.path)
             except Exception as exp:
                 logger.warning("Could not save cache to file [%s]: %s",
-                               filename, str(exp))
+                               self._rw_file.path, str(exp))
         else:
             logger.warning("Could not save cache, no writable directory")
 
-    def _encoder(self, obj):
-        """ Encode a toc element leaf-node """
-        return {'__class__': obj.__class__.__name__,
-                'ident': obj.ident,
-                'group': obj.group,
-                'name': obj.name,
-                'ctype': obj.ctype,
-                'pytype': obj.pytype,
-                'access': obj.access}
-        raise TypeError(repr(obj) + ' is not JSON serializable')
-
-    def _decoder(self, obj):
-        """ Decode a toc element leaf-node """
-        if '__class__' in obj:
-            elem = eval(obj['__class__'])()
-            elem.ident = obj['ident']
-            elem.group = str(obj['group'])
-            elem.name = str(obj['name'])
-            elem.ctype = str(obj['ctype'])
-            elem.pytype = str(obj['pytype'])
-            elem.access = obj['access']
-            return elem
-        return obj
+
+class SharedTocCache(object):
+    """
+    TOC cache shared by all the Crazyflies in the process. The TOCs are
+    kept in memory as frozen Toc objects, so Crazyflies with the same
+    firmware use the same TOC without decoding it again. The least
+    recently used TOCs are dropped when there are more than size of them,
+    they are still found in the TocCache (the files) afterwards.
+
+    Only one Crazyflie downloads a TOC that isn't cached, the others
+    asking for the same CRC get it when the download is done. Their
+    callbacks are then called from the thread inserting the TOC (or
+    releasing the download), so they should hand the answer over to their
+    own thread (see Crazyflie.queue_call) instead of doing the work there.
+    """
+
+    def __init__(self, ro_cache=None, rw_cache=None, size=SHARED_CACHE_SIZE):
+        self._store = TocCache(ro_cache=ro_cache, rw_cache=rw_cache)
+        self._size = max(1, size)
+        self._lock = Lock()
+        # Frozen TOCs by CRC, in least recently used order
+        self._tocs = OrderedDict()
+        # TOCs being downloaded, by CRC. Each entry is a list where the
+        # first item is the owner of the download and the rest are
+        # (owner, callback) of the ones waiting for it
+        self._downloads = {}
+
+    def fetch(self, crc, callback, owner=None):
+        """
+        Look up the TOC with the CRC crc. callback is called with the TOC
+        (a frozen Toc) when it's available, or with None if the caller
+        should download the TOC and insert it. If another owner is
+        downloading the TOC the callback is called when it's done,
+        otherwise it's called before fetch returns. owner (i.e the
+        Crazyflie) is used to release the download if the owner goes away,
+        see release.
+        """
+        with self._lock:
+            toc = self._get(crc)
+            if toc is None:
+                download = self._downloads.get(crc)
+                if download is not None:
+                    download.append((owner, callback))
+                    return
+                self._downloads[crc] = [owner]
+        callback(toc)
+
+    def _get(self, crc):
+        """Return the frozen TOC for crc from memory or from the files, must
+        be called with the lock held"""
+        toc = self._tocs.pop(crc, None)
+        if toc is None:
+            data = self._store.fetch(crc)
+            if data is None:
+                return None
+            toc = Toc()
+            toc.toc = data
+            toc.freeze()
+        self._add(crc, toc)
+        return toc
+
+    def _add(self, crc, toc):
+        self._tocs[crc] = toc
+        while len(self._tocs) > self._size:
+            self._tocs.popitem(last=False)
+
+    def insert(self, crc, toc):
+        """
+        Add a downloaded TOC (a dictionary {group: {name: element}}) and
+        return it as a frozen Toc. The ones waiting for it are called with
+        the frozen Toc.
+        """
+        snapshot = Toc()
+        snapshot.toc = toc
+        snapshot.freeze()
+        with self._lock:
+            self._store.insert(crc, toc)
+            self._add(crc, snapshot)
+            download = self._downloads.pop(crc, [None])
+        for (_, callback) in download[1:]:
+            callback(snapshot)
+        return snapshot
+
+    def release(self, owner):
+        """
+        Forget everything owner is waiting for. Downloads started by owner
+        are handed over to the first one waiting for the same TOC.
+        """
+        handovers = []
+        with self._lock:
+            for (crc, download) in self._downloads.items():
+                waiting = [w for w in download[1:] if w[0] is not owner]
+                if download[0] is not owner:
+                    self._downloads[crc] = [download[0]] + waiting
+                elif waiting:
+                    self._downloads[crc] = [waiting[0][0]] + waiting[1:]
+                    handovers.append(waiting[0][1])
+                else:
+                    del self._downloads[crc]
+        for callback in handovers:
+            callback(None)
+
+    def clear(self):
+        """Drop the TOCs kept in memory"""
+        with self._lock:
+            self._tocs.clear()
+
+
+# The shared caches by cache directories
+_shared_caches = {}
+_shared_caches_lock = Lock()
+
+
+def get_shared_cache(ro_cache=None, rw_cache=None):
+    """Return the SharedTocCache for the cache directories, it's created
+    the first time"""
+    key = (ro_cache, rw_cache)
+    with _shared_caches_lock:
+        cache = _shared_caches.get(key)
+        if cache is None:
+            cache = SharedTocCache(ro_cache=ro_cache, rw_cache=rw_cache)
+            _shared_caches[key] = cache
+        return cache
@@ -37,11 +37,12 @@ logger = logging.getLogger(__name__)
 
 from .radiodriver import RadioDriver
 from .udpdriver import UdpDriver
-from .serialdriver import SerialDriver
+from .serialdriver import SerialPeerDriver
 from .debugdriver import DebugDriver
+from .replaydriver import ReplayDriver
 from .exceptions import WrongUriType
 
-DRIVERS = [RadioDriver, SerialDriver, UdpDriver, DebugDriver]
+DRIVERS = [RadioDriver, SerialPeerDriver, UdpDriver, ReplayDriver, DebugDriver]
 INSTANCES = []
 
 
@@ -55,14 +56,16 @@ def init_drivers(enable_debug_driver=False):
             continue
 
 
-def scan_interfaces():
-    """ Scan all the interfaces for available Crazyflies """
+def scan_interfaces(incremental=False):
+    """ Scan all the interfaces for available Crazyflies. If incremental is
+    True, drivers that support it only look for the Crazyflies found by the
+    previous scan, which is a lot faster."""
     available = []
     found = []
     for instance in INSTANCES:
         logger.debug("Scanning: %s", instance)
         try:
-            found = instance.scan_interface()
+            found = instance.scan_interface(incremental)
             available += found
         except Exception:
             raise
@@ -83,11 +86,14 @@ def get_interfaces_status():
 def get_link_driver(uri, link_quality_callback=None, link_error_callback=None):
     """Return the link driver for the given URI. Returns None if no driver
     was found for the URI or the URI was not well formatted for the matching
-    driver."""
+    driver. A new driver instance is created for every link (with the
+    options of the registered driver), so several links can be open at the
+    same time."""
     for instance in INSTANCES:
+        driver = instance.new_link()
         try:
-            instance.connect(uri, link_quality_callback, link_error_callback)
-            return instance
+            driver.connect(uri, link_quality_callback, link_error_callback)
+            return driver
         except WrongUriType:
             continue
 
@@ -33,6 +33,8 @@ CRTP Driver main class.
 __author__ = 'Bitcraze AB'
 __all__ = ['CRTPDriver']
 
+from .linkstats import LinkStatistics
+
 
 class CRTPDriver:
     """ CTRP Driver main class
@@ -44,6 +46,7 @@ class CRTPDriver:
         """Driver constructor. Throw an exception if the driver is unable to
         open the URI
         """
+        self.link_stats = LinkStatistics()
 
     def connect(self, uri, link_quality_callback, link_error_callback):
         """Connect the driver to a specified URI
@@ -75,10 +78,13 @@ class CRTPDriver:
         Return a human readable name of the interface.
         """
 
-    def scan_interface(self):
+    def scan_interface(self, incremental=False):
         """
         Scan interface for available Crazyflie quadcopters and return a list
         witha them.
+
+        @param incremental If True, drivers that support it only look for
+               the Crazyflies found by the previous scan
         """
 
     def enum(self):
@@ -91,5 +97,15 @@ class CRTPDriver:
         None means no help
         """
 
+    def new_link(self):
+        """Return a new, not connected, driver of the same kind with the
+        same options, used to open a link"""
+        return self.__class__()
+
+    def get_statistics(self):
+        """Return a snapshot of the link statistics as a dictionary (see
+        LinkStatistics.sample)"""
+        return self.link_stats.sample()
+
     def close(self):
         """Close the link"""
@@ -34,7 +34,7 @@ __author__ = 'Bitcraze AB'
 __all__ = ['CRTPPort', 'CRTPPacket']
 
 
-import struct
+from array import array
 
 
 class CRTPPort:
@@ -53,14 +53,23 @@ class CRTPPort:
 class CRTPPacket(object):
     """
     A packet that can be sent via the CRTP.
+
+    The payload is kept in a single mutable bytearray and the header fields
+    are cached, so reading a byte of the packet (pk[i]) or decoding a field
+    directly from the payload (struct.unpack_from(fmt, pk.payload, offset))
+    does not create any intermediate objects. The data, datal, datat and
+    datas properties are kept for compatibility with older code but will
+    create a copy of the payload every time they are accessed.
     """
 
+    __slots__ = ('header', 'size', '_port', '_channel', '_data')
+
     def __init__(self, header=0, data=None):
         """
         Create an empty packet with default values.
         """
         self.size = 0
-        self._data = ""
+        self._data = bytearray()
         # The two bits in position 3 and 4 needs to be set for legacy
         # support of the bootloader
         self.header = header | 0x3 << 2
@@ -97,7 +106,7 @@ class CRTPPacket(object):
         Set the port and channel for this packet.
         """
         self._port = port
-        self.channel = channel
+        self._channel = channel
         self._update_header()
 
     def _update_header(self):
@@ -105,39 +114,47 @@ class CRTPPacket(object):
         # The two bits in position 3 and 4 needs to be set for legacy
         # support of the bootloader
         self.header = ((self._port & 0x0f) << 4 | 3 << 2 |
-                       (self.channel & 0x03))
+                       (self._channel & 0x03))
+
+    def __getitem__(self, index):
+        """Get one byte (as an int) or a slice (as a bytearray) of the
+        payload"""
+        return self._data[index]
+
+    def _get_payload(self):
+        """Get the payload buffer of the packet. This is not a copy, so
+        changes made to the returned bytearray will change the packet."""
+        return self._data
 
     #Some python madness to access different format of the data
     def _get_data(self):
         """Get the packet data"""
-        return self._data
+        return bytes(self._data)
 
     def _set_data(self, data):
-        """Set the packet data"""
-        if type(data) == str:
+        """Set the packet data. A bytearray is used as is (without copying
+        it), any other supported type is copied into a new bytearray."""
+        if type(data) == bytearray:
             self._data = data
-        elif type(data) == list or type(data) == tuple:
-            if len(data) == 1:
-                self._data = struct.pack("B", data[0])
-            elif len(data) > 1:
-                self._data = struct.pack("B" * len(data), *data)
-            else:
-                self._data = ""
+        elif type(data) in (str, list, tuple, memoryview, buffer, array):
+            self._data = bytearray(data)
         else:
-            raise Exception("Data shall be of str, tupple or list type")
+            raise Exception("Data shall be of str, bytearray, tupple or list"
+                            " type")
 
     def _get_data_l(self):
         """Get the data in the packet as a list"""
-        return list(self._get_data_t())
+        return list(self._data)
 
     def _get_data_t(self):
         """Get the data in the packet as a tuple"""
-        return struct.unpack("B" * len(self._data), self._data)
+        return tuple(self._data)
 
     def __str__(self):
         """Get a string representation of the packet"""
-        return "{}:{} {}".format(self._port, self.channel, self.datat)
+        return "{}:{} {}".format(self._port, self._channel, self.datat)
 
+    payload = property(_get_payload, _set_data)
     data = property(_get_data, _set_data)
     datal = property(_get_data_l, _set_data)
     datat = property(_get_data_t, _set_data)
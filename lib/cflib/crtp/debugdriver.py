@@ -54,6 +54,8 @@ from cflib.crazyflie.param import ParamTocElement
 import random
 import string
 import errno
+import heapq
+import itertools
 
 import logging
 logger = logging.getLogger(__name__)
@@ -72,6 +74,7 @@ class DebugDriver (CRTPDriver):
     """ Debug driver used for debugging UI/communication without using a
     Crazyflie"""
     def __init__(self):
+        CRTPDriver.__init__(self)
         self.fakeLoggingThreads = []
         # Fill up the fake logging TOC with values and data
         self.fakeLogToc = []
@@ -253,18 +256,21 @@ class DebugDriver (CRTPDriver):
         self.fakeflash = {}
         self._random_answer_delay = True
         self.queue = Queue.Queue()
+        self.link_stats.set_queues(self.queue, None)
         self._packet_handler = _PacketHandlingThread(self.queue,
                                                      self.fakeLogToc,
                                                      self.fakeParamToc)
         self._packet_handler.start()
 
-    def scan_interface(self):
+    def scan_interface(self, incremental=False):
         return [["debug://0/0", "Normal connection"],
                 ["debug://0/1", "Fail to connect"],
                 ["debug://0/2", "Incomplete log TOC download"],
                 ["debug://0/3", "Insert random delays on replies"],
                 ["debug://0/4", "Insert random delays on replies and random TOC CRCs"],
-                ["debug://0/5", "Normal but random TOC CRCs"]]
+                ["debug://0/5", "Normal but random TOC CRCs"],
+                ["debug://0/6", "Insert random latency on replies (out of"
+                                " order)"]]
 
 
     def get_status(self):
@@ -287,6 +293,7 @@ class DebugDriver (CRTPDriver):
         self._packet_handler.doIncompleteLogTOC = False
         self._packet_handler.bootloader = False
         self._packet_handler._random_answer_delay = False
+        self._packet_handler._random_answer_latency = False
         self._packet_handler._random_toc_crcs = False
 
         if (re.search("^debug://.*/1\Z", uri)):
@@ -302,6 +309,9 @@ class DebugDriver (CRTPDriver):
             self._packet_handler._random_toc_crcs = True
         if (re.search("^debug://.*/5\Z", uri)):
             self._packet_handler._random_toc_crcs = True
+        if (re.search("^debug://.*/6\Z", uri)):
+            self._packet_handler._random_answer_delay = True
+            self._packet_handler._random_answer_latency = True
 
         self.fakeConsoleThread = None
 
@@ -313,23 +323,20 @@ class DebugDriver (CRTPDriver):
             self._packet_handler.linkQualityCallback(0)
 
     def receive_packet(self, time=0):
-        if time == 0:
-            try:
-                return self.queue.get(False)
-            except Queue.Empty:
-                return None
-        elif time < 0:
-            try:
-                return self.queue.get(True)
-            except Queue.Empty:
-                return None
-        else:
-            try:
-                return self.queue.get(True, time)
-            except Queue.Empty:
-                return None
+        try:
+            if time == 0:
+                pk = self.queue.get(False)
+            elif time < 0:
+                pk = self.queue.get(True)
+            else:
+                pk = self.queue.get(True, time)
+        except Queue.Empty:
+            return None
+        self.link_stats.packet_in(pk)
+        return pk
 
     def send_packet(self, pk):
+        self.link_stats.packet_out(pk)
         self._packet_handler.handle_packet(pk)
 
     def close(self):
@@ -354,7 +361,12 @@ class _PacketHandlingThread(Thread):
         self.doIncompleteLogTOC = False
         self.bootloader = False
         self._random_answer_delay = False
+        # Delay each answer on its own instead of one at a time
+        self._random_answer_latency = False
         self._random_toc_crcs = False
+        # Heap of (due time, sequence number, packet) of the delayed answers
+        self._delayed = []
+        self._sequence = itertools.count()
 
         self.linkErrorCallback = None
         self.linkQualityCallback = None
@@ -370,7 +382,19 @@ class _PacketHandlingThread(Thread):
 
     def run(self):
         while (True):
-            pk = self._in_queue.get(True)
+            timeout = None
+            if self._delayed:
+                timeout = max(0, self._delayed[0][0] - time.time())
+            try:
+                pk = self._in_queue.get(True, timeout)
+            except Queue.Empty:
+                pk = None
+            # Send the delayed answers that are due
+            now = time.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                self.queue.put(heapq.heappop(self._delayed)[2])
+            if pk is None:
+                continue
             if (self.inhibitAnswers):
                 self.nowAnswerCounter = self.nowAnswerCounter - 1
                 logger.debug("Not answering with any data, will send link errori"
@@ -627,10 +651,18 @@ class _PacketHandlingThread(Thread):
 
     def _send_packet(self, pk):
         # Do not delay log data
-        if self._random_answer_delay and pk.port != 0x05 and pk.channel != 0x02:
+        if self._random_answer_delay and not (pk.port == 0x05 and
+                                              pk.channel == 0x02):
             # Calculate a delay between 0ms and 250ms
             delay = random.randint(0, 250)/1000.0
             logger.debug("Delaying answer %.2fms", delay*1000)
+            if self._random_answer_latency:
+                # Delay each answer on its own, like the latency of a real
+                # link, so answers to requests sent close together can
+                # arrive out of order. They are sent by run() when due.
+                heapq.heappush(self._delayed, (time.time() + delay,
+                                               next(self._sequence), pk))
+                return
             time.sleep(delay)
         self.queue.put(pk)
 
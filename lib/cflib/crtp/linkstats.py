@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Link statistics collected by the CRTP link drivers.
+
+The drivers update plain counters for every packet, which is cheap enough
+to always be enabled. Nothing is reported by the driver, instead the
+statistics are sampled on demand with sample(), which also computes the
+derived values (ratios, queue depths and latency percentiles).
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['LinkStatistics']
+
+import collections
+
+# Number of round-trip latency samples kept for the percentiles
+LATENCY_SAMPLES = 1000
+# Number of CRTP ports
+PORTS = 16
+# The ack retry count is a 4-bit value
+MAX_RETRIES = 16
+
+
+class LinkStatistics(object):
+    """Counters for the traffic of one link"""
+
+    def __init__(self):
+        self.in_queue = None
+        self.out_queue = None
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters"""
+        self.packets_in = [0] * PORTS
+        self.bytes_in = [0] * PORTS
+        self.packets_out = [0] * PORTS
+        self.bytes_out = [0] * PORTS
+        self.retries = [0] * MAX_RETRIES
+        self.acks = 0
+        self.empty_acks = 0
+        self.lost = 0
+        self.drops = 0
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def set_queues(self, in_queue, out_queue):
+        """Set the queues of the driver, their depths are sampled"""
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+
+    def packet_in(self, pk):
+        """Count a packet received from the Crazyflie"""
+        port = pk.port & 0x0F
+        self.packets_in[port] += 1
+        self.bytes_in[port] += len(pk.payload) + 1
+
+    def packet_out(self, pk):
+        """Count a packet sent to the Crazyflie"""
+        port = pk.port & 0x0F
+        self.packets_out[port] += 1
+        self.bytes_out[port] += len(pk.payload) + 1
+
+    def ack(self, retries, empty):
+        """Count an ack received after retries retries, empty if it didn't
+        contain any data"""
+        self.acks += 1
+        self.retries[min(retries, MAX_RETRIES - 1)] += 1
+        if empty:
+            self.empty_acks += 1
+
+    def packet_lost(self):
+        """Count a packet that was not acked"""
+        self.lost += 1
+
+    def packet_dropped(self):
+        """Count a packet that was dropped before being sent"""
+        self.drops += 1
+
+    def round_trip(self, seconds):
+        """Add a round-trip latency sample"""
+        self._latencies.append(seconds)
+
+    @staticmethod
+    def _queue_depth(queue):
+        if queue is None:
+            return None
+        return queue.qsize()
+
+    def sample(self):
+        """Return a snapshot of the statistics as a dictionary"""
+        latencies = sorted(self._latencies)
+        percentiles = {}
+        for p in (50, 90, 99):
+            if latencies:
+                index = min(len(latencies) - 1, len(latencies) * p // 100)
+                percentiles[p] = latencies[index]
+            else:
+                percentiles[p] = None
+        acks = self.acks
+        return {"packets_in": sum(self.packets_in),
+                "packets_out": sum(self.packets_out),
+                "bytes_in": sum(self.bytes_in),
+                "bytes_out": sum(self.bytes_out),
+                "ports_in": dict((port, (self.packets_in[port],
+                                         self.bytes_in[port]))
+                                 for port in range(PORTS)
+                                 if self.packets_in[port]),
+                "ports_out": dict((port, (self.packets_out[port],
+                                          self.bytes_out[port]))
+                                  for port in range(PORTS)
+                                  if self.packets_out[port]),
+                "acks": acks,
+                "retries": list(self.retries),
+                "empty_ack_ratio": (float(self.empty_acks) / acks
+                                    if acks else 0.0),
+                "lost": self.lost,
+                "drops": self.drops,
+                "in_queue": self._queue_depth(self.in_queue),
+                "out_queue": self._queue_depth(self.out_queue),
+                "latency_p50": percentiles[50],
+                "latency_p90": percentiles[90],
+                "latency_p99": percentiles[99]}
@@ -34,7 +34,8 @@ USB dongle.
 """
 
 __author__ = 'Bitcraze AB'
-__all__ = ['RadioDriver']
+__all__ = ['RadioDriver', 'PollingPolicy', 'FixedPollingPolicy',
+           'AdaptivePollingPolicy']
 
 import logging
 logger = logging.getLogger(__name__)
@@ -42,32 +43,190 @@ logger = logging.getLogger(__name__)
 from cflib.crtp.crtpdriver import CRTPDriver
 from .crtpstack import CRTPPacket
 from .exceptions import WrongUriType
+from .linkstats import LinkStatistics
 import threading
 import Queue
 import re
 import array
+import collections
+import time
 
-from cflib.drivers.crazyradio import Crazyradio
+from cflib.drivers.crazyradio import Crazyradio, find_devices
+from .radioscan import scan_dongles
 from usb import USBError
 
 
+class PollingPolicy(object):
+    """
+    Decides how long the radio thread waits for a packet to send before
+    polling the Crazyflie with a null packet. Since the Crazyflie can only
+    send data in the acks, waiting longer saves USB bandwidth and CPU but
+    adds latency to the data sent from the Crazyflie. Outgoing packets are
+    always sent as soon as they are queued.
+    """
+
+    def get_wait_time(self, got_data, queue_depth):
+        """Return the time in seconds to wait for an outgoing packet
+
+        got_data -- True if the last ack contained data
+        queue_depth -- Number of outgoing packets waiting to be sent
+        """
+        return 0
+
+
+class FixedPollingPolicy(PollingPolicy):
+    """Polls as fast as possible until a number of empty acks are received
+    in a row, then waits a fixed time between polls"""
+
+    def __init__(self, empty_before_wait=10, wait_time=0.01):
+        self.empty_before_wait = empty_before_wait
+        self.wait_time = wait_time
+        self._empty_count = 0
+
+    def get_wait_time(self, got_data, queue_depth):
+        if got_data:
+            self._empty_count = 0
+            return 0
+        self._empty_count += 1
+        if self._empty_count > self.empty_before_wait:
+            self._empty_count = self.empty_before_wait
+            # Relaxation time if the last packets where empty
+            return self.wait_time
+        return 0
+
+
+class AdaptivePollingPolicy(PollingPolicy):
+    """
+    Backs off exponentially (from min_wait up to max_wait) while the link
+    is idle. It keeps track of the interval between packets from the
+    Crazyflie and, as long as data keeps coming, never waits past the time
+    the next packet is expected. A lower max_wait gives lower latency, a
+    higher one lower CPU and USB usage.
+    """
+
+    def __init__(self, min_wait=0.0005, max_wait=0.01, backoff=2.0,
+                 smoothing=0.2):
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.backoff = backoff
+        self.smoothing = smoothing
+        # Estimated time in seconds between packets from the Crazyflie
+        self.downlink_interval = None
+        self._last_data_ts = None
+        self._wait = 0.0
+
+    def get_wait_time(self, got_data, queue_depth):
+        now = time.time()
+        if got_data:
+            if self._last_data_ts is not None:
+                interval = now - self._last_data_ts
+                if self.downlink_interval is None:
+                    self.downlink_interval = interval
+                else:
+                    self.downlink_interval += (self.smoothing *
+                                               (interval -
+                                                self.downlink_interval))
+            self._last_data_ts = now
+            self._wait = 0.0
+            return 0
+        if queue_depth > 0:
+            return 0
+
+        self._wait = min(max(self._wait * self.backoff, self.min_wait),
+                         self.max_wait)
+        wait = self._wait
+        if self.downlink_interval is not None:
+            since_data = now - self._last_data_ts
+            # Only use the estimate if data is still coming in
+            if since_data < 4 * self.downlink_interval:
+                until_next = self.downlink_interval - since_data
+                wait = min(wait, max(until_next, self.min_wait))
+        return wait
+
+# Polling policies that can be selected by name, using the poll option in
+# the URI or the polling argument of the driver
+POLLING_POLICIES = {
+    "fixed": FixedPollingPolicy,
+    "adaptive": AdaptivePollingPolicy,
+    "latency": lambda: AdaptivePollingPolicy(max_wait=0.002),
+    "power": lambda: AdaptivePollingPolicy(min_wait=0.002, max_wait=0.02)
+}
+
+
+# Format of the radio URIs, the groups used are 1: dongle number,
+# 4: channel, 7: datarate, 9: address and 11: options
+_URI_RE = re.compile("^radio://([0-9]+)((/([0-9]+))"
+                     "((/(250K|1M|2M))(/([0-9A-Fa-f]{10}))?)?)?"
+                     "(\\?([a-z]+=[a-z0-9]+(&[a-z]+=[a-z0-9]+)*))?$")
+
+DEFAULT_ADDRESS = (0xE7,) * 5
+
+# Dongles opened by the radio links, indexed by dongle number. A dongle is
+# shared by all the links opened on it and closed with the last one.
+_shared_radios = {}
+_shared_radios_lock = threading.Lock()
+
+
 class RadioDriver(CRTPDriver):
     """ Crazyradio link driver """
-    def __init__(self):
-        """ Create the link driver """
+    def __init__(self, batch_size=1, polling="fixed", weight=1,
+                 latency_budget=0.01):
+        """ Create the link driver
+
+        batch_size -- Max number of queued packets that are sent in one
+                      turn of the link. Using more than 1 gives higher
+                      throughput, but the link quality is only reported
+                      once per turn.
+        polling -- Name of the polling policy used when the link is idle
+                   (fixed, adaptive, latency or power) or a function
+                   returning a new PollingPolicy
+        weight -- Share of the dongle the link gets when several links are
+                  open on the same dongle, a link with weight 2 gets twice
+                  as many turns as a link with weight 1
+        latency_budget -- Max time in seconds a link that has something to
+                          send should wait for its turn. Links waiting
+                          longer are served first.
+
+        All of them can also be set for one link using the options batch,
+        poll, weight and latency (in ms) in the URI.
+        """
+        if not callable(polling) and polling not in POLLING_POLICIES:
+            raise ValueError("Unknown polling policy [%s], use one of %s" %
+                             (polling, ", ".join(sorted(POLLING_POLICIES))))
         CRTPDriver.__init__(self)
+        self.batch_size = batch_size
+        self.polling = polling
+        self.weight = weight
+        self.latency_budget = latency_budget
         self.cradio = None
         self.uri = ""
         self.link_error_callback = None
         self.link_quality_callback = None
         self.in_queue = None
         self.out_queue = None
-        self._thread = None
+        self._radio = None
+        self._link = None
+        self._paused = False
+
+    def new_link(self):
+        return RadioDriver(self.batch_size, self.polling, self.weight,
+                           self.latency_budget)
 
     def connect(self, uri, link_quality_callback, link_error_callback):
         """
         Connect the link driver to a specified URI of the format:
-        radio://<dongle nbr>/<radio channel>/[250K,1M,2M]
+        radio://<dongle nbr>/<radio channel>/[250K,1M,2M]/<address>[?<options>]
+
+        The address is 5 bytes written as 10 hex digits (E7E7E7E7E7 if
+        not given). Several links can be open at the same time on one
+        dongle as long as they use different channels, datarates or
+        addresses, the dongle is then shared between the links in turns.
+
+        The options are given as name=value separated by &:
+          batch -- Max number of packets sent per turn (int)
+          poll -- Polling policy: fixed, adaptive, latency or power
+          weight -- Share of the dongle compared to the other links (int)
+          latency -- Latency budget of the link in ms (int)
 
         The callback for linkQuality can be called at any moment from the
         driver to report back the link quality in percentage. The
@@ -80,55 +239,70 @@ class RadioDriver(CRTPDriver):
             raise WrongUriType("Not a radio URI")
 
         # Open the USB dongle
-        if not re.search("^radio://([0-9]+)((/([0-9]+))(/(250K|1M|2M))?)?$",
-                         uri):
+        uri_data = _URI_RE.search(uri)
+        if not uri_data:
             raise WrongUriType('Wrong radio URI format!')
 
-        uri_data = re.search("^radio://([0-9]+)((/([0-9]+))"
-                             "(/(250K|1M|2M))?)?$",
-                             uri)
-
-        self.uri = uri
+        batch_size = self.batch_size
+        polling = self.polling
+        weight = self.weight
+        latency_budget = self.latency_budget
+        if uri_data.group(11):
+            for option in uri_data.group(11).split("&"):
+                [name, value] = option.split("=")
+                if name == "batch" and value.isdigit():
+                    batch_size = int(value)
+                elif name == "poll" and value in POLLING_POLICIES:
+                    polling = value
+                elif name == "weight" and value.isdigit() and int(value):
+                    weight = int(value)
+                elif name == "latency" and value.isdigit():
+                    latency_budget = int(value) / 1000.0
+                else:
+                    raise WrongUriType("Bad radio URI option [%s]" % option)
+        if polling in POLLING_POLICIES:
+            polling = POLLING_POLICIES[polling]
 
         channel = 2
         if uri_data.group(4):
             channel = int(uri_data.group(4))
 
         datarate = Crazyradio.DR_2MPS
-        if uri_data.group(6) == "250K":
+        if uri_data.group(7) == "250K":
             datarate = Crazyradio.DR_250KPS
-        if uri_data.group(6) == "1M":
+        if uri_data.group(7) == "1M":
             datarate = Crazyradio.DR_1MPS
-        if uri_data.group(6) == "2M":
+        if uri_data.group(7) == "2M":
             datarate = Crazyradio.DR_2MPS
 
-        if self.cradio is None:
-            self.cradio = Crazyradio(devid=int(uri_data.group(1)))
-        else:
-            raise Exception("Link already open!")
+        address = DEFAULT_ADDRESS
+        if uri_data.group(9):
+            address = tuple(int(uri_data.group(9)[i:i + 2], 16)
+                            for i in range(0, 10, 2))
 
-        if self.cradio.version >= 0.4:
-            self.cradio.set_arc(10)
-        else:
-            logger.warning("Radio version <0.4 will be obsoleted soon!")
-
-        self.cradio.set_channel(channel)
+        if self._link is not None:
+            raise Exception("Link already open!")
 
-        self.cradio.set_data_rate(datarate)
+        self.uri = uri
 
         # Prepare the inter-thread communication queue
         self.in_queue = Queue.Queue()
         # Limited size out queue to avoid "ReadBack" effect
         self.out_queue = Queue.Queue(50)
-
-        # Launch the comm thread
-        self._thread = _RadioDriverThread(self.cradio, self.in_queue,
-                                          self.out_queue,
-                                          link_quality_callback,
-                                          link_error_callback)
-        self._thread.start()
+        self.link_stats.reset()
+        self.link_stats.set_queues(self.in_queue, self.out_queue)
+
+        link = _RadioLink(channel, datarate, address, self.in_queue,
+                          self.out_queue, link_quality_callback,
+                          link_error_callback, batch_size, polling(),
+                          weight, latency_budget, self.link_stats)
+        self._radio = _SharedRadio.open(int(uri_data.group(1)), link)
+        self._link = link
+        self._paused = False
+        self.cradio = self._radio.cradio
 
         self.link_error_callback = link_error_callback
+        self.link_quality_callback = link_quality_callback
 
     def receive_packet(self, time=0):
         """
@@ -155,199 +329,490 @@ class RadioDriver(CRTPDriver):
         """ Send the packet pk though the link """
         # if self.out_queue.full():
         #    self.out_queue.get()
-        if (self.cradio is None):
+        if (self._link is None):
             return
 
         try:
             self.out_queue.put(pk, True, 2)
+            self._radio.wake_up()
         except Queue.Full:
+            self.link_stats.packet_dropped()
             if self.link_error_callback:
                 self.link_error_callback("RadioDriver: Could not send packet"
                                          " to copter")
 
     def pause(self):
-        self._thread.stop()
-        self._thread = None
+        """
+        Stop using the dongle so it can be used directly through cradio.
+        This pauses all the links open on the same dongle. When restarted
+        the link keeps the radio configuration that cradio was left with.
+        """
+        if self._paused:
+            return
+        self._paused = True
+        self._radio.pause()
 
     def restart(self):
-        if self._thread:
+        if not self._paused:
             return
+        self._paused = False
+        self._radio.resume(self._link)
 
-        self._thread = _RadioDriverThread(self.cradio, self.in_queue,
-                                          self.out_queue,
-                                          self.link_quality_callback,
-                                          self.link_error_callback)
-        self._thread.start()
+    def get_cycle_stats(self):
+        """
+        Return a dictionary with statistics about the turns of the link:
+        number of cycles (USB transfers), average and max USB round-trip
+        time, average and max time the link waited for its turn once it
+        had something to send (in seconds), ratio of empty acks, the
+        estimated interval between packets from the Crazyflie (if the
+        polling policy estimates it) and the number of times the dongle
+        had to be reconfigured to switch between links.
+        """
+        if self._link is None:
+            return {}
+        stats = self._link.get_stats()
+        stats["radio_switches"] = self._radio.switches
+        return stats
 
     def close(self):
         """ Close the link. """
-        # Stop the comm thread
-        self._thread.stop()
+        if self._link is None:
+            return
+        # Stop serving the link, the dongle is closed with the last link
+        self._radio.close(self._link, self._paused)
+        self._link = None
+        self._radio = None
+        self._paused = False
+        self.cradio = None
 
-        # Close the USB dongle
+    def scan_interface(self, incremental=False):
+        """
+        Scan interface for Crazyflies, using in parallel all the dongles
+        that are not used by an open link. If incremental is True only the
+        Crazyflies found by the previous scan are looked for, unless none
+        of them answers.
+        """
         try:
-            if self.cradio:
-                self.cradio.close()
-        except:
-            # If we pull out the dongle we will not make this call
-            pass
-        self.cradio = None
+            devices = [(devid, device)
+                       for (devid, device) in enumerate(find_devices())
+                       if devid not in _shared_radios]
+        except Exception:
+            return []
+        if not devices:
+            if _shared_radios:
+                raise Exception("Cannot scann for links while the link is"
+                                " open!")
+            return []
 
-    def _scan_radio_channels(self, start=0, stop=125):
-        """ Scan for Crazyflies between the supplied channels. """
-        return list(self.cradio.scan_channels(start, stop, (0xff,)))
+        return [[uri, ""] for uri in scan_dongles(devices, incremental)]
 
-    def scan_interface(self):
-        """ Scan interface for Crazyflies """
-        if self.cradio is None:
-            try:
-                self.cradio = Crazyradio()
-            except Exception:
-                return []
-        else:
-            raise Exception("Cannot scann for links while the link is open!")
+    def get_status(self):
+        if 0 in _shared_radios:
+            return "Crazyradio version {}".format(
+                _shared_radios[0].cradio.version)
+        try:
+            cradio = Crazyradio()
+        except USBError as e:
+            return "Cannot open Crazyradio. Permission problem?"\
+                   " ({})".format(str(e))
+        except Exception as e:
+            return str(e)
+        version = cradio.version
+        cradio.close()
+
+        return "Crazyradio version {}".format(version)
 
-        # FIXME: implements serial number in the Crazyradio driver!
-        serial = "N/A"
+    def get_name(self):
+        return "radio"
 
-        logger.info("v%s dongle with serial %s found", self.cradio.version,
-                    serial)
-        found = []
 
-        self.cradio.set_arc(1)
+class _RadioLink(object):
+    """State of one link served by a shared dongle"""
 
-        self.cradio.set_data_rate(self.cradio.DR_250KPS)
-        found += map(lambda c: ["radio://0/{}/250K".format(c), ""],
-                     self._scan_radio_channels())
-        self.cradio.set_data_rate(self.cradio.DR_1MPS)
-        found += map(lambda c: ["radio://0/{}/1M".format(c), ""],
-                     self._scan_radio_channels())
-        self.cradio.set_data_rate(self.cradio.DR_2MPS)
-        found += map(lambda c: ["radio://0/{}/2M".format(c), ""],
-                     self._scan_radio_channels())
+    RETRYCOUNT_BEFORE_DISCONNECT = 10
 
-        self.cradio.close()
-        self.cradio = None
+    def __init__(self, channel, datarate, address, in_queue, out_queue,
+                 link_quality_callback, link_error_callback, batch_size,
+                 polling_policy, weight, latency_budget, link_stats):
+        self.radio_config = (channel, datarate, tuple(address))
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.link_quality_callback = link_quality_callback
+        self.link_error_callback = link_error_callback
+        self.batch_size = max(1, batch_size)
+        self.polling_policy = polling_policy
+        self.weight = weight
+        self.latency_budget = latency_budget
+        self.link_stats = link_stats
+        self.retryBeforeDisconnect = self.RETRYCOUNT_BEFORE_DISCONNECT
+        # Packets taken from the out queue that are waiting to be sent
+        self.batch = collections.deque()
+        # Time of the next null packet if there is nothing to send
+        self.next_poll = time.time()
+        # Time the link got something to send, None if it's waiting
+        self.ready_since = None
+        # Credit used for the weighted round-robin
+        self.credit = 0
+
+        self.cycles = 0
+        self.turns = 0
+        self.empty_acks = 0
+        self.usb_time = 0.0
+        self.usb_time_max = 0.0
+        self.turn_latency = 0.0
+        self.turn_latency_max = 0.0
+
+    def is_ready(self, now):
+        """Return True if the link has packets to send or should be
+        polled"""
+        return (now >= self.next_poll or len(self.batch) > 0 or
+                self.out_queue.qsize() > 0)
+
+    def fill_batch(self):
+        """Move up to batch_size packets from the out queue to the
+        batch"""
+        try:
+            while len(self.batch) < self.batch_size:
+                self.batch.append(self.out_queue.get(False))
+        except Queue.Empty:
+            pass
 
-        return found
+    def get_stats(self):
+        """Return a dictionary with the cycle statistics"""
+        cycles = max(self.cycles, 1)
+        turns = max(self.turns, 1)
+        return {"cycles": self.cycles,
+                "usb_time_avg": self.usb_time / cycles,
+                "usb_time_max": self.usb_time_max,
+                "turn_latency_avg": self.turn_latency / turns,
+                "turn_latency_max": self.turn_latency_max,
+                "empty_ack_ratio": float(self.empty_acks) / cycles,
+                "downlink_interval": getattr(self.polling_policy,
+                                             "downlink_interval", None)}
+
+
+class _SharedRadio(object):
+    """
+    A Crazyradio dongle shared by one or more links. The links are served
+    in turns by one thread, reconfiguring the channel, datarate and address
+    of the dongle when switching between them. Links that have waited
+    longer than their latency budget are served first (oldest first),
+    otherwise the links that are ready get turns in a smooth weighted
+    round-robin.
+    """
 
-    def get_status(self):
-        if self.cradio is None:
-            try:
-                self.cradio = Crazyradio()
-            except USBError as e:
-                return "Cannot open Crazyradio. Permission problem?"\
-                       " ({})".format(str(e))
-            except Exception as e:
-                return str(e)
+    def __init__(self, devid, cradio):
+        self.devid = devid
+        self.cradio = cradio
+        self.links = []
+        # Number of times the dongle was reconfigured for another link
+        self.switches = 0
+        self._radio_config = None
+        self._paused = 0
+        self._thread = None
+        self._cond = threading.Condition(threading.Lock())
+        # True while the thread is waiting for a link to get ready
+        self._waiting = False
+
+    @staticmethod
+    def open(devid, link):
+        """Add the link to the dongle, opening it if needed, and return the
+        shared dongle"""
+        with _shared_radios_lock:
+            radio = _shared_radios.get(devid)
+            if radio is None:
+                cradio = Crazyradio(devid=devid)
+                if cradio.version >= 0.4:
+                    cradio.set_arc(10)
+                else:
+                    logger.warning("Radio version <0.4 will be obsoleted"
+                                   " soon!")
+                radio = _SharedRadio(devid, cradio)
+                _shared_radios[devid] = radio
+            radio._add_link(link)
+        return radio
+
+    def close(self, link, paused):
+        """Remove the link, the dongle is closed with the last link"""
+        with _shared_radios_lock:
+            with self._cond:
+                # The list is replaced, not modified, so that the thread can
+                # look at it without locking
+                self.links = [l for l in self.links if l is not link]
+                if paused:
+                    self._paused -= 1
+                last = not self.links
+                self._cond.notify()
+            if self._paused or last:
+                self._stop_thread()
+            elif self._thread is None:
+                self._start_thread()
+            if last:
+                del _shared_radios[self.devid]
+                try:
+                    self.cradio.close()
+                except:
+                    # If we pull out the dongle we will not make this call
+                    pass
+
+    def _add_link(self, link):
+        with self._cond:
+            for other in self.links:
+                if other.radio_config == link.radio_config:
+                    raise Exception("Link already open!")
+            self.links = self.links + [link]
+            self._cond.notify()
+        if self._thread is None and not self._paused:
+            self._start_thread()
+
+    def _start_thread(self):
+        self._thread = _RadioDriverThread(self)
+        self._thread.start()
 
-        return "Crazyradio version {}".format(self.cradio.version)
+    def _stop_thread(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
 
-    def get_name(self):
-        return "radio"
+    def wake_up(self):
+        """Tell the thread that a link might have become ready"""
+        if self._waiting:
+            with self._cond:
+                self._cond.notify()
+
+    def pause(self):
+        """Stop the thread so the dongle can be used directly"""
+        with _shared_radios_lock:
+            self._paused += 1
+            self._stop_thread()
+
+    def resume(self, link):
+        """Restart the thread, the link takes over the current configuration
+        of the dongle"""
+        with _shared_radios_lock:
+            self._paused -= 1
+            link.radio_config = (self.cradio.channel, self.cradio.datarate,
+                                 self.cradio.address)
+            self._radio_config = link.radio_config
+            if not self._paused and self._thread is None:
+                self._start_thread()
+
+    def next_link(self, thread):
+        """Wait for a link to be ready and return it, return None if the
+        thread is stopped"""
+        # A single link that is ready is served without locking
+        links = self.links
+        if len(links) == 1 and not thread.sp:
+            now = time.time()
+            link = links[0]
+            if link.is_ready(now):
+                if link.ready_since is None:
+                    link.ready_since = min(now, link.next_poll)
+                return link
+        with self._cond:
+            while not thread.sp:
+                # Set before looking at the queues so that wake_up() can
+                # not be missed
+                self._waiting = True
+                now = time.time()
+                ready = []
+                next_time = None
+                for link in self.links:
+                    if link.is_ready(now):
+                        if link.ready_since is None:
+                            link.ready_since = min(now, link.next_poll)
+                        ready.append(link)
+                    elif next_time is None or link.next_poll < next_time:
+                        next_time = link.next_poll
+                if ready:
+                    self._waiting = False
+                    return self._pick(ready, now)
+                if next_time is None:
+                    self._cond.wait()
+                else:
+                    self._cond.wait(next_time - now)
+            self._waiting = False
+        return None
+
+    def _pick(self, ready, now):
+        """Pick the next link to serve among the ones that are ready"""
+        if len(ready) == 1:
+            return ready[0]
+        late = None
+        for link in ready:
+            if now - link.ready_since > link.latency_budget:
+                if late is None or link.ready_since < late.ready_since:
+                    late = link
+        if late is not None:
+            return late
+        # Smooth weighted round-robin
+        total = 0
+        best = None
+        for link in ready:
+            link.credit += link.weight
+            total += link.weight
+            if best is None or link.credit > best.credit:
+                best = link
+        best.credit -= total
+        return best
+
+    def configure(self, link):
+        """Set the dongle radio configuration used by the link"""
+        if self._radio_config == link.radio_config:
+            return
+        (channel, datarate, address) = link.radio_config
+        if self._radio_config is None:
+            self._radio_config = (None, None, None)
+        if self._radio_config[0] != channel:
+            self.cradio.set_channel(channel)
+        if self._radio_config[1] != datarate:
+            self.cradio.set_data_rate(datarate)
+        if self._radio_config[2] != address:
+            self.cradio.set_address(address)
+        self._radio_config = link.radio_config
+        self.switches += 1
 
 
 # Transmit/receive radio thread
 class _RadioDriverThread (threading.Thread):
     """
-    Radio link receiver thread used to read data from the
-    Crazyradio USB driver. """
+    Radio link thread serving the links of a shared dongle, used to send
+    and read data using the Crazyradio USB driver. """
 
-    RETRYCOUNT_BEFORE_DISCONNECT = 10
-
-    def __init__(self, cradio, inQueue, outQueue, link_quality_callback,
-                 link_error_callback):
+    def __init__(self, radio):
         """ Create the object """
         threading.Thread.__init__(self)
-        self.cradio = cradio
-        self.in_queue = inQueue
-        self.out_queue = outQueue
+        self.radio = radio
+        self.cradio = radio.cradio
         self.sp = False
-        self.link_error_callback = link_error_callback
-        self.link_quality_callback = link_quality_callback
-        self.retryBeforeDisconnect = self.RETRYCOUNT_BEFORE_DISCONNECT
+        # USB buffers are reused for every packet sent
+        self._null_packet = array.array('B', [0xFF])
+        self._out_buffer = array.array('B', [0xFF])
 
     def stop(self):
         """ Stop the thread """
         self.sp = True
+        with self.radio._cond:
+            self.radio._cond.notify()
         try:
             self.join()
         except Exception:
             pass
 
-    def run(self):
-        """ Run the receiver thread """
-        dataOut = array.array('B', [0xFF])
-        waitTime = 0
-        emptyCtr = 0
+    def _encode(self, pk):
+        """Encode a packet into the USB out buffer"""
+        dataOut = self._out_buffer
+        del dataOut[1:]
+        dataOut[0] = pk.header
+        dataOut.fromstring(buffer(pk.payload))
+        return dataOut
 
+    def run(self):
+        """ Run the radio thread """
         while(True):
-            if (self.sp):
+            link = self.radio.next_link(self)
+            if link is None:
+                break
+
+            try:
+                self.radio.configure(link)
+            except Exception as e:
+                import traceback
+                link.link_error_callback("Error communicating with crazy radio"
+                                         " ,it has probably been unplugged!\n"
+                                         "Exception:%s\n\n%s" % (e,
+                                         traceback.format_exc()))
                 break
+            self._serve(link)
+
+    def _serve(self, link):
+        """Give the link one turn: send its queued packets (at most
+        batch_size) or a null packet to poll the Crazyflie"""
+        now = time.time()
+        latency = now - link.ready_since
+        link.ready_since = None
+        link.turns += 1
+        link.turn_latency += latency
+        if latency > link.turn_latency_max:
+            link.turn_latency_max = latency
+
+        if not link.batch:
+            link.fill_batch()
+
+        gotData = False
+        while(True):
+            if link.batch:
+                # print "-> " + outPacket.__str__()
+                outPacket = link.batch.popleft()
+                dataOut = self._encode(outPacket)
+            else:
+                outPacket = None
+                dataOut = self._null_packet
 
+            ackStatus = None
             try:
+                cycleStart = time.time()
                 ackStatus = self.cradio.send_packet(dataOut)
+                usbTime = time.time() - cycleStart
+                link.cycles += 1
+                link.usb_time += usbTime
+                link.link_stats.round_trip(usbTime)
+                if usbTime > link.usb_time_max:
+                    link.usb_time_max = usbTime
             except Exception as e:
                 import traceback
-                self.link_error_callback("Error communicating with crazy radio"
+                link.link_error_callback("Error communicating with crazy radio"
                                          " ,it has probably been unplugged!\n"
                                          "Exception:%s\n\n%s" % (e,
                                          traceback.format_exc()))
+                return
 
             # Analise the in data packet ...
             if ackStatus is None:
-                if (self.link_error_callback is not None):
-                    self.link_error_callback("Dongle communication error"
+                if outPacket is not None:
+                    link.batch.appendleft(outPacket)
+                if (link.link_error_callback is not None and not self.sp):
+                    link.link_error_callback("Dongle communication error"
                                              " (ackStatus==None)")
-                continue
+                return
 
-            if (self.link_quality_callback is not None):
-                self.link_quality_callback((10 - ackStatus.retry) * 10)
+            # The link quality is reported once per turn
+            if (link.link_quality_callback is not None and
+                    not link.batch):
+                link.link_quality_callback((10 - ackStatus.retry) * 10)
 
-            # If no copter, retry
+            # If no copter, retry in the next turn
             if ackStatus.ack is False:
-                self.retryBeforeDisconnect = self.retryBeforeDisconnect - 1
-                if (self.retryBeforeDisconnect == 0 and
-                        self.link_error_callback is not None):
-                    self.link_error_callback("Too many packets lost")
-                continue
-            self.retryBeforeDisconnect = self.RETRYCOUNT_BEFORE_DISCONNECT
+                if outPacket is not None:
+                    link.batch.appendleft(outPacket)
+                link.link_stats.packet_lost()
+                link.retryBeforeDisconnect = link.retryBeforeDisconnect - 1
+                if (link.retryBeforeDisconnect == 0 and
+                        link.link_error_callback is not None):
+                    link.link_error_callback("Too many packets lost")
+                return
+            link.retryBeforeDisconnect = link.RETRYCOUNT_BEFORE_DISCONNECT
 
             data = ackStatus.data
-
-            # If there is a copter in range, the packet is analysed and the
-            # next packet to send is prepared
-            if (len(data) > 0):
-                inPacket = CRTPPacket(data[0], list(data[1:]))
+            link.link_stats.ack(ackStatus.retry, len(data) == 0)
+            if outPacket is not None:
+                link.link_stats.packet_out(outPacket)
+
+            # If there is a copter in range, the packet is analysed
+            gotData = len(data) > 0
+            if gotData:
+                inPacket = CRTPPacket(data[0], data[1:])
                 # print "<- " + inPacket.__str__()
-                self.in_queue.put(inPacket)
-                waitTime = 0
-                emptyCtr = 0
+                link.link_stats.packet_in(inPacket)
+                link.in_queue.put(inPacket)
             else:
-                emptyCtr += 1
-                if (emptyCtr > 10):
-                    emptyCtr = 10
-                    # Relaxation time if the last 10 packet where empty
-                    waitTime = 0.01
-                else:
-                    waitTime = 0
+                link.empty_acks += 1
 
-            # get the next packet to send of relaxation (wait 10ms)
-            outPacket = None
-            try:
-                outPacket = self.out_queue.get(True, waitTime)
-            except Queue.Empty:
-                outPacket = None
-
-            dataOut = array.array('B')
+            if not link.batch or self.sp:
+                break
 
-            if outPacket:
-                # print "-> " + outPacket.__str__()
-                dataOut.append(outPacket.header)
-                for X in outPacket.data:
-                    if type(X) == int:
-                        dataOut.append(X)
-                    else:
-                        dataOut.append(ord(X))
-            else:
-                dataOut.append(0xFF)
+        # Poll again after the time given by the polling policy, unless
+        # something is queued before that
+        waitTime = link.polling_policy.get_wait_time(gotData,
+                                                     link.out_queue.qsize())
+        link.next_poll = time.time() + waitTime
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Scanning for Crazyflies using all the Crazyradio dongles at the same time.
+
+The channels of the three datarates are split in chunks that are handed
+out to one thread per dongle, so faster dongles (the ones that can scan
+in firmware) take more of the work. The URIs found by earlier scans are
+remembered and checked first, with one packet each, which is enough when
+doing an incremental scan.
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['scan_dongles']
+
+import logging
+logger = logging.getLogger(__name__)
+
+import re
+import threading
+import Queue
+
+from cflib.drivers.crazyradio import Crazyradio
+
+# Number of channels scanned at a time by a dongle
+SCAN_CHUNK = 32
+# Last channel that can be used by the radio
+MAX_CHANNEL = 125
+
+DATARATES = (("250K", Crazyradio.DR_250KPS),
+             ("1M", Crazyradio.DR_1MPS),
+             ("2M", Crazyradio.DR_2MPS))
+
+DEFAULT_ADDRESS = (0xE7,) * 5
+
+# URIs found by the previous scans
+_seen_uris = []
+_seen_uris_lock = threading.Lock()
+
+_URI_RE = re.compile("^radio://[0-9]+/([0-9]+)/(250K|1M|2M)"
+                     "(/([0-9A-Fa-f]{10}))?$")
+
+
+def _uri(devid, channel, datarate, address=None):
+    """Return the URI of a Crazyflie found with the dongle devid"""
+    uri = "radio://{}/{}/{}".format(devid, channel, datarate)
+    if address is not None:
+        uri += "/" + "".join("%02X" % a for a in address)
+    return uri
+
+
+def _parse_uri(uri):
+    """Return (channel, datarate name, address) for a radio URI or None if
+    the URI can not be checked by a scan"""
+    uri_data = _URI_RE.search(uri)
+    if not uri_data:
+        return None
+    address = None
+    if uri_data.group(4):
+        address = tuple(int(uri_data.group(4)[i:i + 2], 16)
+                        for i in range(0, 10, 2))
+        if address == DEFAULT_ADDRESS:
+            address = None
+    return (int(uri_data.group(1)), uri_data.group(2), address)
+
+
+class _DongleScanThread(threading.Thread):
+    """Scans the chunks of channels, or checks the URIs, taken from a
+    queue using one dongle"""
+
+    def __init__(self, devid, cradio, tasks, found):
+        threading.Thread.__init__(self)
+        self.devid = devid
+        self.cradio = cradio
+        self.tasks = tasks
+        self.found = found
+        self.daemon = True
+
+    def run(self):
+        cradio = self.cradio
+        try:
+            while True:
+                try:
+                    task = self.tasks.get(False)
+                except Queue.Empty:
+                    break
+                (rate_name, rate, start, stop, address) = task
+                if rate != cradio.datarate:
+                    cradio.set_data_rate(rate)
+                # Dongles older than 0.4 have no address set but use the
+                # default one
+                if address is None:
+                    address = DEFAULT_ADDRESS
+                    if cradio.address is None:
+                        address = None
+                if address != cradio.address:
+                    cradio.set_address(address)
+                if address == DEFAULT_ADDRESS:
+                    address = None
+                for channel in cradio.scan_channels(start, stop, (0xff,)):
+                    self.found.append((rate, channel, rate_name, address,
+                                       self.devid))
+        except Exception as e:
+            logger.warning("Error while scanning with a dongle: %s", e)
+
+
+def _run(radios, tasks):
+    """Run the tasks using all the dongles, a list of (devid, Crazyradio),
+    and return what was found, sorted by datarate and channel"""
+    queue = Queue.Queue()
+    for task in tasks:
+        queue.put(task)
+    found = []
+    threads = [_DongleScanThread(devid, cradio, queue, found)
+               for (devid, cradio) in radios]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    found.sort()
+    return [_uri(devid, channel, rate_name, address)
+            for (rate, channel, rate_name, address, devid) in found]
+
+
+def scan_dongles(devices, incremental=False, known=None):
+    """
+    Scan for Crazyflies in parallel using the dongles in devices, a list of
+    (device id, USB device), and return the list of URIs found. The URIs
+    use the id of the dongle that found the Crazyflie (radio://<id>/...).
+
+    The URIs in known (by default the ones found by the previous scans) are
+    checked first. If incremental is True and at least one of them answers
+    only those are returned, otherwise all the channels are scanned.
+    """
+    if known is None:
+        with _seen_uris_lock:
+            known = list(_seen_uris)
+
+    radios = []
+    for (devid, device) in devices:
+        try:
+            cradio = Crazyradio(device=device)
+            cradio.set_arc(1)
+        except Exception as e:
+            logger.warning("Cannot scan using a dongle: %s", e)
+            continue
+        logger.info("Scanning with v%s dongle (%s scan)", cradio.version,
+                    "firmware" if cradio._has_fw_scan() else "PC")
+        radios.append((devid, cradio))
+    if not radios:
+        return []
+
+    try:
+        found = []
+        if known:
+            tasks = []
+            for uri in known:
+                parsed = _parse_uri(uri)
+                if parsed is None:
+                    continue
+                (channel, rate_name, address) = parsed
+                rate = dict(DATARATES)[rate_name]
+                tasks.append((rate_name, rate, channel, channel, address))
+            found = _run(radios, tasks)
+
+        if not incremental or not found:
+            tasks = []
+            for (rate_name, rate) in DATARATES:
+                for start in range(0, MAX_CHANNEL + 1, SCAN_CHUNK):
+                    stop = min(start + SCAN_CHUNK - 1, MAX_CHANNEL)
+                    tasks.append((rate_name, rate, start, stop, None))
+            # The Crazyflies checked first stay at the start of the list,
+            # with the dongle that found them first
+            checked = set(_parse_uri(uri) for uri in found)
+            found += [uri for uri in _run(radios, tasks)
+                      if _parse_uri(uri) not in checked]
+    finally:
+        for (_, cradio) in radios:
+            cradio.close()
+
+    with _seen_uris_lock:
+        _seen_uris[:] = found
+    return found
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Recording of CRTP sessions and a link driver playing them back, used to
+test and benchmark the library and the client offline.
+
+A SessionRecorder records all the packets sent and received by a Crazyflie
+to a session file. Connecting to replay://<path to session file> plays back
+the received packets at the speed they were recorded at, or faster with
+replay://<path>?speed=<factor>, where a speed of 0 plays them back as fast
+as they can be processed.
+
+The replay is kept in step with the stack: a recorded incoming packet is
+not played back until the packets that were sent before it during the
+recording have been sent again (commander packets excepted), so the answers
+to requests never arrive before the requests. Packets that were resent
+since they were not answered in time are recorded as such and not waited
+for. If the stack doesn't send them within SYNC_TIMEOUT the replay
+continues anyway. The replay starts
+when the stack sends its first packet. To replay the connection setup, the
+TOCs have to be downloaded (not found in a cache) both when recording and
+when replaying.
+
+Session file format:
+
+The file starts with the magic bytes "CFSR" and a version byte, followed
+by one record per packet: the time since the previous record in
+microseconds (uint32), a flags byte with bit 7 set for sent packets and bit
+6 set for packets resent by the stack, the header byte, the data length
+(uint8) and the data.
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['ReplayDriver', 'SessionRecorder']
+
+import re
+import time
+import collections
+import Queue
+import struct
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .crtpdriver import CRTPDriver
+from .crtpstack import CRTPPacket, CRTPPort
+from .exceptions import WrongUriType
+
+# Format of the replay URIs, the groups used are 1: path and 3: speed
+_URI_RE = re.compile("^replay://([^?]+)(\\?speed=([0-9]*\\.?[0-9]+))?$")
+
+MAGIC = "CFSR"
+VERSION = 2
+_RECORD = struct.Struct("<IBBB")
+# Set in the flags byte of a record for sent packets
+DIRECTION_OUT = 0x80
+# Set in the flags byte of a record for packets resent by the stack
+RESENT = 0x40
+MAX_DELTA = 0xFFFFFFFF
+
+# Time in seconds to wait for the stack to send the packets that were sent
+# before a received packet, before playing it back anyway
+SYNC_TIMEOUT = 1.0
+# Sent packets that the replay doesn't wait for, since they are not
+# answered and are sent at a rate that depends on the user
+SYNC_IGNORED_PORTS = (CRTPPort.COMMANDER,)
+# Max number of packets played back but not yet received by the stack
+QUEUE_SIZE = 1000
+
+
+def read_session(f):
+    """Read the session in the file f, yield (time in s, out, header, data,
+    resent) for every packet, where out is True for sent packets and resent
+    is True for packets resent by the stack"""
+    if f.read(len(MAGIC) + 1) != MAGIC + chr(VERSION):
+        raise IOError("Not a version %d CRTP session file" % VERSION)
+    t = 0
+    while True:
+        record = f.read(_RECORD.size)
+        if len(record) < _RECORD.size:
+            break
+        (delta, flags, header, length) = _RECORD.unpack(record)
+        data = f.read(length)
+        t += delta / 1000000.0
+        yield (t, bool(flags & DIRECTION_OUT), header, data,
+               bool(flags & RESENT))
+
+
+class SessionRecorder(object):
+    """Records all the packets sent and received by a Crazyflie to a
+    session file"""
+
+    def __init__(self, crazyflie, filename):
+        """Record the session of crazyflie to filename once started"""
+        self._cf = crazyflie
+        self.filename = filename
+        self._file = None
+        self._lock = threading.Lock()
+        self._last = 0
+        self.packets = 0
+        # Packet that is being resent
+        self._resent = None
+
+    def _record(self, pk, flags):
+        with self._lock:
+            if self._file is None:
+                return
+            now = time.time()
+            # The clock might be adjusted, keep the times monotonic
+            delta = int(max(0, now - self._last) * 1000000)
+            self._last = max(now, self._last)
+            data = str(pk.payload)
+            self._file.write(_RECORD.pack(min(delta, MAX_DELTA),
+                                          flags, pk.header & 0xFF, len(data))
+                             + data)
+            self.packets += 1
+
+    def _packet_received(self, pk):
+        self._record(pk, 0)
+
+    def _packet_resent(self, pk):
+        # Called just before packet_sent for the same packet, from the same
+        # thread
+        self._resent = pk
+
+    def _packet_sent(self, pk):
+        if self._resent is pk:
+            self._resent = None
+            self._record(pk, DIRECTION_OUT | RESENT)
+        else:
+            self._record(pk, DIRECTION_OUT)
+
+    def start(self):
+        """Start recording, before opening the link to record the
+        connection setup"""
+        with self._lock:
+            self._file = open(self.filename, "wb")
+            self._file.write(MAGIC + chr(VERSION))
+            self._last = time.time()
+            self.packets = 0
+        self._cf.packet_received.add_callback(self._packet_received)
+        self._cf.packet_resent.add_callback(self._packet_resent)
+        self._cf.packet_sent.add_callback(self._packet_sent)
+
+    def stop(self):
+        """Stop recording and close the file, does nothing if not
+        recording"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        self._cf.packet_received.remove_callback(self._packet_received)
+        self._cf.packet_resent.remove_callback(self._packet_resent)
+        self._cf.packet_sent.remove_callback(self._packet_sent)
+
+
+class ReplayDriver(CRTPDriver):
+    """ Link driver playing back a recorded session """
+
+    def __init__(self):
+        """ Create the link driver """
+        CRTPDriver.__init__(self)
+        self.path = None
+        self.speed = 1.0
+        self.in_queue = None
+        self._thread = None
+
+    def connect(self, uri, linkQualityCallback, linkErrorCallback):
+        """
+        Connect the link driver to a specified URI of the format:
+        replay://<path>[?speed=<factor>]
+
+        The speed defaults to 1, 0 plays the session back as fast as
+        possible.
+        """
+        if not re.search("^replay://", uri):
+            raise WrongUriType("Not a replay URI")
+
+        uri_data = _URI_RE.search(uri)
+        if not uri_data:
+            raise Exception("Invalid replay URI")
+
+        self.path = uri_data.group(1)
+        if uri_data.group(3):
+            self.speed = float(uri_data.group(3))
+        session = open(self.path, "rb")
+
+        self.in_queue = Queue.Queue(QUEUE_SIZE)
+        self.link_stats.set_queues(self.in_queue, None)
+        self._thread = _ReplayThread(session, self.speed, self.in_queue,
+                                     linkErrorCallback)
+        self._thread.start()
+
+    def receive_packet(self, time=0):
+        """
+        Receive a packet though the link. This call is blocking but will
+        timeout and return None if a timeout is supplied.
+        """
+        try:
+            if time == 0:
+                pk = self.in_queue.get(False)
+            elif time < 0:
+                pk = self.in_queue.get(True)
+            else:
+                pk = self.in_queue.get(True, time)
+        except Queue.Empty:
+            return None
+        self.link_stats.packet_in(pk)
+        return pk
+
+    def send_packet(self, pk):
+        """ Send the packet pk, it's only used to keep the replay in step
+        with the stack """
+        self.link_stats.packet_out(pk)
+        if pk.port not in SYNC_IGNORED_PORTS:
+            self._thread.sent(pk.header & 0xFF, str(pk.payload))
+
+    def close(self):
+        """ Close the link. """
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+
+    def get_status(self):
+        """Return Finished when all the packets have been played back"""
+        if self._thread is not None and self._thread.finished:
+            return "Finished"
+        return "Ok"
+
+    def get_name(self):
+        return "replay"
+
+    def scan_interface(self, incremental=False):
+        return []
+
+
+def _take(counter, key):
+    """Remove one of key from the Counter counter, return False if there
+    was none"""
+    count = counter[key]
+    if not count:
+        return False
+    if count == 1:
+        del counter[key]
+    else:
+        counter[key] = count - 1
+    return True
+
+
+class _ReplayThread(threading.Thread):
+    """Thread reading the session and putting the received packets in the
+    in queue when it's time"""
+
+    def __init__(self, session, speed, in_queue, link_error_callback):
+        threading.Thread.__init__(self, name="Replay")
+        self.setDaemon(True)
+        self._session = session
+        self._speed = speed
+        self._in_queue = in_queue
+        self._link_error_callback = link_error_callback
+        self._cond = threading.Condition(threading.Lock())
+        # Packets recorded as sent that the stack hasn't sent yet, and
+        # packets sent by the stack that the replay hasn't reached yet.
+        # Counters, the same packet can be sent several times in a row.
+        self._waiting = collections.Counter()
+        self._sent = collections.Counter()
+        # The stack has sent its first packet
+        self._started = False
+        self.finished = False
+        self.sp = False
+
+    def stop(self):
+        with self._cond:
+            self.sp = True
+            self._cond.notify()
+        self.join()
+
+    def sent(self, header, data):
+        """Called for every packet sent by the stack"""
+        key = (header, data)
+        with self._cond:
+            if not self._started:
+                self._started = True
+                self._cond.notify()
+            if _take(self._waiting, key):
+                if not self._waiting:
+                    self._cond.notify()
+            else:
+                self._sent[key] += 1
+
+    def _sync(self):
+        """Wait until the stack has sent the packets recorded so far, return
+        True if it did so in time"""
+        with self._cond:
+            # The session starts when the stack sends its first packet
+            while self._waiting and not self._started and not self.sp:
+                self._cond.wait(0.1)
+            deadline = time.time() + SYNC_TIMEOUT
+            while self._waiting and not self.sp:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning("Replay out of step, %d sent packets "
+                                   "missing", sum(self._waiting.values()))
+                    self._waiting.clear()
+                    self._sent.clear()
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _put(self, pk):
+        while not self.sp:
+            try:
+                self._in_queue.put(pk, True, 0.1)
+                return
+            except Queue.Full:
+                continue
+
+    def run(self):
+        try:
+            start = time.time()
+            for (t, out, header, data, resent) in read_session(
+                    self._session):
+                if self.sp:
+                    break
+                if out:
+                    # The stack only resends when it's slower than the
+                    # Crazyflie, which depends on the timing of the replay
+                    if resent or (header & 0xF0) >> 4 in SYNC_IGNORED_PORTS:
+                        continue
+                    key = (header, data)
+                    with self._cond:
+                        if not _take(self._sent, key):
+                            self._waiting[key] += 1
+                    continue
+                self._sync()
+                if self._speed > 0:
+                    due = start + t / self._speed
+                    now = time.time()
+                    if due < now or not self._started:
+                        # Late (i.e waited for the stack), shift the rest of
+                        # the session to keep the time between the packets
+                        start = now - t / self._speed
+                        due = start + t / self._speed
+                    with self._cond:
+                        while not self.sp and due > now:
+                            self._cond.wait(due - now)
+                            now = time.time()
+                self._put(CRTPPacket(header, data))
+        except Exception as exp:
+            if self._link_error_callback is not None:
+                self._link_error_callback("Error replaying session: %s" % exp)
+        finally:
+            self._session.close()
+            self.finished = True
@@ -25,38 +25,295 @@
 #  along with this program; if not, write to the Free Software
 #  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #  MA  02110-1301, USA.
-
 """
-An early serial link driver. This could still be used (after some fixing) to
-run high-speed CRTP with the Crazyflie. The UART can be run at 2Mbit.
+Serial peer link driver, runs CRTP over a serial port (i.e a UART at
+2Mbit or a pseudo terminal) to a peer using the same framing. Needs
+pyserial.
+
+Every packet is sent as one frame: the two start bytes 0xAA 0x55, the length
+of the packet (header and data), the CRTP header, the data and a checksum
+(the sum of the length, header and data bytes modulo 256). The receiving
+side reads everything that is available at once and decodes all the frames
+in it, resynchronising on the start bytes if a frame is corrupt.
+
+This framing is a host-to-host format for links where both ends run this
+driver, or use encode_frame and FrameDecoder like the simulated copter in
+examples/serialbenchmark.py. It is not the framing of the UART link in the
+Crazyflie firmware, so the driver can't be used to talk to a Crazyflie. To
+make that clear its URIs use the serialpeer:// scheme and not serial://.
 """
 
 __author__ = 'Bitcraze AB'
-__all__ = ['SerialDriver']
+__all__ = ['SerialPeerDriver']
 
 from .crtpdriver import CRTPDriver
+from .crtpstack import CRTPPacket
 
 from .exceptions import WrongUriType
 
+import os
 import re
+import Queue
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+# Format of the serial peer URIs, the groups used are 1: device and 3:
+# baudrate. Device names without a path are looked for in /dev on POSIX
+# systems.
+_URI_RE = re.compile("^serialpeer://([-_./a-zA-Z0-9]+?)(/([0-9]{4,}))?$")
+
+DEFAULT_BAUDRATE = 2000000
+
+START = bytearray((0xAA, 0x55))
+# Max length of a packet (header and data)
+MAX_LENGTH = 32
+# Max number of bytes written to the port at once
+MAX_WRITE = 4096
+
 
+def encode_frame(pk, frame=None):
+    """Encode the packet pk as a frame, appended to the bytearray frame if
+    given. The frame is returned."""
+    if frame is None:
+        frame = bytearray()
+    start = len(frame)
+    frame += START
+    frame.append(len(pk.payload) + 1)
+    frame.append(pk.header)
+    frame += pk.payload
+    # sum() of a bytearray runs in C, a lot faster than a loop in Python
+    frame.append(sum(frame[start + 2:]) & 0xFF)
+    return frame
+
+
+class FrameDecoder(object):
+    """Decodes frames from a stream of bytes"""
 
-class SerialDriver (CRTPDriver):
     def __init__(self):
-        None
+        self._buffer = bytearray()
+        # Number of corrupt frames seen
+        self.errors = 0
+
+    def decode(self, data):
+        """Add the bytes in data and return a list of the packets in the
+        frames that are complete"""
+        buf = self._buffer
+        buf += data
+        packets = []
+        index = 0
+        end = len(buf)
+        while True:
+            start = buf.find(START, index)
+            if start < 0:
+                # Keep the last byte in case it's the first start byte
+                index = max(index, end - 1)
+                break
+            if start + 3 > end:
+                index = start
+                break
+            length = buf[start + 2]
+            if length < 1 or length > MAX_LENGTH:
+                self.errors += 1
+                index = start + 1
+                continue
+            checksum_index = start + 3 + length
+            if checksum_index >= end:
+                # Wait for the rest of the frame
+                index = start
+                break
+            if sum(buf[start + 2:checksum_index]) & 0xFF != buf[checksum_index]:
+                self.errors += 1
+                index = start + 1
+                continue
+            packets.append(CRTPPacket(buf[start + 3],
+                                      buf[start + 4:checksum_index]))
+            index = checksum_index + 1
+        del buf[:index]
+        return packets
+
+
+class SerialPeerDriver (CRTPDriver):
+    """ Serial link driver for peers using the same framing (not a
+    Crazyflie) """
+    def __init__(self):
+        CRTPDriver.__init__(self)
+        self.in_queue = None
+        self.out_queue = None
+        self._serial = None
+        self._receive_thread = None
+        self._send_thread = None
+        self._link_error_callback = None
 
     def connect(self, uri, linkQualityCallback, linkErrorCallback):
-        #check if the URI is a serial URI
-        if not re.search("^serial://", uri):
-            raise WrongUriType("Not a serial URI")
+        """
+        Connect the link driver to a specified URI of the format:
+        serialpeer://<device>[/<baudrate>]
+
+        The device is i.e ttyUSB0 (/dev/ttyUSB0), /dev/pts/3 or COM3. The
+        baudrate defaults to 2000000.
+        """
+        #check if the URI is a serial peer URI
+        if not re.search("^serialpeer://", uri):
+            raise WrongUriType("Not a serial peer URI")
 
-        #Check if it is a valid serial URI
-        uriRe = re.search("^serial://([a-z A-Z 0-9]+)/?([0-9]+)?$", uri)
+        #Check if it is a valid serial peer URI
+        uriRe = _URI_RE.search(uri)
         if not uriRe:
-            raise Exception("Invalid serial URI")
+            raise Exception("Invalid serial peer URI")
+
+        if serial is None:
+            raise Exception("The serial peer driver needs pyserial")
+
+        device = uriRe.group(1)
+        if os.name == "posix" and not device.startswith("/"):
+            device = "/dev/" + device
+        baudrate = DEFAULT_BAUDRATE
+        if uriRe.group(3):
+            baudrate = int(uriRe.group(3))
+
+        self._serial = serial.Serial(device, baudrate, timeout=0.1)
+        self._link_error_callback = linkErrorCallback
+
+        self.in_queue = Queue.Queue()
+        self.out_queue = Queue.Queue()
+        self.link_stats.set_queues(self.in_queue, self.out_queue)
+
+        self._receive_thread = _SerialReceiveThread(self._serial,
+                                                    self.in_queue,
+                                                    self._link_error)
+        self._receive_thread.start()
+        self._send_thread = _SerialSendThread(self._serial, self.out_queue,
+                                              self._link_error)
+        self._send_thread.start()
+
+    def _link_error(self, message):
+        callback = self._link_error_callback
+        # Only report the first error
+        self._link_error_callback = None
+        if callback is not None:
+            callback(message)
+
+    def receive_packet(self, time=0):
+        """
+        Receive a packet though the link. This call is blocking but will
+        timeout and return None if a timeout is supplied.
+        """
+        try:
+            if time == 0:
+                pk = self.in_queue.get(False)
+            elif time < 0:
+                pk = self.in_queue.get(True)
+            else:
+                pk = self.in_queue.get(True, time)
+        except Queue.Empty:
+            return None
+        self.link_stats.packet_in(pk)
+        return pk
+
+    def send_packet(self, pk):
+        """ Send the packet pk though the link """
+        self.link_stats.packet_out(pk)
+        self.out_queue.put(pk)
+
+    def close(self):
+        """ Close the link. """
+        self._link_error_callback = None
+        if self._send_thread is not None:
+            self._send_thread.stop()
+            self._send_thread = None
+        if self._receive_thread is not None:
+            self._receive_thread.stop()
+            self._receive_thread = None
+        if self._serial is not None:
+            self._serial.close()
+            self._serial = None
+
+    def get_status(self):
+        if serial is None:
+            return "pyserial not found"
+        return "Ok"
 
     def get_name(self):
-        return "serial"
+        return "serialpeer"
 
-    def scan_interface(self):
+    def scan_interface(self, incremental=False):
         return []
+
+
+class _SerialReceiveThread(threading.Thread):
+    """Thread reading from the serial port and putting the decoded packets
+    in the in queue"""
+
+    def __init__(self, port, in_queue, link_error_callback):
+        threading.Thread.__init__(self, name="SerialReceive")
+        self.setDaemon(True)
+        self._port = port
+        self._in_queue = in_queue
+        self._link_error_callback = link_error_callback
+        self._decoder = FrameDecoder()
+        self.sp = False
+
+    def stop(self):
+        self.sp = True
+        self.join()
+
+    def run(self):
+        while not self.sp:
+            try:
+                # Read all there is, or wait (up to the timeout of the port)
+                # for the next byte
+                data = self._port.read(self._port.in_waiting or 1)
+            except Exception as exp:  # pylint: disable=W0703
+                if not self.sp:
+                    self._link_error_callback("Error reading from the serial"
+                                              " port: %s" % exp)
+                break
+            if data:
+                errors = self._decoder.errors
+                for pk in self._decoder.decode(data):
+                    self._in_queue.put(pk)
+                if self._decoder.errors != errors:
+                    logger.warning("Dropped %d corrupt frames",
+                                   self._decoder.errors - errors)
+
+
+class _SerialSendThread(threading.Thread):
+    """Thread writing the packets in the out queue to the serial port, all
+    the queued packets are written at once"""
+
+    def __init__(self, port, out_queue, link_error_callback):
+        threading.Thread.__init__(self, name="SerialSend")
+        self.setDaemon(True)
+        self._port = port
+        self._out_queue = out_queue
+        self._link_error_callback = link_error_callback
+        self.sp = False
+
+    def stop(self):
+        self.sp = True
+        self.join()
+
+    def run(self):
+        while not self.sp:
+            try:
+                frames = encode_frame(self._out_queue.get(True, 0.1))
+            except Queue.Empty:
+                continue
+            try:
+                while len(frames) < MAX_WRITE:
+                    encode_frame(self._out_queue.get(False), frames)
+            except Queue.Empty:
+                pass
+            try:
+                self._port.write(frames)
+            except Exception as exp:  # pylint: disable=W0703
+                self._link_error_callback("Error writing to the serial port:"
+                                          " %s" % exp)
+                break
@@ -25,7 +25,6 @@
 #  along with this program; if not, write to the Free Software
 #  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #  MA  02110-1301, USA.
-
 """ CRTP UDP Driver. Work either with the UDP server or with an UDP device
 See udpserver.py for the protocol"""
 
@@ -38,68 +37,319 @@ from .crtpstack import CRTPPacket
 from .exceptions import WrongUriType
 import Queue
 import re
-import struct
-from socket import socket
+import errno
+import select
+import socket
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Format of the UDP URIs, the groups used are 1: host, 3: port and
+# 5: options
+_URI_RE = re.compile("^udp://([^:/?]*)(:([0-9]+))?/?"
+                     "(\\?([a-z]+=[a-z0-9]+(&[a-z]+=[a-z0-9]+)*))?$")
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 7777
+
+# Header of the control datagrams sent to the server, followed by the
+# command and the checksum
+CONTROL_HEADER = 0xFF
+CONTROL_CHANNEL = 0x01
+CMD_CONNECT = 0x01
+CMD_DISCONNECT = 0x02
+CMD_CONNECT_BATCHED = 0x03
+
+# Max number of packets in a batched datagram
+MAX_BATCH = 255
+# Max size of the data of a CRTP packet
+MAX_PAYLOAD = 31
+# Max size of a datagram: a batch of MAX_BATCH packets with full data, each
+# with its length and header, followed by the checksum
+MAX_DATAGRAM = MAX_BATCH * (2 + MAX_PAYLOAD) + 1
+
+
+def checksum(data):
+    """Return the checksum of data (a bytearray), the sum of the bytes
+    modulo 256"""
+    # sum() of a bytearray runs in C, a lot faster than a loop in Python
+    return sum(data) & 0xFF
+
+
+def control_datagram(cmd):
+    """Return the control datagram for the command cmd"""
+    data = bytearray((CONTROL_HEADER, CONTROL_CHANNEL, cmd))
+    data.append(checksum(data))
+    return data
+
+
+def encode_packet(pk):
+    """Return a datagram with the packet pk"""
+    data = bytearray((pk.header,))
+    data += pk.payload
+    data.append(checksum(data))
+    return data
+
+
+def encode_batch(packets):
+    """Return a batched datagram with the packets"""
+    data = bytearray()
+    for pk in packets:
+        data.append(len(pk.payload))
+        data.append(pk.header)
+        data += pk.payload
+    data.append(checksum(data))
+    return data
+
+
+def decode_datagram(datagram, batched):
+    """Return the packets in the datagram (a string or bytearray) as a
+    list, the list is empty if the datagram is corrupt"""
+    data = bytearray(datagram)
+    if len(data) < 2 or checksum(data[:-1]) != data[-1]:
+        return []
+    if not batched:
+        return [CRTPPacket(data[0], data[1:-1])]
+    packets = []
+    index = 0
+    end = len(data) - 1
+    while index < end:
+        length = data[index]
+        if index + 2 + length > end:
+            # Bad length
+            return []
+        packets.append(CRTPPacket(data[index + 1],
+                                  data[index + 2:index + 2 + length]))
+        index += 2 + length
+    return packets
+
+
+def is_control(data, cmd=None):
+    """Return True if the datagram data (a bytearray) is a control datagram
+    (with the command cmd if given)"""
+    return (len(data) == 4 and data[0] == CONTROL_HEADER and
+            data[1] == CONTROL_CHANNEL and data[3] == checksum(data[:3]) and
+            (cmd is None or data[2] == cmd))
 
 
 class UdpDriver(CRTPDriver):
-    def __init__(self):
-        None
+    """ UDP link driver """
+    def __init__(self, batch_size=1):
+        """ Create the link driver
+
+        batch_size -- Max number of queued packets that are sent in one
+                      datagram, can also be set for one link using the
+                      batch option of the URI
+        """
+        CRTPDriver.__init__(self)
+        self.batch_size = batch_size
+        self.addr = None
+        self.in_queue = None
+        self.out_queue = None
+        self._socket = None
+        self._receive_thread = None
+        self._send_thread = None
+        self._link_error_callback = None
+
+    def new_link(self):
+        return UdpDriver(self.batch_size)
 
     def connect(self, uri, linkQualityCallback, linkErrorCallback):
-        #check if the URI is a radio URI
+        """
+        Connect the link driver to a specified URI of the format:
+        udp://[<host>][:<port>][?<options>]
+
+        The host defaults to localhost and the port to 7777. The option
+        batch (max number of packets sent in one datagram) can be given as
+        batch=<n>. Batching has to be supported by the other end.
+        """
+        #check if the URI is a UDP URI
         if not re.search("^udp://", uri):
             raise WrongUriType("Not an UDP URI")
 
-        self.queue = Queue.Queue()
-        self.socket = socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.addr = ("localhost", 7777)
-        self.socket.connect(self.addr)
+        uri_data = _URI_RE.search(uri)
+        if not uri_data:
+            raise Exception("Invalid UDP URI")
+
+        batch_size = self.batch_size
+        if uri_data.group(5):
+            for option in uri_data.group(5).split("&"):
+                (name, value) = option.split("=")
+                if name == "batch" and value.isdigit():
+                    batch_size = int(value)
+                else:
+                    raise Exception("Invalid UDP URI option [%s]" % option)
+        batch_size = min(max(1, batch_size), MAX_BATCH)
+
+        host = uri_data.group(1) or DEFAULT_HOST
+        port = DEFAULT_PORT
+        if uri_data.group(3):
+            port = int(uri_data.group(3))
+        self.addr = (host, port)
+        self._link_error_callback = linkErrorCallback
+
+        self.in_queue = Queue.Queue()
+        if batch_size > 1:
+            self.out_queue = Queue.Queue()
+        self.link_stats.set_queues(self.in_queue, self.out_queue)
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Only receive datagrams from the server
+        self._socket.connect(self.addr)
 
         #Add this to the server clients list
-        self.socket.sendto("\xFF\x01\x01\x01", self.addr)
+        if batch_size > 1:
+            self._socket.send(control_datagram(CMD_CONNECT_BATCHED))
+        else:
+            self._socket.send(control_datagram(CMD_CONNECT))
 
-    def receive_packet(self, time=0):
-        data, addr = self.socket.recvfrom(1024)
+        self._receive_thread = _UdpReceiveThread(self._socket, batch_size > 1,
+                                                 self.in_queue,
+                                                 self._link_error)
+        self._receive_thread.start()
+        if batch_size > 1:
+            self._send_thread = _UdpSendThread(self._socket, batch_size,
+                                               self.out_queue,
+                                               self._link_error)
+            self._send_thread.start()
 
-        if data:
-            data = struct.unpack('b' * (len(data) - 1), data[0:len(data) - 1])
-            pk = CRTPPacket()
-            pk.port = data[0]
-            pk.data = data[1:]
-            return pk
+    def _link_error(self, message):
+        callback = self._link_error_callback
+        # Only report the first error
+        self._link_error_callback = None
+        if callback is not None:
+            callback(message)
 
+    def receive_packet(self, time=0):
+        """
+        Receive a packet though the link. This call is blocking but will
+        timeout and return None if a timeout is supplied.
+        """
         try:
             if time == 0:
-                return self.rxqueue.get(False)
+                pk = self.in_queue.get(False)
             elif time < 0:
-                while True:
-                    return self.rxqueue.get(True, 10)
+                pk = self.in_queue.get(True)
             else:
-                return self.rxqueue.get(True, time)
+                pk = self.in_queue.get(True, time)
         except Queue.Empty:
             return None
+        self.link_stats.packet_in(pk)
+        return pk
 
     def send_packet(self, pk):
-        raw = (pk.port,) + struct.unpack("B"* len(pk.data), pk.data)
-
-        cksum = 0
-        for i in raw:
-            cksum += i
-
-        cksum %= 256
-
-        data = ''.join(chr(v) for v in (raw + (cksum,)))
-
-        #print tuple(data)
-        self.socket.sendto(data, self.addr)
+        """ Send the packet pk though the link """
+        self.link_stats.packet_out(pk)
+        if self.out_queue is not None:
+            self.out_queue.put(pk)
+            return
+        try:
+            self._socket.send(encode_packet(pk))
+        except socket.error as exp:
+            self._link_error("Error sending to [%s:%d]: %s" %
+                             (self.addr + (exp,)))
 
     def close(self):
-        #Remove this to the server clients list
-        self.socket.sendto("\xFF\x01\x02\x02", self.addr)
+        """ Close the link. """
+        self._link_error_callback = None
+        if self._send_thread is not None:
+            self._send_thread.stop()
+            self._send_thread = None
+        if self._receive_thread is not None:
+            self._receive_thread.stop()
+            self._receive_thread = None
+        if self._socket is not None:
+            #Remove this to the server clients list
+            try:
+                self._socket.send(control_datagram(CMD_DISCONNECT))
+            except socket.error:
+                pass
+            self._socket.close()
+            self._socket = None
+
+    def get_status(self):
+        return "Ok"
 
     def get_name(self):
         return "udp"
 
-    def scan_interface(self):
+    def scan_interface(self, incremental=False):
         return []
+
+
+class _UdpReceiveThread(threading.Thread):
+    """Thread receiving the datagrams from the server and putting the
+    packets in the in queue"""
+
+    def __init__(self, sock, batched, in_queue, link_error_callback):
+        threading.Thread.__init__(self, name="UdpReceive")
+        self.setDaemon(True)
+        self._socket = sock
+        self._batched = batched
+        self._in_queue = in_queue
+        self._link_error_callback = link_error_callback
+        self.sp = False
+
+    def stop(self):
+        self.sp = True
+        self.join()
+
+    def run(self):
+        while not self.sp:
+            try:
+                # Wake up regularly to check if the thread should stop
+                (readable, _, _) = select.select([self._socket], [], [], 0.1)
+                if not readable:
+                    continue
+                datagram = self._socket.recv(MAX_DATAGRAM)
+            except (select.error, socket.error) as exp:
+                if self.sp:
+                    break
+                if getattr(exp, "errno", None) == errno.ECONNREFUSED:
+                    # Got an ICMP port unreachable for a datagram we sent
+                    self._link_error_callback("Nothing is listening on the"
+                                              " UDP port")
+                    break
+                self._link_error_callback("Error receiving UDP data: %s" %
+                                          exp)
+                break
+            packets = decode_datagram(datagram, self._batched)
+            if not packets:
+                logger.warning("Dropping corrupt datagram")
+            for pk in packets:
+                self._in_queue.put(pk)
+
+
+class _UdpSendThread(threading.Thread):
+    """Thread sending the packets in the out queue, up to batch_size in one
+    datagram"""
+
+    def __init__(self, sock, batch_size, out_queue, link_error_callback):
+        threading.Thread.__init__(self, name="UdpSend")
+        self.setDaemon(True)
+        self._socket = sock
+        self._batch_size = batch_size
+        self._out_queue = out_queue
+        self._link_error_callback = link_error_callback
+        self.sp = False
+
+    def stop(self):
+        self.sp = True
+        self.join()
+
+    def run(self):
+        while not self.sp:
+            packets = []
+            try:
+                packets.append(self._out_queue.get(True, 0.1))
+                while len(packets) < self._batch_size:
+                    packets.append(self._out_queue.get(False))
+            except Queue.Empty:
+                if not packets:
+                    continue
+            try:
+                self._socket.send(encode_batch(packets))
+            except socket.error as exp:
+                self._link_error_callback("Error sending UDP data: %s" % exp)
+                break
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+"""
+UDP server simulating Crazyflies, used to test the library (and load test
+it with many links) without any hardware. Every client connecting to the
+server gets its own simulated Crazyflie, run by the debug driver. Start it
+from the lib directory with:
+
+    python -m cflib.crtp.udpserver [--port 7777] [--copter debug://0/0]
+
+and connect to udp://localhost:7777.
+
+Protocol:
+
+All datagrams end with a checksum byte, the sum of the other bytes modulo
+256. A client registers with the server by sending the control datagram
+0xFF 0x01 <cmd> <checksum>, where cmd is 0x01 to connect or 0x03 to
+connect with batching, and unregisters with cmd 0x02.
+
+Without batching a datagram holds one CRTP packet: the header byte followed
+by the data. With batching a datagram holds one or more packets, each
+encoded as the length of the data, the header byte and the data. Batching
+is used in both directions.
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['UdpServer']
+
+import socket
+import select
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+from .debugdriver import DebugDriver
+from .udpdriver import (DEFAULT_PORT, MAX_BATCH, MAX_DATAGRAM, CMD_CONNECT,
+                        CMD_CONNECT_BATCHED, CMD_DISCONNECT, decode_datagram,
+                        encode_batch, encode_packet, is_control)
+
+
+class UdpServer(object):
+    """Serves simulated Crazyflies over UDP"""
+
+    def __init__(self, host="localhost", port=DEFAULT_PORT,
+                 copter_uri="debug://0/0"):
+        """
+        host, port -- Address the server listens on
+        copter_uri -- URI of the debug driver used for the simulated
+                      Crazyflies, i.e debug://0/3 adds random delays
+        """
+        self.addr = (host, port)
+        self.copter_uri = copter_uri
+        self._socket = None
+        self._clients = {}
+        self.sp = False
+
+    def serve_forever(self):
+        """Serve the clients until stop is called"""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(self.addr)
+        logger.info("Serving simulated Crazyflies on %s:%d", *self.addr)
+        try:
+            while not self.sp:
+                (readable, _, _) = select.select([self._socket], [], [], 0.1)
+                if not readable:
+                    continue
+                try:
+                    (datagram, addr) = self._socket.recvfrom(MAX_DATAGRAM)
+                except socket.error as exp:
+                    # i.e a port unreachable from a client that went away
+                    logger.debug("Error receiving: %s", exp)
+                    continue
+                self._handle_datagram(bytearray(datagram), addr)
+        finally:
+            for client in self._clients.values():
+                client.stop()
+            self._clients = {}
+            self._socket.close()
+
+    def stop(self):
+        """Make serve_forever return"""
+        self.sp = True
+
+    def get_client_count(self):
+        return len(self._clients)
+
+    def _handle_datagram(self, data, addr):
+        client = self._clients.get(addr)
+        if is_control(data, CMD_CONNECT) or is_control(data,
+                                                        CMD_CONNECT_BATCHED):
+            if client is not None:
+                client.stop()
+            client = _Client(self._socket, addr, self.copter_uri,
+                             is_control(data, CMD_CONNECT_BATCHED))
+            self._clients[addr] = client
+            client.start()
+            logger.info("Client %s:%d connected", *addr)
+        elif is_control(data, CMD_DISCONNECT):
+            if client is not None:
+                client.stop()
+                del self._clients[addr]
+                logger.info("Client %s:%d disconnected", *addr)
+        elif client is not None:
+            packets = decode_datagram(data, client.batched)
+            if not packets:
+                logger.warning("Dropping corrupt datagram from %s:%d", *addr)
+            for pk in packets:
+                client.copter.send_packet(pk)
+        else:
+            logger.debug("Dropping datagram from unknown client %s:%d",
+                         *addr)
+
+
+class _Client(threading.Thread):
+    """A client of the server and its simulated Crazyflie, the thread sends
+    the packets from the Crazyflie to the client"""
+
+    def __init__(self, sock, addr, copter_uri, batched):
+        threading.Thread.__init__(self, name="UdpClient")
+        self.setDaemon(True)
+        self._socket = sock
+        self.addr = addr
+        self.batched = batched
+        self.copter = DebugDriver()
+        self.copter.connect(copter_uri, None, None)
+        self.sp = False
+
+    def stop(self):
+        self.sp = True
+        self.join()
+        self.copter.close()
+
+    def run(self):
+        while not self.sp:
+            pk = self.copter.receive_packet(0.1)
+            if pk is None:
+                continue
+            if self.batched:
+                packets = [pk]
+                while len(packets) < MAX_BATCH:
+                    pk = self.copter.receive_packet(0)
+                    if pk is None:
+                        break
+                    packets.append(pk)
+                datagram = encode_batch(packets)
+            else:
+                datagram = encode_packet(pk)
+            try:
+                self._socket.sendto(datagram, self.addr)
+            except socket.error as exp:
+                logger.debug("Error sending to %s:%d: %s",
+                             *(self.addr + (exp,)))
+
+
+def main():
+    """Run the server until interrupted"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="udpserver")
+    parser.add_argument("--host", action="store", dest="host", type=str,
+                        default="localhost",
+                        help="Address to listen on, defaults to localhost")
+    parser.add_argument("-p", "--port", action="store", dest="port",
+                        type=int, default=DEFAULT_PORT,
+                        help="Port to listen on, defaults to %d" %
+                             DEFAULT_PORT)
+    parser.add_argument("-c", "--copter", action="store", dest="copter",
+                        type=str, default="debug://0/0",
+                        help="Debug driver URI used for the simulated"
+                             " Crazyflies, defaults to debug://0/0")
+    parser.add_argument("-d", "--debug", action="store_true", dest="debug",
+                        help="Enable debug output")
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        # Only show the clients connecting and disconnecting, not all the
+        # output from the simulated Crazyflies
+        logging.basicConfig(level=logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    server = UdpServer(args.host, args.port, args.copter)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
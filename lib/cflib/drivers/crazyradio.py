@@ -56,6 +56,12 @@ SET_CONT_CARRIER = 0x20
 SCANN_CHANNELS = 0x21
 LAUNCH_BOOTLOADER = 0xFF
 
+# Scan the channels in the dongle firmware (a lot faster than from the PC).
+# Off by default because of Crazyradio firmware bug #9, that no released
+# firmware is known to fix. Only set it if the firmware of all the dongles
+# used is known to scan correctly.
+USE_FW_SCAN = False
+
 try:
     import usb.core
     pyusb_backend = None
@@ -67,25 +73,53 @@ except:
     pyusb1 = False
 
 
+# Simulated dongles (see cflib.drivers.mockradio) that are listed after the
+# real ones
+_simulated_devices = []
+
+
+def add_simulated_device(device):
+    """Add a simulated dongle device, it will get the device id after the
+    last real dongle. Returns the device id."""
+    _simulated_devices.append(device)
+    return len(_find_devices()) - 1
+
+
+def remove_simulated_devices():
+    """Remove all the simulated dongle devices"""
+    del _simulated_devices[:]
+
+
+def find_devices():
+    """Return the USB devices of all the dongles (real and simulated), the
+    index in the list is the device id"""
+    return _find_devices()
+
+
 def _find_devices():
     """
     Returns a list of CrazyRadio devices currently connected to the computer
     """
     ret = []
 
-    if pyusb1:
-        dev = usb.core.find(idVendor=0x1915, idProduct=0x7777, find_all=1, backend=pyusb_backend)
-        if dev is not None:
-            ret = dev
-    else:
-        busses = usb.busses()
-        for bus in busses:
-            for device in bus.devices:
-                if device.idVendor == CRADIO_VID:
-                    if device.idProduct == CRADIO_PID:
-                        ret += [device, ]
+    try:
+        if pyusb1:
+            dev = usb.core.find(idVendor=0x1915, idProduct=0x7777, find_all=1, backend=pyusb_backend)
+            if dev is not None:
+                ret = list(dev)
+        else:
+            busses = usb.busses()
+            for bus in busses:
+                for device in bus.devices:
+                    if device.idVendor == CRADIO_VID:
+                        if device.idProduct == CRADIO_PID:
+                            ret += [device, ]
+    except Exception:
+        # Without a USB backend only the simulated dongles can be used
+        if not _simulated_devices:
+            raise
 
-    return ret
+    return ret + _simulated_devices
 
 
 class _radio_ack:
@@ -116,6 +150,9 @@ class Crazyradio:
                 raise Exception("Cannot find a Crazyradio Dongle")
 
         self.dev = device
+        self.channel = None
+        self.datarate = None
+        self.address = None
 
         if (pyusb1 is True):
             self.dev.set_configuration(1)
@@ -162,6 +199,7 @@ class Crazyradio:
     def set_channel(self, channel):
         """ Set the radio channel to be used """
         _send_vendor_setup(self.handle, SET_RADIO_CHANNEL, channel, 0, ())
+        self.channel = channel
 
     def set_address(self, address):
         """ Set the radio address to be used"""
@@ -170,10 +208,12 @@ class Crazyradio:
                             " bytes long")
 
         _send_vendor_setup(self.handle, SET_RADIO_ADDRESS, 0, 0, address)
+        self.address = tuple(address)
 
     def set_data_rate(self, datarate):
         """ Set the radio datarate to be used """
         _send_vendor_setup(self.handle, SET_DATA_RATE, datarate, 0, ())
+        self.datarate = datarate
 
     def set_power(self, power):
         """ Set the radio power to be used """
@@ -211,9 +251,9 @@ class Crazyradio:
             _send_vendor_setup(self.handle, SET_CONT_CARRIER, 0, 0, ())
 
     def _has_fw_scan(self):
-        #return self.version >= 0.5
-        # FIXME: Mitigation for Crazyradio firmware bug #9
-        return False
+        # FIXME: Mitigation for Crazyradio firmware bug #9, the firmware
+        # scan is opt-in (see USE_FW_SCAN)
+        return USE_FW_SCAN and self.version >= 0.5
 
     def scan_channels(self, start, stop, packet):
         if self._has_fw_scan():  # Fast firmware-driven scann
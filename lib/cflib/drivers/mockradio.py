@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+
+"""
+Simulated Crazyradio USB dongle with simulated Crazyflies in range.
+
+MockCrazyradioDevice implements the parts of the pyusb device interface
+that are used by the Crazyradio driver, so the complete radio link
+(Crazyradio, RadioDriver and its thread) can be run and benchmarked
+without any hardware. Register a device with
+cflib.drivers.crazyradio.add_simulated_device() and it will be listed after
+the real dongles, i.e it can be opened using a normal radio:// URI.
+"""
+
+__author__ = 'Bitcraze AB'
+__all__ = ['MockCrazyradioDevice', 'SimulatedCopter']
+
+import array
+import time
+import collections
+from threading import Lock
+
+from .crazyradio import Crazyradio
+from .crazyradio import SET_RADIO_CHANNEL, SET_RADIO_ADDRESS, SET_DATA_RATE
+from .crazyradio import SET_RADIO_ARC, SCANN_CHANNELS
+
+DEFAULT_ADDRESS = (0xE7,) * 5
+
+
+class SimulatedCopter(object):
+    """A Crazyflie in range of a MockCrazyradioDevice"""
+
+    def __init__(self, channel=2, datarate=Crazyradio.DR_2MPS,
+                 address=DEFAULT_ADDRESS, downlink=None):
+        """
+        channel, datarate, address -- Radio configuration the copter
+                                      answers on
+        downlink -- If set to a packet (a sequence of bytes starting with
+                    the header) it's sent back in every ack that has no
+                    queued data, used to simulate a saturated downlink
+        """
+        self.channel = channel
+        self.datarate = datarate
+        self.address = tuple(address)
+        self.downlink = downlink
+        self._queue = collections.deque()
+        # Number of non-null packets received and sent by the copter
+        self.packets_received = 0
+        self.packets_sent = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def queue_packet(self, data):
+        """Queue a packet (a sequence of bytes starting with the header) to
+        be sent back in the next ack"""
+        self._queue.append(data)
+
+    def handle_packet(self, data):
+        """Handle a packet from the radio and return the payload of the
+        ack (empty if nothing to send)"""
+        if len(data) > 0 and data[0] != 0xFF:
+            self.packets_received += 1
+            self.bytes_received += len(data)
+        if self._queue:
+            answer = self._queue.popleft()
+        elif self.downlink is not None:
+            answer = self.downlink
+        else:
+            return ()
+        self.packets_sent += 1
+        self.bytes_sent += len(answer)
+        return answer
+
+
+class MockCrazyradioDevice(object):
+    """Simulates the USB device of a Crazyradio dongle"""
+
+    def __init__(self, copters=(), version=0x0052, usb_latency=0.0,
+                 arc_retries=0, air_time=0.0):
+        """
+        copters -- The SimulatedCopters in range of the dongle
+        version -- Dongle firmware version, as the bcdDevice field
+        usb_latency -- Time in seconds each USB transfer round-trip takes
+        arc_retries -- Number of retries reported in every ack
+        air_time -- Time in seconds it takes to send a packet and get the
+                    ack over the radio, also used for every channel of a
+                    firmware scan
+        """
+        self.bcdDevice = version
+        self.usb_latency = usb_latency
+        self.air_time = air_time
+        self.arc_retries = arc_retries
+        self.copters = list(copters)
+        self.channel = 2
+        self.datarate = Crazyradio.DR_2MPS
+        self.address = DEFAULT_ADDRESS
+        self.arc = 3
+        self.transfers = 0
+        self._ack = array.array('B', [0])
+        self._scan_result = ()
+        self._lock = Lock()
+
+    def add_copter(self, copter):
+        """Put one more copter in range of the dongle"""
+        self.copters.append(copter)
+
+    def _copter_in_range(self):
+        """Return the copter answering on the current radio settings"""
+        for copter in self.copters:
+            if (copter.channel == self.channel and
+                    copter.datarate == self.datarate and
+                    copter.address == self.address):
+                return copter
+        return None
+
+    # pyusb device interface used by the Crazyradio driver
+    def set_configuration(self, configuration=None):
+        pass
+
+    def reset(self):
+        pass
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0,
+                      data_or_wLength=None, timeout=None):
+        if self.usb_latency > 0:
+            time.sleep(self.usb_latency)
+        if bmRequestType & 0x80:
+            if bRequest == SCANN_CHANNELS:
+                return array.array('B', self._scan_result[:data_or_wLength])
+            return array.array('B')
+
+        if bRequest == SET_RADIO_CHANNEL:
+            self.channel = wValue
+        elif bRequest == SET_RADIO_ADDRESS:
+            self.address = tuple(data_or_wLength)
+        elif bRequest == SET_DATA_RATE:
+            self.datarate = wValue
+        elif bRequest == SET_RADIO_ARC:
+            self.arc = wValue
+        elif bRequest == SCANN_CHANNELS:
+            found = []
+            for copter in self.copters:
+                if (wValue <= copter.channel <= wIndex and
+                        copter.datarate == self.datarate and
+                        copter.address == self.address):
+                    found.append(copter.channel)
+            self._scan_result = tuple(sorted(set(found)))
+            if self.air_time > 0:
+                time.sleep(self.air_time * (wIndex - wValue + 1))
+        if data_or_wLength is None:
+            return 0
+        return len(data_or_wLength)
+
+    def write(self, endpoint, data, interface=0, timeout=None):
+        if self.air_time > 0:
+            time.sleep(self.air_time)
+        with self._lock:
+            self.transfers += 1
+            copter = self._copter_in_range()
+            if copter is None:
+                self._ack = array.array('B', [0])
+            else:
+                self._ack = array.array('B', [0x01 | self.arc_retries << 4])
+                self._ack.extend(copter.handle_packet(data))
+        return len(data)
+
+    def read(self, endpoint, size, interface=0, timeout=None):
+        if self.usb_latency > 0:
+            time.sleep(self.usb_latency)
+        return self._ack
@@ -28,10 +28,35 @@
 
 """
 Callback objects used in the Crazyflie library
+
+The callbacks are kept in a tuple that is replaced (never modified) when
+callbacks are added or removed, so they can be called from one thread
+while other threads add and remove callbacks, without locking. An
+exception in one callback is logged and doesn't stop the others from being
+called.
+
+For high-rate events (i.e every packet) a callback can be added as batched.
+It's then called periodically from a common thread with a list of the
+argument tuples of the calls made since the last time, instead of once for
+every call.
 """
 
 __author__ = 'Bitcraze AB'
-__all__ = ['Caller']
+__all__ = ['Caller', 'BATCH_INTERVAL', 'BATCH_MAXLEN']
+
+import time
+import traceback
+from collections import deque
+from threading import Thread, Lock, Condition
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Default time in seconds between the calls to batched callbacks
+BATCH_INTERVAL = 0.05
+# Default max number of calls kept for a batched callback between two
+# deliveries, the oldest ones are dropped if it falls behind
+BATCH_MAXLEN = 10000
 
 
 class Caller():
@@ -39,18 +64,159 @@ class Caller():
 
     def __init__(self):
         """ Create the object """
-        self.callbacks = []
+        self.callbacks = ()
+        # The entries of callbacks by registered callback, used to check
+        # for duplicates and find the entry to remove without a scan
+        self._registered = {}
+        # (callback, entry) of the callbacks that can't be hashed (i.e
+        # bound methods of lists), they are rare so they are just scanned
+        self._unhashable = []
+        self._lock = Lock()
+
+    def _find(self, cb):
+        """Return the entry in callbacks of cb or None, the lock must be
+        held"""
+        try:
+            return self._registered.get(cb)
+        except TypeError:
+            for (registered, entry) in self._unhashable:
+                if registered == cb:
+                    return entry
+            return None
+
+    def _register(self, cb, entry):
+        """Add the entry of cb to callbacks, the lock must be held"""
+        try:
+            self._registered[cb] = entry
+        except TypeError:
+            self._unhashable.append((cb, entry))
+        self.callbacks = self.callbacks + (entry,)
 
     def add_callback(self, cb):
         """ Register cb as a new callback. Will not register duplicates. """
-        if ((cb in self.callbacks) is False):
-            self.callbacks.append(cb)
+        with self._lock:
+            if self._find(cb) is None:
+                self._register(cb, cb)
+
+    def add_batched_callback(self, cb, interval=BATCH_INTERVAL,
+                             maxlen=BATCH_MAXLEN):
+        """
+        Register cb as a new batched callback. Every interval seconds cb is
+        called with a list of the argument tuples of the calls made since
+        the last time, if there were any. At most maxlen calls are kept,
+        if cb falls behind the oldest ones are dropped. Will not register
+        duplicates.
+        """
+        with self._lock:
+            if self._find(cb) is not None:
+                return
+            batched = _BatchedCallback(cb, interval, maxlen)
+            self._register(cb, batched)
+        _BatchThread.add(batched)
 
     def remove_callback(self, cb):
-        """ Un-register cb from the callbacks """
-        self.callbacks.remove(cb)
+        """ Un-register cb from the callbacks, raises a ValueError if it's
+        not registered """
+        with self._lock:
+            removed = self._find(cb)
+            if removed is None:
+                raise ValueError("%s is not a registered callback" % (cb,))
+            try:
+                del self._registered[cb]
+            except TypeError:
+                self._unhashable = [u for u in self._unhashable
+                                    if u[1] is not removed]
+            self.callbacks = tuple(c for c in self.callbacks
+                                   if c is not removed)
+        if isinstance(removed, _BatchedCallback):
+            _BatchThread.remove(removed)
 
     def call(self, *args):
         """ Call the callbacks registered with the arguments args """
         for cb in self.callbacks:
-            cb(*args)
+            try:
+                cb(*args)
+            except Exception:  # pylint: disable=W0703
+                # We can't know what will happen in the callbacks, so catch
+                # everything and continue with the others
+                logger.warning("Exception in callback [%s]\n\n%s", cb,
+                               traceback.format_exc())
+
+
+class _BatchedCallback(object):
+    """Collects the calls to a batched callback until they are delivered"""
+
+    def __init__(self, cb, interval, maxlen):
+        self.cb = cb
+        self.interval = interval
+        self.next_delivery = time.time() + interval
+        # Number of calls dropped because maxlen calls were waiting
+        self.dropped = 0
+        self._calls = deque(maxlen=maxlen)
+
+    def __call__(self, *args):
+        calls = self._calls
+        if len(calls) == calls.maxlen:
+            self.dropped += 1
+        # The oldest call is dropped by the deque when it's full
+        calls.append(args)
+
+    def deliver(self):
+        """Call the callback with the calls collected so far"""
+        calls = self._calls
+        # Only take the calls there are now, new ones can be added while
+        # doing this
+        batch = [calls.popleft() for _ in xrange(len(calls))]
+        if batch:
+            try:
+                self.cb(batch)
+            except Exception:  # pylint: disable=W0703
+                logger.warning("Exception in batched callback [%s]\n\n%s",
+                               self.cb, traceback.format_exc())
+
+
+class _BatchThread(Thread):
+    """Thread delivering the calls to all batched callbacks"""
+
+    _lock = Lock()
+    _thread = None
+
+    def __init__(self):
+        Thread.__init__(self, name="BatchedCallbacks")
+        self.setDaemon(True)
+        self._cond = Condition(Lock())
+        self._batched = []
+
+    @classmethod
+    def add(cls, batched):
+        with cls._lock:
+            if cls._thread is None:
+                cls._thread = _BatchThread()
+                cls._thread.start()
+            thread = cls._thread
+        with thread._cond:
+            thread._batched = thread._batched + [batched]
+            thread._cond.notify()
+
+    @classmethod
+    def remove(cls, batched):
+        thread = cls._thread
+        with thread._cond:
+            thread._batched = [b for b in thread._batched if b is not batched]
+
+    def run(self):
+        while True:
+            with self._cond:
+                batched = self._batched
+                if not batched:
+                    self._cond.wait()
+                    continue
+                now = time.time()
+                next_delivery = min(b.next_delivery for b in batched)
+                if next_delivery > now:
+                    self._cond.wait(next_delivery - now)
+                    continue
+            for b in batched:
+                if b.next_delivery <= now:
+                    b.next_delivery = max(b.next_delivery + b.interval, now)
+                    b.deliver()
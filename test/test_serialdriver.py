@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) 2011-2013 Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA  02110-1301, USA.
+"""
+Tests of the framing of the serial peer link driver, and of the driver itself
+over a pseudo terminal (POSIX only, needs pyserial). Run from the root of
+the repository with:
+
+    python -m unittest discover -s test
+"""
+
+import os
+import sys
+import time
+import logging
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "lib"))
+
+from cflib.crtp import serialdriver
+from cflib.crtp.serialdriver import SerialPeerDriver, FrameDecoder
+from cflib.crtp.serialdriver import encode_frame
+from cflib.crtp.crtpstack import CRTPPacket
+from cflib.crtp.exceptions import WrongUriType
+
+# The corrupt frames are logged as warnings
+logging.basicConfig(level=logging.ERROR)
+
+
+def _packets():
+    return [CRTPPacket(0x52, range(31)),
+            CRTPPacket(0x30, [1, 2, 3]),
+            CRTPPacket(0xF3, []),
+            CRTPPacket(0x00, [0xAA, 0x55, 0xAA, 0x55])]
+
+
+class FrameTest(unittest.TestCase):
+
+    def assertPackets(self, packets, expected):
+        self.assertEqual([(pk.header, pk.payload) for pk in packets],
+                         [(pk.header, pk.payload) for pk in expected])
+
+    def test_encode(self):
+        # The link bits (3 and 2) of the header are always set
+        frame = encode_frame(CRTPPacket(0x30, [1, 2, 3]))
+        self.assertEqual(frame, bytearray((0xAA, 0x55, 4, 0x3C, 1, 2, 3,
+                                           (4 + 0x3C + 6) & 0xFF)))
+
+    def test_encode_appends(self):
+        frame = bytearray(b"xy")
+        self.assertIs(encode_frame(CRTPPacket(0x30, [1]), frame), frame)
+        self.assertEqual(frame[:2], b"xy")
+        self.assertEqual(len(frame), 2 + 6)
+
+    def test_round_trip(self):
+        frames = bytearray()
+        for pk in _packets():
+            encode_frame(pk, frames)
+        decoder = FrameDecoder()
+        self.assertPackets(decoder.decode(frames), _packets())
+        self.assertEqual(decoder.errors, 0)
+
+    def test_split(self):
+        frames = bytearray()
+        for pk in _packets():
+            encode_frame(pk, frames)
+        for size in (1, 2, 3, 5, 7):
+            decoder = FrameDecoder()
+            packets = []
+            for i in range(0, len(frames), size):
+                packets += decoder.decode(frames[i:i + size])
+            self.assertPackets(packets, _packets())
+            self.assertEqual(decoder.errors, 0)
+
+    def test_resync_after_garbage(self):
+        decoder = FrameDecoder()
+        frame = encode_frame(CRTPPacket(0x30, [1, 2, 3]))
+        packets = decoder.decode(bytearray(b"\x00\x55\xAA\xAA") + frame)
+        self.assertPackets(packets, [CRTPPacket(0x30, [1, 2, 3])])
+
+    def test_checksum_error(self):
+        decoder = FrameDecoder()
+        corrupt = encode_frame(CRTPPacket(0x30, [1, 2, 3]))
+        corrupt[-1] ^= 0xFF
+        frame = encode_frame(CRTPPacket(0x31, [4]))
+        self.assertPackets(decoder.decode(corrupt + frame),
+                           [CRTPPacket(0x31, [4])])
+        self.assertEqual(decoder.errors, 1)
+
+    def test_corrupt_data(self):
+        decoder = FrameDecoder()
+        corrupt = encode_frame(CRTPPacket(0x30, [1, 2, 3]))
+        corrupt[4] ^= 0x01
+        frame = encode_frame(CRTPPacket(0x31, [4]))
+        self.assertPackets(decoder.decode(corrupt + frame),
+                           [CRTPPacket(0x31, [4])])
+        self.assertEqual(decoder.errors, 1)
+
+    def test_bad_length(self):
+        decoder = FrameDecoder()
+        frame = encode_frame(CRTPPacket(0x31, [4]))
+        for length in (0, serialdriver.MAX_LENGTH + 1):
+            packets = decoder.decode(bytearray((0xAA, 0x55, length)) + frame)
+            self.assertPackets(packets, [CRTPPacket(0x31, [4])])
+        self.assertEqual(decoder.errors, 2)
+
+    def test_truncated_frame(self):
+        # A frame cut short by the start of the next one is dropped, the
+        # next frame is still decoded once it's complete
+        decoder = FrameDecoder()
+        frame = encode_frame(CRTPPacket(0x31, [4]))
+        packets = decoder.decode(encode_frame(CRTPPacket(0x30, range(20)))[:10])
+        packets += decoder.decode(frame)
+        packets += decoder.decode(frame * 3)
+        self.assertEqual([pk.header for pk in packets][-3:], [CRTPPacket(0x31).header] * 3)
+        self.assertTrue(decoder.errors >= 1)
+
+
+class UriTest(unittest.TestCase):
+
+    def test_serial_uri_not_handled(self):
+        # The framing isn't the one of the Crazyflie firmware, so serial://
+        # URIs are left to other drivers
+        self.assertRaises(WrongUriType, SerialPeerDriver().connect,
+                          "serial://ttyUSB0", None, None)
+
+
+@unittest.skipUnless(os.name == "posix" and serialdriver.serial is not None,
+                     "needs a POSIX system and pyserial")
+class PtyLoopbackTest(unittest.TestCase):
+
+    def setUp(self):
+        (self.master, self.slave) = os.openpty()
+        self.errors = []
+        self.driver = SerialPeerDriver()
+        self.driver.connect("serialpeer://" + os.ttyname(self.slave), None,
+                            self.errors.append)
+
+    def tearDown(self):
+        self.driver.close()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def _read_packets(self, count, timeout=2.0):
+        decoder = FrameDecoder()
+        packets = []
+        end = time.time() + timeout
+        while len(packets) < count and time.time() < end:
+            packets += decoder.decode(os.read(self.master, 4096))
+        return packets
+
+    def test_send(self):
+        for pk in _packets():
+            self.driver.send_packet(pk)
+        packets = self._read_packets(len(_packets()))
+        self.assertEqual([(pk.header, pk.payload) for pk in packets],
+                         [(pk.header, pk.payload) for pk in _packets()])
+
+    def test_receive(self):
+        frames = bytearray(b"\x55\x00")
+        for pk in _packets():
+            encode_frame(pk, frames)
+        corrupt = encode_frame(CRTPPacket(0x30, [1]))
+        corrupt[-1] ^= 0xFF
+        frames += corrupt
+        encode_frame(CRTPPacket(0x31, [2]), frames)
+        # Written in two pieces, the receive side has to join the frames
+        os.write(self.master, bytes(frames[:20]))
+        time.sleep(0.05)
+        os.write(self.master, bytes(frames[20:]))
+        packets = []
+        for _ in range(len(_packets()) + 1):
+            pk = self.driver.receive_packet(2.0)
+            self.assertIsNotNone(pk)
+            packets.append((pk.header, pk.payload))
+        self.assertEqual(packets,
+                         [(pk.header, pk.payload) for pk in _packets()] +
+                         [(CRTPPacket(0x31).header, bytearray((2,)))])
+        self.assertIsNone(self.driver.receive_packet(0.1))
+        self.assertEqual(self.errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()